@@ -14,6 +14,7 @@ class Settings(BaseSettings):
     api_title: str = "Keepsake API"
     api_version: str = "1.0.0"
     debug: bool = False
+    metrics_token: str = ""  # Bearer token for /metrics ("" disables the endpoint)
     
     # OpenAI
     openai_api_key: str
@@ -23,11 +24,65 @@ class Settings(BaseSettings):
     supabase_key: str  # Service role key for backend operations
     supabase_jwt_secret: str  # For verifying user JWTs
     
+    # Storage backend: "supabase", or "sqlite" for an embedded single-node database
+    memory_store: str = "supabase"
+    sqlite_path: str = "keepsake.db"
+    
+    # Database I/O
+    db_pool_size: int = 16  # Max concurrent Supabase calls (dedicated I/O threads)
+    db_timeout_seconds: float = 10.0  # Per-call timeout for Supabase round trips
+    
+    # Memory cache (per-process, decoded memory blobs)
+    memory_cache_size: int = 1024  # Max users kept in the LRU
+    memory_cache_ttl_seconds: float = 60.0  # Bounds staleness across workers
+    memory_cas_retries: int = 3  # Re-read/merge attempts after a version conflict
+    memory_cas_merge_seconds: float = 5.0  # Chat saves and fact merges keep retrying this long
+    
+    # Chat history storage: "blob" (inside memories.data) or "table" (chat_messages)
+    history_storage: str = "blob"
+    
+    # Memory blob encoding: "json", or "msgpack-zstd" (needs msgpack + zstandard)
+    memory_encoding: str = "json"
+    memory_codec_dict_path: str = ""  # Shared zstd dictionary from api.tools.train_dict
+    
+    # Fold older messages into a rolling summary once this many sit outside
+    # the prompt window (0 disables)
+    summary_fold_messages: int = 20
+    
+    # Purge expired free-tier facts every N seconds in this process (0 disables;
+    # enable on one worker only, or run api.tools.sweep_facts from cron)
+    fact_sweep_interval_seconds: float = 0.0
+    
+    # Embedding cache: in-process LRU, optionally in front of a local SQLite file
+    # (off unless a path is set, e.g. /var/lib/keepsake/embeddings.db)
+    embedding_cache_size: int = 4096
+    embedding_cache_path: str = ""
+    
+    # Recall vector writes: batched across users, up to N texts or T ms per batch
+    vector_batch_size: int = 64
+    vector_batch_delay_ms: float = 200.0
+    vector_queue_size: int = 10000  # Pending texts beyond this are dropped
+    
+    # Local recall-vector index (read-through cache in front of match_vectors)
+    vector_index_max_mb: float = 64.0  # Matrix memory across all users, growth slack included; 0 disables
+    vector_index_user_max_vectors: int = 1000  # Larger users keep using match_vectors
+    vector_index_ttl_seconds: float = 300.0  # Fetch newer rows so other workers' writes show up
+    
+    # Recall vector storage profile (compare with api.tools.bench_vectors)
+    embedding_dimensions: int = 0  # Shortened text-embedding-3 output; 0: full 1536
+    vector_quantization: str = "float32"  # "float32", "float16" or "int8" (per-vector scale)
+    
+    # Max wait for RAG before a paid turn goes ahead without it (0: no limit)
+    rag_budget_ms: float = 400.0
+    
     # Security
     cors_origins: str = "*"  # Comma-separated list, or "*" for dev
     
-    # Rate Limiting
+    # Rate Limiting (chat requests per user; per-tier overrides in TIER_CONFIG, 0 disables)
     rate_limit_per_minute: int = 30
+    rate_limit_backend: str = "local"  # "local" (per process) or "sqlite" (shared by workers on a host)
+    rate_limit_sqlite_path: str = "ratelimit.db"
+    rate_limit_max_buckets: int = 10000  # Local backend: users tracked at once
     
     class Config:
         env_file = ".env"
@@ -45,6 +100,7 @@ TIER_CONFIG = {
     0: {  # Free
         "name": "Free",
         "message_limit": 15,
+        "rate_limit_per_minute": None,  # Settings.rate_limit_per_minute
         "memory_hours": 48,
         "models": {"default": "gpt-4o-mini", "deep": "gpt-4o-mini"},
         "first_deep_4o": True,  # One-time taste
@@ -54,6 +110,7 @@ TIER_CONFIG = {
     1: {  # Plus
         "name": "Plus", 
         "message_limit": None,  # Unlimited
+        "rate_limit_per_minute": 60,
         "memory_hours": None,  # Permanent
         "models": {"default": "gpt-4o-mini", "deep": "gpt-4o"},
         "first_deep_4o": False,
@@ -63,6 +120,7 @@ TIER_CONFIG = {
     2: {  # Premium
         "name": "Premium",
         "message_limit": None,
+        "rate_limit_per_minute": 120,
         "memory_hours": None,
         "models": {"default": "gpt-4o-mini", "deep": "gpt-4o"},
         "first_deep_4o": False,
@@ -5,10 +5,14 @@ FastAPI backend for the Keepsake companion app.
 Run with: uvicorn api.main:app --reload
 """
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 from api.config import get_settings
+from api.services.memory import memory_service, request_write_stats
+from api.services.ratelimit import rate_limiter
+from api.services.embeddings import embedding_service
+from api.services.sweeper import FactSweeper
 from api.routes import (
     auth_router,
     chat_router,
@@ -16,6 +20,11 @@ from api.routes import (
     memory_router,
     scenes_router
 )
+from api.routes.chat import rag_stats
+from api.routes.deps import require_metrics_token
+
+
+fact_sweeper = FactSweeper(memory_service, interval=get_settings().fact_sweep_interval_seconds)
 
 
 @asynccontextmanager
@@ -25,9 +34,19 @@ async def lifespan(app: FastAPI):
     settings = get_settings()
     print(f"🚀 Keepsake API starting...")
     print(f"   Debug mode: {settings.debug}")
+    if settings.vector_index_max_mb > 0 and not memory_service.vector_index.enabled:
+        print("⚠️  numpy is not installed: the local RAG index is off and every search "
+              "uses match_vectors (pip install -r api/requirements.txt)")
+    if fact_sweeper.interval > 0:
+        fact_sweeper.start()
     yield
     # Shutdown
     print("👋 Keepsake API shutting down...")
+    await fact_sweeper.stop()
+    await memory_service.vector_writer.stop()
+    rate_limiter.close()
+    embedding_service.close()
+    memory_service.store.close()
 
 
 # Initialize FastAPI app
@@ -67,6 +86,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def track_memory_writes(request: Request, call_next):
+    """Report memory writes performed/skipped by this request in response headers."""
+    stats = {"writes": 0, "skipped": 0}
+    request_write_stats.set(stats)
+    response = await call_next(request)
+    # Streaming endpoints save after headers are sent; those land in /metrics only
+    response.headers["X-Memory-Writes"] = str(stats["writes"])
+    response.headers["X-Memory-Writes-Skipped"] = str(stats["skipped"])
+    return response
+
 # Register routers
 app.include_router(auth_router)
 app.include_router(chat_router)
@@ -98,6 +128,22 @@ async def health():
     }
 
 
+@app.get("/metrics", dependencies=[Depends(require_metrics_token)], include_in_schema=False)
+async def metrics():
+    """Internal counters for sizing caches and pools (METRICS_TOKEN as Bearer token)."""
+    return {
+        "memory_cache": memory_service.cache.stats(),
+        "memory_loads": memory_service.get_load_stats(),
+        "memory_writes": memory_service.get_write_stats(),
+        "fact_sweeper": fact_sweeper.stats,
+        "rate_limiter": rate_limiter.stats(),
+        "embeddings": embedding_service.stats(),
+        "vector_writer": {**memory_service.vector_writer.stats, "pending": memory_service.vector_writer.pending()},
+        "vector_index": memory_service.vector_index.stats(),
+        "rag": rag_stats
+    }
+
+
 # For running directly with `python -m api.main`
 if __name__ == "__main__":
     import uvicorn
@@ -61,19 +61,33 @@ class ActiveContext(BaseModel):
     last_recalled_date: str = ""
 
 
+class HistorySummary(BaseModel):
+    """Rolling summary of messages older than the prompt window."""
+    text: str = ""
+    through: str = ""  # Fingerprint of the last folded messages
+    folded: int = 0  # Messages folded in so far
+
+
 class UserFact(BaseModel):
     """A stored fact about the user."""
     content: str
     created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    created_ts: Optional[float] = None  # Epoch seconds; user_facts is sorted by it
 
 
 class UserMemory(BaseModel):
     """Complete user memory state."""
+    schema_version: int = 3
     history: List[Dict[str, str]] = Field(default_factory=list)
     emotional_state: EmotionalState = Field(default_factory=EmotionalState)
     user_profile: UserProfile = Field(default_factory=lambda: UserProfile(name=""))
     active_context: ActiveContext = Field(default_factory=ActiveContext)
+    history_summary: HistorySummary = Field(default_factory=HistorySummary)
     user_facts: List[UserFact] = Field(default_factory=list)
+    expired_facts_count: int = 0
+    user_message_count: int = 0
+    assistant_message_count: int = 0
+    last_extraction_index: int = 0
     balance: int = 100
     inventory: List[str] = Field(default_factory=lambda: ["default"])
     current_outfit: str = "default"
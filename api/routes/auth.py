@@ -50,12 +50,7 @@ async def register(user_data: UserRegister):
             "gender": user_data.gender or "",
             "companion_name": user_data.companion_name
         }
-        await memory_service.create_user_memory(user_id, profile)
-        
-        # Update memory with avatar choice
-        memory = await memory_service.load_memory(user_id)
-        memory['avatar_id'] = user_data.avatar_id
-        await memory_service.save_memory(user_id, memory)
+        await memory_service.create_user_memory(user_id, profile, avatar_id=user_data.avatar_id)
         
         return AuthResponse(
             access_token=auth_response.session.access_token,
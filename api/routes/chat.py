@@ -4,8 +4,9 @@ Handles messaging, streaming responses, and session greetings.
 """
 import asyncio
 import random
+import time
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Tuple
 from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
@@ -14,12 +15,24 @@ from api.config import get_settings, TIER_CONFIG
 from api.models.schemas import (
     ChatRequest, ChatResponse, VibeGreetingRequest, VibeGreetingResponse
 )
-from api.services.ai import ai_service
-from api.services.memory import memory_service
-from api.routes.deps import get_current_user
+from api.services.ai import ai_service, PROMPT_HISTORY_MESSAGES
+from api.services.memory import memory_service, history_fingerprint, record_message, UnavailableMemory
+from api.routes.deps import get_current_user, get_rate_limited_user
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
+# Facts are extracted from every Nth user message
+FACT_EXTRACTION_INTERVAL = 3
+
+# Speculative RAG lookups: started, answered within RAG_BUDGET_MS, or skipped
+rag_stats = {"started": 0, "in_budget": 0, "over_budget": 0}
+
+# Users with a history summary being written by this process
+_summarizing: set = set()
+
+# Error for a turn whose memory write failed (the reply was not kept)
+TURN_NOT_SAVED = "Your message couldn't be saved. Please try again."
+
 
 class StreamChatRequest(BaseModel):
     """Request for streaming chat."""
@@ -29,10 +42,103 @@ class StreamChatRequest(BaseModel):
     is_first_of_session: bool = False
 
 
+class TurnEmbedding:
+    """The user message's embedding, computed once per turn for RAG and the vector store."""
+    
+    def __init__(self, text: str):
+        self.task = asyncio.ensure_future(memory_service.get_embedding(text))
+    
+    async def get(self):
+        # Shield: a RAG lookup cut off by its deadline mustn't cancel it
+        return await asyncio.shield(self.task)
+    
+    def ready(self):
+        """The embedding if it was computed successfully, else None."""
+        if self.task.done() and not self.task.cancelled() and self.task.exception() is None:
+            return self.task.result()
+        return None
+
+
+class SpeculativeRag:
+    """A RAG lookup started early in a turn, then awaited within the latency budget."""
+    
+    def __init__(self, user_id: str, query: str):
+        budget = get_settings().rag_budget_ms
+        self.deadline = time.perf_counter() + budget / 1000 if budget > 0 else None
+        self.embedding = TurnEmbedding(query)
+        self.task = asyncio.ensure_future(self._retrieve(user_id, query))
+        rag_stats["started"] += 1
+    
+    async def _retrieve(self, user_id: str, query: str) -> str:
+        try:
+            embedding = await self.embedding.get()
+        except Exception as e:
+            print(f"RAG retrieval error: {e}")
+            return ""
+        return await memory_service.retrieve_context(user_id, query, embedding=embedding)
+    
+    async def result(self) -> str:
+        """The retrieved context, or "" if it isn't ready by the deadline."""
+        if self.deadline is None:
+            return await self.task
+        try:
+            # Past the deadline this still returns a lookup that already finished.
+            # A late lookup keeps running: it warms the embedding cache and vector index
+            text = await asyncio.wait_for(asyncio.shield(self.task), max(self.deadline - time.perf_counter(), 0))
+        except asyncio.TimeoutError:
+            rag_stats["over_budget"] += 1
+            return ""
+        rag_stats["in_budget"] += 1
+        return text
+
+
+def start_rag(user_id: str, query: str, account: dict) -> Optional[SpeculativeRag]:
+    """Start RAG before the memory load if the user's (cached) tier has it."""
+    if not TIER_CONFIG.get(account.get('tier') or 0, TIER_CONFIG[0]).get('rag_enabled'):
+        return None
+    return SpeculativeRag(user_id, query)
+
+
+async def load_turn_memory(user_id: str) -> dict:
+    """load_memory for a turn, or 503 if it can't be read (its defaults would never be saved)."""
+    memory = await memory_service.load_memory(user_id)
+    if isinstance(memory, UnavailableMemory):
+        raise HTTPException(
+            status_code=503,
+            detail="Your memories couldn't be loaded right now. Please try again."
+        )
+    return memory
+
+
+async def begin_turn(user_id: str, message: str) -> Tuple[dict, Optional[SpeculativeRag], dict]:
+    """
+    Daily message limit first, then RAG and the memory load, so a user over
+    the limit costs no embedding, vector search or memory read.
+    Returns (account, RAG lookup or None, memory).
+    """
+    # Account fields cached by the rate limit check
+    account = await memory_service.load_account(user_id)
+    if not await memory_service.take_message_quota(user_id, account):
+        raise HTTPException(
+            status_code=403,
+            detail="Message limit reached. Upgrade for unlimited conversations."
+        )
+    
+    # Start RAG for paid users now, so it overlaps the memory load
+    rag = start_rag(user_id, message, account)
+    
+    try:
+        memory = await load_turn_memory(user_id)
+    except HTTPException:
+        await memory_service.refund_message_quota(user_id, account)
+        raise
+    return account, rag, memory
+
+
 @router.post("/message")
 async def send_message(
     request: ChatRequest,
-    user: dict = Depends(get_current_user)
+    user: dict = Depends(get_rate_limited_user)
 ):
     """
     Send a message and get AI response (non-streaming).
@@ -40,21 +146,14 @@ async def send_message(
     """
     user_id = user["id"]
     
-    # Load user memory
-    memory = await memory_service.load_memory(user_id)
+    # Quota check, then RAG alongside the memory load (usually cached)
+    account, rag, memory = await begin_turn(user_id, request.message)
     tier = memory.get('tier', 0)
     tier_config = TIER_CONFIG.get(tier, TIER_CONFIG[0])
-    
-    # Check message limit for free tier
-    user_msg_count = len([m for m in memory['history'] if m['role'] == 'user'])
-    if tier_config.get('message_limit') and user_msg_count >= tier_config['message_limit']:
-        raise HTTPException(
-            status_code=403, 
-            detail="Message limit reached. Upgrade for unlimited conversations."
-        )
+    user_msg_count = memory.get('user_message_count', 0)
     
     # Add user message to history
-    memory['history'].append({"role": "user", "content": request.message})
+    record_message(memory, "user", request.message)
     
     # Update emotional state
     memory['emotional_state'] = memory_service.update_emotional_state(
@@ -92,16 +191,17 @@ async def send_message(
     
     # Get facts for context
     valid_facts, expired_count = memory_service.get_valid_facts_with_expiry(
-        memory.get('user_facts', []), tier
+        memory.get('user_facts', []), tier, user_id, getattr(memory, 'version', None)
     )
     facts_text = "\n".join(valid_facts) if valid_facts else "(No stored facts yet)"
     if tier == 0 and valid_facts:
         facts_text += "\n(Free tier: 48-hour memory window)"
     
-    # RAG retrieval for paid users
+    # RAG retrieval for paid users (skipped if it misses the latency budget)
     rag_text = ""
     if tier >= 1 and tier_config.get('rag_enabled'):
-        rag_text = await memory_service.retrieve_context(user_id, request.message)
+        rag = rag or SpeculativeRag(user_id, request.message)
+        rag_text = await rag.result()
     
     # Get emotional value strategy
     value_strategy, value_allows_questions = ai_service.get_emotional_value(
@@ -121,7 +221,8 @@ async def send_message(
         facts_text=facts_text,
         rag_text=rag_text,
         situational_modifiers=value_strategy,
-        time_offset=memory.get('time_offset', 0)
+        time_offset=memory.get('time_offset', 0),
+        history_summary=memory.get('history_summary', {}).get('text', '')
     )
     
     # Determine if questions allowed
@@ -130,16 +231,21 @@ async def send_message(
         should_ask_question = False
     
     # Generate response
-    response = await ai_service.generate_response(
-        system_prompt,
-        memory['history'],
-        model,
-        is_deep,
-        should_ask_question
-    )
+    try:
+        response = await ai_service.generate_response(
+            system_prompt,
+            memory_service.prompt_history(memory, PROMPT_HISTORY_MESSAGES),
+            model,
+            is_deep,
+            should_ask_question
+        )
+    except Exception:
+        # No reply: the message doesn't count against the quota
+        await memory_service.refund_message_quota(user_id, account)
+        raise
     
     # Add response to history
-    memory['history'].append({"role": "assistant", "content": response})
+    record_message(memory, "assistant", response)
     
     # Update balance
     memory['balance'] = memory.get('balance', 100) + 2
@@ -148,16 +254,29 @@ async def send_message(
     if memory['emotional_state'].get('agency', 0) > 20 and random.random() < 0.1:
         memory['balance'] += 15
     
-    # Save memory
-    await memory_service.save_memory(user_id, memory)
+    # Claim fact extraction (every 3 messages) with the same write
+    extract_due = claim_fact_extraction(memory)
+    
+    # Save memory (it retries through conflicts; failing means the turn is lost)
+    if not await memory_service.save_memory(user_id, memory):
+        await memory_service.refund_message_quota(user_id, account)
+        raise HTTPException(status_code=503, detail=TURN_NOT_SAVED)
     
-    # Background: Extract facts (every 3 messages)
-    if (user_msg_count + 1) % 3 == 0:
+    # Background: Extract facts
+    if extract_due:
         asyncio.create_task(extract_facts_background(user_id, list(memory['history'])))
     
-    # Background: Save to vector store for paid users
+    # Background: Save to vector store for paid users (reusing the turn's embedding)
     if len(request.message) > 20 and tier >= 1:
-        asyncio.create_task(memory_service.save_vector_memory(user_id, request.message))
+        memory_service.save_vector_memory(
+            user_id, request.message, rag.embedding.ready() if rag else None
+        )
+    
+    # Background: Fold messages older than the prompt window into the summary
+    schedule_history_summary(user_id, memory)
+    
+    # Background: Count the message for tiers without a limit (limited ones were counted up front)
+    schedule_message_count(user_id, account)
     
     return ChatResponse(
         response=response,
@@ -170,28 +289,21 @@ async def send_message(
 @router.post("/message/stream")
 async def send_message_stream(
     request: StreamChatRequest,
-    user: dict = Depends(get_current_user)
+    user: dict = Depends(get_rate_limited_user)
 ):
     """
     Send a message and get streaming AI response (SSE).
     """
     user_id = user["id"]
     
-    # Load user memory
-    memory = await memory_service.load_memory(user_id)
+    # Quota check, then RAG alongside the memory load (usually cached)
+    account, rag, memory = await begin_turn(user_id, request.message)
     tier = memory.get('tier', 0)
     tier_config = TIER_CONFIG.get(tier, TIER_CONFIG[0])
-    
-    # Check message limit for free tier
-    user_msg_count = len([m for m in memory['history'] if m['role'] == 'user'])
-    if tier_config.get('message_limit') and user_msg_count >= tier_config['message_limit']:
-        raise HTTPException(
-            status_code=403,
-            detail="Message limit reached. Upgrade for unlimited conversations."
-        )
+    user_msg_count = memory.get('user_message_count', 0)
     
     # Add user message to history
-    memory['history'].append({"role": "user", "content": request.message})
+    record_message(memory, "user", request.message)
     
     # Update emotional state
     memory['emotional_state'] = memory_service.update_emotional_state(
@@ -228,14 +340,15 @@ async def send_message_stream(
     
     # Get facts
     valid_facts, _ = memory_service.get_valid_facts_with_expiry(
-        memory.get('user_facts', []), tier
+        memory.get('user_facts', []), tier, user_id, getattr(memory, 'version', None)
     )
     facts_text = "\n".join(valid_facts) if valid_facts else "(No stored facts yet)"
     
-    # RAG for paid users
+    # RAG for paid users (skipped if it misses the latency budget)
     rag_text = ""
     if tier >= 1 and tier_config.get('rag_enabled'):
-        rag_text = await memory_service.retrieve_context(user_id, request.message)
+        rag = rag or SpeculativeRag(user_id, request.message)
+        rag_text = await rag.result()
     
     # Get value strategy
     value_strategy, value_allows_questions = ai_service.get_emotional_value(
@@ -255,7 +368,8 @@ async def send_message_stream(
         facts_text=facts_text,
         rag_text=rag_text,
         situational_modifiers=value_strategy,
-        time_offset=memory.get('time_offset', 0)
+        time_offset=memory.get('time_offset', 0),
+        history_summary=memory.get('history_summary', {}).get('text', '')
     )
     
     should_ask_question = vibe_allows_questions and value_allows_questions
@@ -266,34 +380,50 @@ async def send_message_stream(
         """Stream generator for SSE."""
         full_response = ""
         
-        async for chunk in ai_service.generate_response_stream(
-            system_prompt,
-            memory['history'],
-            model,
-            is_deep,
-            should_ask_question
-        ):
-            full_response += chunk
-            yield f"data: {chunk}\n\n"
-        
-        # Signal end of stream
-        yield f"data: [DONE]\n\n"
+        try:
+            async for chunk in ai_service.generate_response_stream(
+                system_prompt,
+                memory_service.prompt_history(memory, PROMPT_HISTORY_MESSAGES),
+                model,
+                is_deep,
+                should_ask_question
+            ):
+                full_response += chunk
+                yield f"data: {chunk}\n\n"
+        except Exception:
+            # The stream broke: the message doesn't count against the quota
+            await memory_service.refund_message_quota(user_id, account)
+            raise
         
         # Save response to history and memory
-        memory['history'].append({"role": "assistant", "content": full_response})
+        record_message(memory, "assistant", full_response)
         memory['balance'] = memory.get('balance', 100) + 2
         
         if memory['emotional_state'].get('agency', 0) > 20 and random.random() < 0.1:
             memory['balance'] += 15
         
-        await memory_service.save_memory(user_id, memory)
+        extract_due = claim_fact_extraction(memory)
+        if not await memory_service.save_memory(user_id, memory):
+            # Tell the client before [DONE], so it can offer to resend
+            await memory_service.refund_message_quota(user_id, account)
+            yield f"event: not_saved\ndata: {TURN_NOT_SAVED}\n\n"
+            yield f"data: [DONE]\n\n"
+            return
+        
+        # Signal end of stream
+        yield f"data: [DONE]\n\n"
         
         # Background tasks
-        if (user_msg_count + 1) % 3 == 0:
+        if extract_due:
             asyncio.create_task(extract_facts_background(user_id, list(memory['history'])))
         
         if len(request.message) > 20 and tier >= 1:
-            asyncio.create_task(memory_service.save_vector_memory(user_id, request.message))
+            memory_service.save_vector_memory(
+                user_id, request.message, rag.embedding.ready() if rag else None
+            )
+        
+        schedule_history_summary(user_id, memory)
+        schedule_message_count(user_id, account)
     
     return StreamingResponse(
         generate(),
@@ -308,13 +438,13 @@ async def send_message_stream(
 @router.post("/greeting", response_model=VibeGreetingResponse)
 async def get_vibe_greeting(
     request: VibeGreetingRequest,
-    user: dict = Depends(get_current_user)
+    user: dict = Depends(get_rate_limited_user)
 ):
     """
     Get a personalized session greeting based on vibe and time.
     """
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
+    memory = await load_turn_memory(user_id)
     
     # Check for event to reference
     active_context = memory.get('active_context', {})
@@ -331,9 +461,8 @@ async def get_vibe_greeting(
             days_since = (datetime.now().date() - rec_date).days
             if days_since <= 1 and last_recalled != today_str and request.vibe >= 30:
                 event_name = significant_event
-                # Update last recalled
+                # Update last recalled (persisted with the greeting below)
                 memory['active_context']['last_recalled_date'] = today_str
-                await memory_service.save_memory(user_id, memory)
         except ValueError:
             pass
     
@@ -356,7 +485,7 @@ async def get_vibe_greeting(
     )
     
     # Add greeting to history
-    memory['history'].append({"role": "assistant", "content": greeting})
+    record_message(memory, "assistant", greeting)
     await memory_service.save_memory(user_id, memory)
     
     return VibeGreetingResponse(
@@ -374,9 +503,7 @@ async def get_chat_history(
     Get chat history for the user.
     """
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
-    
-    history = memory.get('history', [])
+    history = await memory_service.load_history(user_id, limit)
     
     # Filter out system messages and limit
     visible_history = [m for m in history if m.get('role') != 'system'][-limit:]
@@ -396,3 +523,45 @@ async def extract_facts_background(user_id: str, history: list):
     except Exception as e:
         print(f"Fact extraction error: {e}")
 
+
+def claim_fact_extraction(memory: dict) -> bool:
+    """True (and recorded in memory) if FACT_EXTRACTION_INTERVAL user messages passed since the last extraction."""
+    count = memory.get('user_message_count', 0)
+    if count - memory.get('last_extraction_index', 0) < FACT_EXTRACTION_INTERVAL:
+        return False
+    memory['last_extraction_index'] = count
+    return True
+
+
+def schedule_message_count(user_id: str, account: dict):
+    """Count a turn in the daily ledger in the background, if the tier has no limit to check."""
+    if memory_service.message_limit(account) is None:
+        asyncio.create_task(memory_service.count_message(user_id, account))
+
+
+def schedule_history_summary(user_id: str, memory: dict):
+    """Start a background fold if enough messages scrolled out of the prompt window."""
+    fold = memory_service.summary_range(memory, PROMPT_HISTORY_MESSAGES)
+    if fold is None or user_id in _summarizing:
+        return
+    _summarizing.add(user_id)
+    start, end = fold
+    asyncio.create_task(summarize_history_background(
+        user_id, list(memory['history'][:end]), start, dict(memory.get('history_summary') or {})
+    ))
+
+
+async def summarize_history_background(user_id: str, history: list, start: int, previous: dict):
+    """Background task to fold history[start:] into the rolling summary."""
+    try:
+        text = await ai_service.summarize_history(previous.get('text', ''), history[start:])
+        summary = {
+            "text": text,
+            "through": history_fingerprint(history),
+            "folded": previous.get('folded', 0) + len(history) - start
+        }
+        await memory_service.save_history_summary(user_id, summary, previous)
+    except Exception as e:
+        print(f"History summary error: {e}")
+    finally:
+        _summarizing.discard(user_id)
@@ -2,11 +2,15 @@
 Route Dependencies
 Authentication and authorization dependencies for route protection.
 """
+import hmac
+import math
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 
 from api.config import get_settings
+from api.services.ratelimit import rate_limiter
 
 # Security scheme for Swagger UI
 security = HTTPBearer()
@@ -58,6 +62,21 @@ async def get_current_user(
         )
 
 
+async def get_rate_limited_user(user: dict = Depends(get_current_user)) -> dict:
+    """
+    get_current_user, plus the per-user rate limit.
+    Use this on routes that call the LLM.
+    """
+    wait = await rate_limiter.check(user["id"])
+    if wait > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many messages. Please slow down.",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+    return user
+
+
 async def get_optional_user(
     credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False))
 ) -> dict | None:
@@ -73,3 +92,19 @@ async def get_optional_user(
     except HTTPException:
         return None
 
+
+async def require_metrics_token(
+    credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer(auto_error=False))
+) -> None:
+    """
+    Guard for /metrics: 404 unless METRICS_TOKEN is set, 401 unless the
+    request carries it as its Bearer token.
+    """
+    expected = get_settings().metrics_token
+    if not expected:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode(), expected.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token"
+        )
@@ -10,6 +10,13 @@ from api.routes.deps import get_current_user
 
 router = APIRouter(prefix="/memory", tags=["Memory"])
 
+# Memory fields read by /memory/stats (no history: message counts are stored)
+STATS_FIELDS = [
+    "user_message_count", "assistant_message_count", "time_offset",
+    "tier", "user_facts", "expired_facts_count", "emotional_state",
+    "last_active_timestamp", "balance"
+]
+
 
 @router.get("/facts", response_model=FactsResponse)
 async def get_facts(user: dict = Depends(get_current_user)):
@@ -18,16 +25,19 @@ async def get_facts(user: dict = Depends(get_current_user)):
     Free tier only sees facts from last 48 hours.
     """
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
+    memory = await memory_service.load_memory(user_id, fields=["tier", "user_facts", "expired_facts_count"])
     
     tier = memory.get('tier', 0)
     raw_facts = memory.get('user_facts', [])
     
-    valid_facts, expired_count = memory_service.get_valid_facts_with_expiry(raw_facts, tier)
+    valid_facts, expired_count = memory_service.get_valid_facts_with_expiry(
+        raw_facts, tier, user_id, getattr(memory, 'version', None)
+    )
     
     return FactsResponse(
         facts=valid_facts,
-        expired_count=expired_count,
+        # Already purged by the sweeper + expired since the last sweep
+        expired_count=(memory.get('expired_facts_count') or 0) + expired_count,
         tier=tier
     )
 
@@ -38,10 +48,7 @@ async def clear_facts(user: dict = Depends(get_current_user)):
     Clear all stored facts.
     """
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
-    
-    memory['user_facts'] = []
-    await memory_service.save_memory(user_id, memory)
+    await memory_service.patch_memory(user_id, {"user_facts": []})
     
     return {"message": "Facts cleared successfully"}
 
@@ -55,8 +62,8 @@ async def sync_memory(user: dict = Depends(get_current_user)):
     user_id = user["id"]
     
     try:
-        # Just load fresh - this forces a new read from Supabase
-        memory = await memory_service.load_memory(user_id)
+        # Bypass the cache - this forces a new read from Supabase
+        memory = await memory_service.load_memory(user_id, refresh=True)
         
         return SyncResponse(
             success=True,
@@ -75,7 +82,7 @@ async def get_emotional_state(user: dict = Depends(get_current_user)):
     Get current emotional state scores.
     """
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
+    memory = await memory_service.load_memory(user_id, fields=["emotional_state", "active_context"])
     
     return {
         "emotional_state": memory.get('emotional_state', {}),
@@ -89,22 +96,24 @@ async def get_memory_stats(user: dict = Depends(get_current_user)):
     Get memory statistics for the user.
     """
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
+    memory = await memory_service.load_memory(user_id, fields=STATS_FIELDS)
     
-    history = memory.get('history', [])
-    user_messages = len([m for m in history if m.get('role') == 'user'])
-    assistant_messages = len([m for m in history if m.get('role') == 'assistant'])
+    user_messages = memory.get('user_message_count', 0)
+    assistant_messages = memory.get('assistant_message_count', 0)
     
     tier = memory.get('tier', 0)
     raw_facts = memory.get('user_facts', [])
-    valid_facts, expired_count = memory_service.get_valid_facts_with_expiry(raw_facts, tier)
+    valid_facts, expired_count = memory_service.get_valid_facts_with_expiry(
+        raw_facts, tier, user_id, getattr(memory, 'version', None)
+    )
     
     return {
-        "total_messages": len(history),
+        "total_messages": user_messages + assistant_messages,
         "user_messages": user_messages,
         "assistant_messages": assistant_messages,
+        "messages_today": await memory_service.messages_today(user_id, memory),
         "facts_count": len(valid_facts),
-        "expired_facts_count": expired_count,
+        "expired_facts_count": (memory.get('expired_facts_count') or 0) + expired_count,
         "tier": tier,
         "emotional_state": memory.get('emotional_state', {}),
         "last_active": memory.get('last_active_timestamp', ''),
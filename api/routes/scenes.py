@@ -11,6 +11,9 @@ from api.routes.deps import get_current_user
 
 router = APIRouter(prefix="/scenes", tags=["Scenes"])
 
+# Memory fields these endpoints read
+SCENE_FIELDS = ["tier"]
+
 # Scene definitions
 SCENE_DEFINITIONS = {
     "Lounge": {
@@ -42,7 +45,7 @@ async def get_scenes(user: dict = Depends(get_current_user)):
     Get all scenes with availability based on user's tier.
     """
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
+    memory = await memory_service.load_memory(user_id, fields=SCENE_FIELDS)
     
     tier = memory.get('tier', 0)
     tier_config = TIER_CONFIG.get(tier, TIER_CONFIG[0])
@@ -75,7 +78,7 @@ async def get_scene_info(
         return {"error": "Scene not found", "available_scenes": list(SCENE_DEFINITIONS.keys())}
     
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
+    memory = await memory_service.load_memory(user_id, fields=SCENE_FIELDS)
     
     tier = memory.get('tier', 0)
     tier_config = TIER_CONFIG.get(tier, TIER_CONFIG[0])
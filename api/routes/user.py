@@ -5,11 +5,14 @@ Handles profile retrieval and updates.
 from fastapi import APIRouter, HTTPException, Depends
 
 from api.models.schemas import ProfileUpdate, ProfileResponse
-from api.services.memory import memory_service
+from api.services.memory import memory_service, apply_memory_patch
 from api.routes.deps import get_current_user
 
 router = APIRouter(prefix="/user", tags=["User"])
 
+# Memory fields needed to build a ProfileResponse
+PROFILE_FIELDS = ["user_profile", "emotional_state", "balance", "tier", "avatar_id", "current_outfit"]
+
 
 @router.get("/profile", response_model=ProfileResponse)
 async def get_profile(user: dict = Depends(get_current_user)):
@@ -17,7 +20,7 @@ async def get_profile(user: dict = Depends(get_current_user)):
     Get current user's profile and stats.
     """
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
+    memory = await memory_service.load_memory(user_id, fields=PROFILE_FIELDS)
     
     profile = memory.get('user_profile', {})
     emotional = memory.get('emotional_state', {})
@@ -49,33 +52,25 @@ async def update_profile(
     user_id = user["id"]
     memory = await memory_service.load_memory(user_id)
     
-    # Update profile fields
-    profile = memory.get('user_profile', {})
-    
-    if updates.name is not None:
-        profile['name'] = updates.name
-    if updates.age is not None:
-        profile['age'] = updates.age
-    if updates.gender is not None:
-        profile['gender'] = updates.gender
-    if updates.companion_name is not None:
-        profile['companion_name'] = updates.companion_name
-    
-    memory['user_profile'] = profile
-    
-    # Update other fields
-    if updates.avatar_id is not None:
-        memory['avatar_id'] = updates.avatar_id
-    if updates.current_outfit is not None:
-        memory['current_outfit'] = updates.current_outfit
-    if updates.time_offset is not None:
-        memory['time_offset'] = updates.time_offset
+    # Collect changed fields as dotted paths for a partial write
+    changes = {}
+    for field in ("name", "age", "gender", "companion_name"):
+        value = getattr(updates, field)
+        if value is not None:
+            changes[f"user_profile.{field}"] = value
+    for field in ("avatar_id", "current_outfit", "time_offset"):
+        value = getattr(updates, field)
+        if value is not None:
+            changes[field] = value
     
     # Save
-    await memory_service.save_memory(user_id, memory)
+    await memory_service.patch_memory(user_id, changes)
+    
+    # Reflect the changes in the response
+    apply_memory_patch(memory, changes)
     
     return ProfileResponse(
-        user_profile=profile,
+        user_profile=memory.get('user_profile', {}),
         emotional_state=memory.get('emotional_state', {}),
         balance=memory.get('balance', 100),
         tier=memory.get('tier', 0),
@@ -94,21 +89,25 @@ async def set_avatar(
     Premium users can switch freely, others are locked.
     """
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
-    
-    tier = memory.get('tier', 0)
     
-    # Check if persona switching is allowed
-    if tier < 2 and memory.get('has_chosen_avatar', False):
+    def choose(memory: dict) -> dict:
+        tier = memory.get('tier', 0)
+        
+        # Check if persona switching is allowed
+        if tier < 2 and memory.get('has_chosen_avatar', False):
+            raise HTTPException(
+                status_code=403,
+                detail="Persona switching requires Premium tier. Upgrade to switch companions."
+            )
+        return {"avatar_id": avatar_id, "has_chosen_avatar": True}
+    
+    # Checked and written against the same version, so a second request can't slip past
+    if await memory_service.update_memory(user_id, choose) is None:
         raise HTTPException(
-            status_code=403,
-            detail="Persona switching requires Premium tier. Upgrade to switch companions."
+            status_code=409,
+            detail="Your account was being updated. Please try again."
         )
     
-    memory['avatar_id'] = avatar_id
-    memory['has_chosen_avatar'] = True
-    await memory_service.save_memory(user_id, memory)
-    
     return {"message": f"Avatar updated to {avatar_id}", "avatar_id": avatar_id}
 
 
@@ -118,7 +117,7 @@ async def get_balance(user: dict = Depends(get_current_user)):
     Get user's coin balance.
     """
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
+    memory = await memory_service.load_memory(user_id, fields=["balance", "tier"])
     
     return {
         "balance": memory.get('balance', 100),
@@ -135,28 +134,31 @@ async def spend_coins(
     Spend coins (for purchases, gifts, etc.)
     """
     user_id = user["id"]
-    memory = await memory_service.load_memory(user_id)
-    
-    current_balance = memory.get('balance', 100)
     
-    if amount > current_balance:
+    def spend(memory: dict) -> dict:
+        current_balance = memory.get('balance', 100)
+        
+        if amount > current_balance:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Insufficient balance. You have {current_balance} coins."
+            )
+        
+        # Spending coins increases warmth
+        warmth = min(100, memory.get('emotional_state', {}).get('warmth', 10) + (amount // 2))
+        return {"balance": current_balance - amount, "emotional_state.warmth": warmth}
+    
+    # Balance is checked and written against the same version, so concurrent
+    # awards or spends are never overwritten
+    changes = await memory_service.update_memory(user_id, spend)
+    if changes is None:
         raise HTTPException(
-            status_code=400,
-            detail=f"Insufficient balance. You have {current_balance} coins."
+            status_code=409,
+            detail="Your balance was being updated. Please try again."
         )
     
-    memory['balance'] = current_balance - amount
-    
-    # Spending coins increases warmth
-    memory['emotional_state']['warmth'] = min(
-        100, 
-        memory['emotional_state'].get('warmth', 10) + (amount // 2)
-    )
-    
-    await memory_service.save_memory(user_id, memory)
-    
     return {
-        "new_balance": memory['balance'],
+        "new_balance": changes['balance'],
         "spent": amount,
         "warmth_gained": amount // 2
     }
@@ -10,6 +10,13 @@ from openai import AsyncOpenAI
 from api.config import get_settings, TIER_CONFIG, DEEP_TRIGGERS
 
 
+# Most recent messages sent verbatim with each prompt; older ones reach the
+# model through the rolling history summary
+PROMPT_HISTORY_MESSAGES = 10
+
+# Upper bound for the rolling summary, to keep prompt tokens flat
+SUMMARY_MAX_WORDS = 150
+
 # Prompt directory (relative to project root)
 PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "prompts")
 
@@ -284,7 +291,8 @@ ROLEPLAY BEHAVIOR:
         facts_text: str,
         rag_text: str = "",
         situational_modifiers: str = "",
-        time_offset: int = 0
+        time_offset: int = 0,
+        history_summary: str = ""
     ) -> Tuple[str, bool]:
         """
         Build the complete system prompt for the AI.
@@ -340,6 +348,8 @@ USER FACTS:
 {facts_text}"""
         if rag_text:
             recall_instr += f"\n\nRELEVANT PAST CONTEXT (from long-term memory):\n{rag_text}"
+        if history_summary:
+            recall_instr += f"\n\nEARLIER IN YOUR CONVERSATIONS (summary):\n{history_summary}"
         
         # Static blocks
         behavior_block = "AGENCY: Small actions. INVITATION: If Closeness > 40, suggest cafe."
@@ -397,7 +407,9 @@ USER FACTS:
         style_enforcement = self.get_style_enforcement(is_deep, should_ask_question)
         
         messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(history[-10:])  # Last 10 messages for context
+        # Context window from MemoryService.prompt_history (stored messages may
+        # carry extra keys like seq)
+        messages.extend({"role": m["role"], "content": m["content"]} for m in history)
         messages.append({"role": "system", "content": style_enforcement})
         
         stream = await self.client.chat.completions.create(
@@ -536,6 +548,32 @@ USER FACTS:
                         new_facts.append(f"• JOKE: {content}")
         
         return new_facts, new_event
+    
+    async def summarize_history(self, previous_summary: str, messages: List[Dict[str, str]]) -> str:
+        """
+        Fold older messages into the running conversation summary.
+        
+        Returns:
+            The updated summary text.
+        """
+        transcript = "\n".join(
+            f"{'User' if m['role'] == 'user' else 'Companion'}: {m['content']}" for m in messages
+        )
+        summary_prompt = (
+            "You keep a running summary of a long conversation between a user and their companion.\n"
+            f"CURRENT SUMMARY:\n{previous_summary or '(none yet)'}\n\n"
+            f"NEW MESSAGES:\n{transcript}\n\n"
+            "Rewrite the summary so it also covers the new messages. Keep names, events, feelings, "
+            "plans and unresolved threads; drop small talk. Third person, past tense, "
+            f"at most {SUMMARY_MAX_WORDS} words. Output only the summary."
+        )
+        
+        response = await self.client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "system", "content": summary_prompt}],
+            max_tokens=SUMMARY_MAX_WORDS * 2
+        )
+        return response.choices[0].message.content.strip()
 
 
 # Singleton instance
@@ -0,0 +1,153 @@
+"""
+Keepsake Memory Codec
+Optional compressed encoding for memories.data.
+
+With MEMORY_ENCODING=msgpack-zstd the blob is stored as a small JSON envelope:
+
+    {"_codec": "msgpack+zstd", "v": 1, "dict_id": 123, "data": "<base64>"}
+
+where data is the msgpack-encoded memory compressed with zstd, optionally
+using a shared dictionary trained on history text (python -m api.tools.train_dict).
+decode() accepts plain JSON blobs and envelopes alike, so the encoding can be
+switched either way without migrating rows.
+
+msgpack and zstandard are optional: pip install msgpack zstandard
+"""
+import base64
+from typing import Any, Dict, List, Optional
+
+CODEC_NAME = "msgpack+zstd"
+# v1: msgpack of the blob, history messages as [role, content] pairs
+CODEC_VERSION = 1
+ENCODINGS = ("json", "msgpack-zstd")
+
+# zstd level: 3 is zstd's default and already far cheaper than JSON on the wire
+COMPRESSION_LEVEL = 3
+
+
+def _import_codec_libs():
+    """Import msgpack and zstandard, with a clear error if they're missing."""
+    try:
+        import msgpack
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError(
+            "Compressed memory blobs need the optional msgpack and zstandard "
+            "packages: pip install msgpack zstandard"
+        ) from e
+    return msgpack, zstandard
+
+
+def is_encoded(value: Any) -> bool:
+    """True if a stored blob is a compressed envelope rather than plain JSON."""
+    return isinstance(value, dict) and value.get("_codec") == CODEC_NAME
+
+
+def _pack_history(history: List[Any]) -> List[Any]:
+    """Plain {role, content} messages become [role, content]; anything else is kept."""
+    return [
+        [m["role"], m["content"]] if isinstance(m, dict) and m.keys() == {"role", "content"} else m
+        for m in history
+    ]
+
+
+def _unpack_history(history: List[Any]) -> List[Any]:
+    return [
+        {"role": m[0], "content": m[1]} if isinstance(m, list) else m
+        for m in history
+    ]
+
+
+def _to_packable(data: Dict[str, Any]) -> Dict[str, Any]:
+    if isinstance(data.get("history"), list):
+        data = dict(data)
+        data["history"] = _pack_history(data["history"])
+    return data
+
+
+def train_dictionary(samples: List[Dict[str, Any]], size: int = 16 * 1024) -> bytes:
+    """
+    Train a zstd dictionary from sample memory blobs.
+    Samples are msgpack-encoded the same way encode() does, so the
+    dictionary learns our keys and common history phrasing.
+    """
+    msgpack, zstandard = _import_codec_libs()
+    packed = [msgpack.packb(_to_packable(blob), use_bin_type=True) for blob in samples]
+    return zstandard.train_dictionary(size, packed).as_bytes()
+
+
+class MemoryCodec:
+    """
+    Encodes memory blobs for storage and decodes whatever is stored.
+
+    Compressor objects are reused and not thread-safe: call from the event
+    loop (or one thread) only.
+    """
+
+    def __init__(self, encoding: str = "json", dict_path: Optional[str] = None):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown MEMORY_ENCODING: {encoding}")
+        self.encoding = encoding
+        self.dict_path = dict_path or None
+        self._dict = None
+        self._compressor = None
+        self._decompressors: Dict[int, Any] = {}
+
+        if self.compressed:
+            # Fail at startup rather than on the first write
+            _import_codec_libs()
+
+    @property
+    def compressed(self) -> bool:
+        """True if new blobs are written as envelopes (opaque to JSON patches/projections)."""
+        return self.encoding != "json"
+
+    def _dictionary(self):
+        """The shared zstd dictionary, loaded on first use (None if not configured)."""
+        if self._dict is None and self.dict_path:
+            _, zstandard = _import_codec_libs()
+            with open(self.dict_path, "rb") as f:
+                self._dict = zstandard.ZstdCompressionDict(f.read())
+        return self._dict
+
+    def encode(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """The memories.data value to store for this blob."""
+        if not self.compressed:
+            return data
+
+        msgpack, zstandard = _import_codec_libs()
+        dictionary = self._dictionary()
+        if self._compressor is None:
+            self._compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=dictionary)
+
+        packed = msgpack.packb(_to_packable(data), use_bin_type=True)
+        return {
+            "_codec": CODEC_NAME,
+            "v": CODEC_VERSION,
+            "dict_id": dictionary.dict_id() if dictionary is not None else 0,
+            "data": base64.b64encode(self._compressor.compress(packed)).decode("ascii"),
+        }
+
+    def decode(self, value: Dict[str, Any]) -> Dict[str, Any]:
+        """Decode a stored blob in either format."""
+        if not is_encoded(value):
+            return value
+        if value.get("v") != CODEC_VERSION:
+            raise ValueError(f"Unsupported {CODEC_NAME} version: {value.get('v')}")
+
+        msgpack, zstandard = _import_codec_libs()
+        dict_id = value.get("dict_id", 0)
+        decompressor = self._decompressors.get(dict_id)
+        if decompressor is None:
+            dictionary = None
+            if dict_id:
+                dictionary = self._dictionary()
+                if dictionary is None or dictionary.dict_id() != dict_id:
+                    raise ValueError(f"Memory blob needs zstd dictionary {dict_id}, which is not loaded")
+            decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+            self._decompressors[dict_id] = decompressor
+
+        data = msgpack.unpackb(decompressor.decompress(base64.b64decode(value["data"])), raw=False)
+        if isinstance(data.get("history"), list):
+            data["history"] = _unpack_history(data["history"])
+        return data
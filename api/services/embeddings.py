@@ -0,0 +1,267 @@
+"""
+Keepsake Embeddings
+text-embedding-3-small calls behind a two-level cache, keyed by a hash of
+model + dimensions + text so the same message is only ever embedded once.
+
+- L1: in-process LRU of recent embeddings
+- L2: a local SQLite file (float32 blobs) that survives restarts and is
+  shared by the workers on one host; EMBEDDING_CACHE_PATH="" disables it
+
+Concurrent requests for the same text share one API call (embed_many()
+waits for texts that embed() is already fetching), embed_many() sends all
+of a batch's other misses as one multi-input request, and every call goes
+through the app's shared AsyncOpenAI client.
+"""
+import asyncio
+import hashlib
+import sqlite3
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from api.config import get_settings
+from api.services.ai import ai_service
+from api.services.cache import TTLCache
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# The L2 file drops its oldest rows once every this many inserts
+SQLITE_PRUNE_EVERY = 1000
+
+SQLITE_SCHEMA = """
+create table if not exists embedding_cache (
+    key       text primary key,
+    embedding blob not null  -- float32 array
+);
+"""
+
+
+def embedding_key(text: str, model: str = EMBEDDING_MODEL, dimensions: int = 0) -> str:
+    """Cache key for a text's embedding (full-length keys predate `dimensions`)."""
+    if dimensions:
+        model = f"{model}:{dimensions}"
+    return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+
+class DiskEmbeddingCache:
+    """
+    The L2 cache: one SQLite table on a single I/O thread, capped at
+    `max_rows` (oldest inserted dropped first).
+    """
+
+    def __init__(self, path: str, max_rows: int = 200000, timeout: float = 10.0):
+        self.path = path
+        self.max_rows = max_rows
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="keepsake-embeddings")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._inserts = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the connection on first use (on the I/O thread)."""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=self.timeout)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            conn.executescript(SQLITE_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(loop.run_in_executor(self._executor, fn, *args), timeout=self.timeout)
+
+    def _get(self, key: str) -> Optional[List[float]]:
+        row = self._connect().execute("select embedding from embedding_cache where key = ?", (key,)).fetchone()
+        return array("f", row[0]).tolist() if row else None
+
+    def _get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        placeholders = ", ".join("?" for _ in keys)
+        rows = self._connect().execute(
+            f"select key, embedding from embedding_cache where key in ({placeholders})", keys
+        ).fetchall()
+        return {key: array("f", blob).tolist() for key, blob in rows}
+
+    def _put(self, items: List[Tuple[str, List[float]]], prune: bool) -> None:
+        conn = self._connect()
+        conn.executemany(
+            "insert or ignore into embedding_cache (key, embedding) values (?, ?)",
+            [(key, array("f", embedding).tobytes()) for key, embedding in items]
+        )
+        if prune:
+            conn.execute(
+                "delete from embedding_cache where rowid <= (select max(rowid) from embedding_cache) - ?",
+                (self.max_rows,)
+            )
+
+    async def get(self, key: str) -> Optional[List[float]]:
+        return await self._run(self._get, key)
+
+    async def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """{key: embedding} for the keys that are cached."""
+        return await self._run(self._get_many, keys)
+
+    async def put(self, key: str, embedding: List[float]) -> None:
+        await self.put_many([(key, embedding)])
+
+    async def put_many(self, items: List[Tuple[str, List[float]]]) -> None:
+        before = self._inserts
+        self._inserts += len(items)
+        prune = before // SQLITE_PRUNE_EVERY != self._inserts // SQLITE_PRUNE_EVERY
+        await self._run(self._put, items, prune)
+
+    def close(self) -> None:
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close)
+        self._executor.shutdown(wait=False)
+
+
+class EmbeddingService:
+    """Cached embeddings. Callers get their own list; cached vectors are never handed out."""
+
+    def __init__(self, client=None, disk: Optional[DiskEmbeddingCache] = None):
+        settings = get_settings()
+        self.client = client or ai_service.client
+        self.model = EMBEDDING_MODEL
+        # Shortened embeddings (EMBEDDING_DIMENSIONS); 0: the model's full length
+        self.dimensions = settings.embedding_dimensions
+        # Embeddings never go stale: plain LRU, no expiry
+        self.memory = TTLCache(max_size=settings.embedding_cache_size, ttl=float("inf"))
+        if disk is None and settings.embedding_cache_path:
+            disk = DiskEmbeddingCache(settings.embedding_cache_path, timeout=settings.db_timeout_seconds)
+        self.disk = disk
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # api_inputs: texts sent to the API (> api_calls when batched)
+        self.counters = {
+            "requests": 0, "memory_hits": 0, "disk_hits": 0, "shared": 0,
+            "api_calls": 0, "api_inputs": 0
+        }
+
+    async def embed(self, text: str) -> List[float]:
+        """Embedding for text, from the caches if possible."""
+        self.counters["requests"] += 1
+        key = embedding_key(text, self.model, self.dimensions)
+
+        cached = self.memory.get(key)
+        if cached is not None:
+            self.counters["memory_hits"] += 1
+            return list(cached)
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, text))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None))
+        else:
+            self.counters["shared"] += 1
+        # Shield so one caller being cancelled doesn't cancel the shared call
+        return list(await asyncio.shield(task))
+
+    async def _load(self, key: str, text: str) -> List[float]:
+        """L2, then the API; fills the caches on the way back."""
+        if self.disk is not None:
+            try:
+                embedding = await self.disk.get(key)
+            except Exception as e:
+                print(f"Embedding cache read error: {e}")
+                embedding = None
+            if embedding is not None:
+                self.counters["disk_hits"] += 1
+                self.memory.set(key, embedding)
+                return embedding
+
+        self.counters["api_calls"] += 1
+        self.counters["api_inputs"] += 1
+        response = await self._create(text)
+        embedding = response.data[0].embedding
+        self.memory.set(key, embedding)
+        if self.disk is not None:
+            try:
+                await self.disk.put(key, embedding)
+            except Exception as e:
+                print(f"Embedding cache write error: {e}")
+        return embedding
+
+    async def _create(self, texts):
+        """One embeddings API call."""
+        if self.dimensions:
+            return await self.client.embeddings.create(input=texts, model=self.model, dimensions=self.dimensions)
+        return await self.client.embeddings.create(input=texts, model=self.model)
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeddings for several texts, in order. Texts embed() is already
+        fetching are waited for; the other cache misses go to the API as one
+        multi-input request.
+        """
+        self.counters["requests"] += len(texts)
+        keys = [embedding_key(text, self.model, self.dimensions) for text in texts]
+        found: Dict[str, List[float]] = {}
+        for key in keys:
+            cached = self.memory.get(key)
+            if cached is not None:
+                self.counters["memory_hits"] += 1
+                found[key] = cached
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        shared = {key: self._inflight[key] for key in missing if key in self._inflight}
+        if shared:
+            results = await asyncio.gather(*(asyncio.shield(task) for task in shared.values()), return_exceptions=True)
+            for key, result in zip(shared, results):
+                # A failed call is retried with the batch
+                if not isinstance(result, BaseException):
+                    self.counters["shared"] += 1
+                    found[key] = result
+                    del missing[key]
+        if missing and self.disk is not None:
+            try:
+                on_disk = await self.disk.get_many(list(missing))
+            except Exception as e:
+                print(f"Embedding cache read error: {e}")
+                on_disk = {}
+            for key, embedding in on_disk.items():
+                self.counters["disk_hits"] += 1
+                self.memory.set(key, embedding)
+                found[key] = embedding
+                del missing[key]
+
+        if missing:
+            self.counters["api_calls"] += 1
+            self.counters["api_inputs"] += len(missing)
+            response = await self._create(list(missing.values()))
+            fresh = list(zip(missing, (item.embedding for item in response.data)))
+            for key, embedding in fresh:
+                self.memory.set(key, embedding)
+                found[key] = embedding
+            if self.disk is not None:
+                try:
+                    await self.disk.put_many(fresh)
+                except Exception as e:
+                    print(f"Embedding cache write error: {e}")
+
+        return [list(found[key]) for key in keys]
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rates for /metrics."""
+        counters = self.counters
+        requests = counters["requests"]
+        hits = counters["memory_hits"] + counters["disk_hits"] + counters["shared"]
+        return {
+            **counters,
+            "hit_rate": round(hits / requests, 4) if requests else 0.0,
+            "dimensions": self.dimensions or None,
+            # ttl is infinite, which JSON can't carry
+            "memory_cache": {**self.memory.stats(), "ttl_seconds": None},
+            "disk_cache": self.disk is not None,
+        }
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
+
+
+# Singleton instance
+embedding_service = EmbeddingService()
@@ -0,0 +1,211 @@
+"""
+Keepsake Fact Index
+Deduplicates extracted user facts before they take one of the 20 fact slots.
+
+- Exact duplicates: set of normalized text ("• User likes coffee!" == "user likes coffee")
+- Near duplicates: MinHash over each fact's content words, bucketed with LSH
+  so a new fact is only compared against likely matches, then verified word
+  by word, never by characters. A candidate is a near duplicate when both
+  facts name the same people and numbers and either
+  - have the same content words, differing only in filler ("really", "a lot")
+    or interchangeable verbs ("likes" / "loves"), or
+  - share at least three content words and swap exactly one other for a
+    differently spelled one ("every morning" / "each morning"). Look-alike
+    swaps ("hiking" / "biking", "married" / "unmarried") are different facts.
+  Paraphrases collapse to the newer phrasing; a fact that only adds detail
+  ("User likes coffee in the morning") stays a separate fact.
+- Tense: "User is married" / "User was married" are not exact duplicates, so
+  the newer one replaces the older as a near duplicate instead of being dropped.
+"""
+import random
+import re
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+# Words that every fact shares ("• User has a ...") and that would make
+# unrelated facts look similar
+STOPWORDS = {
+    "user", "users", "the", "a", "an", "to", "of", "in", "on", "at", "and", "s",
+    "their", "they",
+}
+
+# Auxiliaries carry a fact's tense: kept in the exact-match text, ignored when
+# looking for near duplicates (so a changed tense replaces the older fact)
+AUXILIARIES = {"is", "are", "was", "were", "has", "have", "had"}
+
+# Interchangeable wordings, compared as the same word
+SYNONYMS = {
+    "like": "likes", "love": "likes", "loves": "likes", "enjoy": "likes",
+    "enjoys": "likes", "adore": "likes", "adores": "likes", "fan": "likes",
+    "dislike": "dislikes", "hate": "dislikes", "hates": "dislikes",
+    "detest": "dislikes", "detests": "dislikes",
+}
+
+# Words that can be added or dropped without changing the fact. Everything
+# else is a content word
+FILLER = {
+    "really", "very", "much", "lot", "so", "quite", "just", "also", "still",
+    "truly", "actually", "absolutely", "definitely", "big", "huge", "great",
+}
+
+NUM_PERMUTATIONS = 32
+LSH_BANDS = 16  # 2 rows per band: near-certain to surface pairs above ~0.4 Jaccard
+
+# Each "permutation" XORs the 32-bit word hash with a fixed random mask:
+# cheap and good enough to pick candidates, which are then verified exactly
+_MASKS = [random.Random(i).getrandbits(32) for i in range(NUM_PERMUTATIONS)]
+
+# Swapped words whose character 3-grams overlap this much are look-alikes
+# ("hiking" / "biking": 0.6), which usually means different facts
+LOOKALIKE_THRESHOLD = 0.3
+SHINGLE_SIZE = 3
+
+# Share of words (after SYNONYMS) two near duplicates must have in common:
+# with filler, so a short fact isn't replaced by a long, padded one; and of
+# content words, so a swap needs three shared words (3 of 5)
+NEAR_DUPLICATE_THRESHOLD = 0.6
+
+_WORD = re.compile(r"[^\W_]+")
+
+
+def normalize_fact(text: str) -> str:
+    """Lowercase words without punctuation, bullets or filler words."""
+    return " ".join(w for w in _WORD.findall(text.lower()) if w not in STOPWORDS)
+
+
+def _entities(text: str) -> Set[str]:
+    """Names and numbers: capitalized words after the first, and digits."""
+    words = _WORD.findall(text)
+    return {w.lower() for w in words[1:] if w[0].isupper() or w.isdigit()}
+
+
+def _shingles(word: str) -> Set[str]:
+    if len(word) <= SHINGLE_SIZE:
+        return {word}
+    return {word[i:i + SHINGLE_SIZE] for i in range(len(word) - SHINGLE_SIZE + 1)}
+
+
+def _minhash(words: FrozenSet[str]) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(w.encode()) for w in words]
+    return tuple(min(map(mask.__xor__, hashes)) for mask in _MASKS)
+
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+@lru_cache(maxsize=8192)
+def _features(
+    content: str
+) -> Tuple[str, FrozenSet[str], FrozenSet[str], FrozenSet[str], Tuple[Tuple[int, Tuple[int, ...]], ...]]:
+    """
+    (normalized text, words, content words, entities, LSH band keys) for a fact.
+    Cached: a user's existing facts are re-indexed on every save_facts.
+    """
+    normalized = normalize_fact(content)
+    words = frozenset(SYNONYMS.get(w, w) for w in normalized.split() if w not in AUXILIARIES)
+    key = words - FILLER
+    bands = ()
+    if key:
+        signature = _minhash(key)
+        rows = NUM_PERMUTATIONS // LSH_BANDS
+        bands = tuple((band, signature[band * rows:(band + 1) * rows]) for band in range(LSH_BANDS))
+    return normalized, words, key, frozenset(_entities(content)), bands
+
+
+def _near_duplicates(a: "_Entry", b: "_Entry") -> bool:
+    """Verify an LSH candidate pair (see the module docstring)."""
+    # "sister named Anna" vs "sister named Maria" are different facts
+    if a.entities != b.entities:
+        return False
+    if a.key == b.key:
+        return _jaccard(a.words, b.words) >= NEAR_DUPLICATE_THRESHOLD
+    ours, theirs = a.key - b.key, b.key - a.key
+    if len(ours) != 1 or len(theirs) != 1 or _jaccard(a.key, b.key) < NEAR_DUPLICATE_THRESHOLD:
+        return False
+    # One word swapped: a paraphrase, unless the two are spelled alike
+    (ours,), (theirs,) = ours, theirs
+    return _jaccard(_shingles(ours), _shingles(theirs)) < LOOKALIKE_THRESHOLD
+
+
+class _Entry:
+    __slots__ = ("fact", "normalized", "words", "key", "entities", "bands")
+
+    def __init__(self, fact: Dict[str, Any]):
+        self.fact = fact
+        self.normalized, self.words, self.key, self.entities, self.bands = _features(fact["content"])
+
+
+class FactIndex:
+    """
+    Ordered set of fact dicts ({"content", "created_at"}) with duplicate
+    detection. Built from a blob's user_facts; facts() returns the list to store.
+    """
+
+    def __init__(self, facts: Optional[List[Dict[str, Any]]] = None):
+        self._entries: Dict[int, _Entry] = {}
+        self._by_text: Dict[str, int] = {}
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[int]] = {}
+        self._next_id = 0
+        for fact in facts or []:
+            if isinstance(fact, dict) and "content" in fact:
+                self.add(fact)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def facts(self) -> List[Dict[str, Any]]:
+        """Facts in insertion order (oldest first)."""
+        return [entry.fact for entry in self._entries.values()]
+
+    def add(self, fact: Dict[str, Any]) -> str:
+        """
+        Add a fact. Returns "added", "duplicate" (exact match, ignored) or
+        "replaced" (near duplicate: the older phrasing is dropped).
+        """
+        entry = _Entry(fact)
+        if entry.normalized in self._by_text:
+            return "duplicate"
+
+        match = self._match(entry)
+        if match is not None:
+            self._remove(match)
+        self._insert(entry)
+        return "replaced" if match is not None else "added"
+
+    def _match(self, entry: _Entry) -> Optional[int]:
+        # Facts made only of filler words have nothing to compare
+        if not entry.key:
+            return None
+
+        candidates = set()
+        for band in entry.bands:
+            candidates |= self._buckets.get(band, set())
+
+        best, best_score = None, 0.0
+        for candidate_id in candidates:
+            other = self._entries[candidate_id]
+            if not _near_duplicates(entry, other):
+                continue
+            score = _jaccard(entry.words, other.words)
+            if score > best_score:
+                best, best_score = candidate_id, score
+        return best
+
+    def _insert(self, entry: _Entry) -> None:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._by_text[entry.normalized] = entry_id
+        for band in entry.bands:
+            self._buckets.setdefault(band, set()).add(entry_id)
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        del self._by_text[entry.normalized]
+        for band in entry.bands:
+            bucket = self._buckets[band]
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[band]
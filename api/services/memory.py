@@ -1,117 +1,1194 @@
 """
 Keepsake Memory Service
-Handles all Supabase memory operations.
+Handles all memory operations on top of a pluggable MemoryStore.
 """
+import asyncio
+import bisect
+import copy
+import hashlib
+import math
+import random
+import time
+from contextvars import ContextVar
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Tuple
-from supabase import create_client, Client
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from api.config import get_settings, TIER_CONFIG
 from api.models.schemas import UserMemory, UserFact, EmotionalState, UserProfile, ActiveContext
+from api.services.cache import TTLCache
+from api.services.codec import MemoryCodec, is_encoded
+from api.services.embeddings import embedding_service
+from api.services.facts import FactIndex
+from api.services.store import MemoryStore, apply_memory_patch, create_store
+from api.services.vectors import VectorIndex, VectorWriter
+
+# Most recent messages kept in memory['history'] (the whole history in blob mode)
+HISTORY_LIMIT = 50
+
+# Layout version of memory blobs. Bump it and extend upgrade_memory() when the
+# layout changes; stale blobs are upgraded and persisted once, on first read.
+SCHEMA_VERSION = 3
+
+# Memory fields checks read before the full memory load (rate limit, quota)
+ACCOUNT_FIELDS = ["tier", "time_offset"]
+
+# Memory fields the fact sweep scans: what purging reads, plus the keys of a
+# compressed envelope (api/services/codec.py), so those rows come back whole
+SWEEP_FIELDS = ["user_facts", "expired_facts_count", "tier", "schema_version", "_codec", "v", "dict_id", "data"]
+
+# Messages hashed into a history_summary "through" fingerprint
+SUMMARY_FINGERPRINT_MESSAGES = 3
+
+# Per-request write counters, installed by the middleware in api/main.py
+request_write_stats: ContextVar[Optional[Dict[str, int]]] = ContextVar("request_write_stats", default=None)
+
+# Base delay for jittered exponential backoff between compare-and-swap retries,
+# and the retry after which it stops doubling
+CAS_BACKOFF_SECONDS = 0.02
+CAS_BACKOFF_MAX_DOUBLINGS = 5
+
+_MISSING = object()
+
+# Fields merged by appending our new items / applying our delta / keeping the
+# larger value on a write conflict
+APPEND_FIELDS = {"history"}
+COUNTER_FIELDS = {"balance", "expired_facts_count", "user_message_count", "assistant_message_count"}
+MAX_FIELDS = {"last_extraction_index"}
+
+
+class TrackedMemory(dict):
+    """
+    Memory dict that remembers its last persisted state and row version,
+    so saves can tell which top-level fields actually changed.
+    """
+    
+    def __init__(self, data: Dict[str, Any], version: Optional[int] = None):
+        super().__init__(data)
+        self._snapshot = copy.deepcopy(data)
+        self.version = version
+    
+    @property
+    def snapshot(self) -> Dict[str, Any]:
+        """Contents as of load/last save."""
+        return self._snapshot
+    
+    def dirty_fields(self) -> set:
+        """Top-level keys added, removed or changed since load/last save."""
+        keys = set(self) | set(self._snapshot)
+        return {k for k in keys if self.get(k, _MISSING) != self._snapshot.get(k, _MISSING)}
+    
+    def mark_clean(self, version: Optional[int]) -> None:
+        """Treat the current contents as persisted at `version`."""
+        self._snapshot = copy.deepcopy(dict(self))
+        self.version = version
+    
+    @classmethod
+    def unsaved(cls, data: Dict[str, Any]) -> "TrackedMemory":
+        """
+        Memory for a user with no row yet: version 0 (what stores report for a
+        missing row) and nothing persisted, so every field is dirty.
+        """
+        memory = cls(data, 0)
+        memory._snapshot = {}
+        return memory
+
+
+def default_memory() -> Dict[str, Any]:
+    """Default memory structure for new users."""
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "history": [],
+        "emotional_state": {
+            "closeness": 10, "warmth": 10, "pace": 10, 
+            "stability": 80, "scene_score": 0, "agency": 10
+        },
+        "user_profile": {
+            "name": "", "age": "", "gender": "", "companion_name": "Keepsake"
+        },
+        "active_context": {"last_topic": "", "significant_event": "", "event_date": "", "last_recalled_date": ""},
+        "history_summary": {"text": "", "through": "", "folded": 0},
+        "user_facts": [],
+        "expired_facts_count": 0,  # Free-tier facts purged after the memory window
+        # Running totals: history is truncated, so it can't be counted
+        "user_message_count": 0,
+        "assistant_message_count": 0,
+        "last_extraction_index": 0,  # user_message_count at the last fact extraction
+        "balance": 100,
+        "inventory": ["default"],
+        "current_outfit": "default",
+        "tier": 0,
+        "avatar_id": "1",
+        "has_chosen_avatar": False,
+        "time_offset": 0,
+        "last_active_timestamp": datetime.now().isoformat()
+    }
+
+
+def migrate_legacy_facts(facts_list: List[Any], stamped_at: Optional[str] = None) -> List[Dict[str, str]]:
+    """
+    Migrate old string-format facts to timestamped format.
+    Old: ["• User likes coffee"]
+    New: [{"content": "• User likes coffee", "created_at": "2024-01-15T10:30:00"}]
+    String facts get `stamped_at` (default: now); run it once and persist the result.
+    """
+    stamped_at = stamped_at or datetime.now().isoformat()
+    migrated = []
+    for fact in facts_list:
+        if isinstance(fact, str):
+            migrated.append({
+                "content": fact,
+                "created_at": stamped_at
+            })
+        elif isinstance(fact, dict) and "content" in fact:
+            migrated.append(fact)
+    return migrated
+
+
+def fact_epoch(fact: Dict[str, Any], default: float) -> float:
+    """Epoch seconds of a fact's ISO created_at, or `default` if it has none/can't parse."""
+    try:
+        return datetime.fromisoformat(fact["created_at"]).timestamp()
+    except (KeyError, ValueError, TypeError):
+        return default
+
+
+def new_fact(content: str) -> Dict[str, Any]:
+    """A fact stamped now: ISO created_at for people, created_ts for the expiry bisect."""
+    now = time.time()
+    return {
+        "content": content,
+        "created_at": datetime.fromtimestamp(now).isoformat(),
+        "created_ts": now
+    }
+
+
+def _fact_ts(fact: Any) -> float:
+    # app.py writes facts with only an ISO created_at; facts with no usable
+    # timestamp at all count as new
+    if not isinstance(fact, dict):
+        return math.inf
+    if "created_ts" in fact:
+        return fact["created_ts"]
+    return fact_epoch(fact, math.inf)
+
+
+def sort_facts(facts_list: List[Any]) -> List[Any]:
+    """
+    Sort facts oldest first, in place, if they aren't already (app.py appends
+    facts without created_ts to blobs the API keeps sorted). Returns the list.
+    """
+    keys = [_fact_ts(fact) for fact in facts_list]
+    if any(a > b for a, b in zip(keys, keys[1:])):
+        facts_list.sort(key=_fact_ts)
+    return facts_list
+
+
+def expired_prefix(facts_list: List[Any], tier: int, now: Optional[float] = None) -> int:
+    """
+    How many facts at the start of the list are past the tier's memory
+    window (0 for tiers with permanent memory). A bisect; the list is
+    sort_facts()ed first, so callers slice the sorted order.
+    """
+    hours = TIER_CONFIG.get(tier, TIER_CONFIG[0]).get("memory_hours")
+    if not hours or not facts_list:
+        return 0
+    cutoff = (now if now is not None else time.time()) - hours * 3600
+    return bisect.bisect_left(sort_facts(facts_list), cutoff, key=_fact_ts)
+
+
+def local_day(time_offset: int = 0) -> str:
+    """The user's current date (ISO), shifted by their time_offset in hours."""
+    return (datetime.now() + timedelta(hours=time_offset or 0)).date().isoformat()
+
+
+def record_message(memory: Dict[str, Any], role: str, content: str) -> None:
+    """Append a chat message to memory['history'] and bump the message counters."""
+    memory.setdefault('history', []).append({"role": role, "content": content})
+    if role == "assistant":
+        memory['assistant_message_count'] = memory.get('assistant_message_count', 0) + 1
+    elif role == "user":
+        memory['user_message_count'] = memory.get('user_message_count', 0) + 1
+
+
+def history_fingerprint(messages: List[Dict[str, Any]]) -> str:
+    """Short hash of the last few messages' role and content (seq and other keys ignored)."""
+    digest = hashlib.sha1()
+    for m in messages[-SUMMARY_FINGERPRINT_MESSAGES:]:
+        digest.update(f"{m.get('role')}:{m.get('content')}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def unsummarized_start(history: List[Dict[str, Any]], summary: Optional[Dict[str, Any]]) -> int:
+    """
+    Index of the first history message not yet folded into the summary.
+    History is truncated from the front, so the summary marks its end with a
+    fingerprint of the last folded messages rather than an index. 0 if there
+    is no summary, or its last folded messages have already been truncated away.
+    """
+    through = (summary or {}).get("through")
+    if not through:
+        return 0
+    for end in range(len(history), 0, -1):
+        if history_fingerprint(history[max(0, end - SUMMARY_FINGERPRINT_MESSAGES):end]) == through:
+            return end
+    return 0
+
+
+def needs_upgrade(data: Dict[str, Any]) -> bool:
+    """True if a blob predates SCHEMA_VERSION."""
+    return (data.get("schema_version") or 0) < SCHEMA_VERSION
+
+
+def upgrade_memory(data: Dict[str, Any], history: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Bring a blob up to SCHEMA_VERSION in place.
+    v1: backfill missing keys, timestamp legacy string facts, truncate history.
+    v2: facts carry a numeric created_ts and are sorted by it (oldest first).
+    v3: message counters, seeded from the (truncated) history still stored.
+    Pass `history` when it lives outside the blob (table mode).
+    """
+    version = data.get("schema_version") or 0
+    
+    if version < 1:
+        for key, value in default_memory().items():
+            if key not in data:
+                data[key] = value
+        data["user_facts"] = migrate_legacy_facts(data.get("user_facts") or [])
+        if len(data.get("history") or []) > HISTORY_LIMIT:
+            data["history"] = data["history"][-HISTORY_LIMIT:]
+    
+    if version < 2:
+        upgraded_at = time.time()
+        facts = [f for f in data.get("user_facts") or [] if isinstance(f, dict) and "content" in f]
+        for fact in facts:
+            fact["created_ts"] = fact_epoch(fact, upgraded_at)
+        facts.sort(key=lambda f: f["created_ts"])
+        data["user_facts"] = facts
+    
+    if version < 3:
+        messages = history if history is not None else data.get("history") or []
+        user_count = sum(1 for m in messages if m.get("role") == "user")
+        data["user_message_count"] = user_count
+        data["assistant_message_count"] = sum(1 for m in messages if m.get("role") == "assistant")
+        # Keep the every-few-messages extraction cadence where it was
+        data["last_extraction_index"] = user_count - user_count % 3
+    
+    data["schema_version"] = SCHEMA_VERSION
+    return data
+
+
+class UnavailableMemory(dict):
+    """
+    Default memory standing in for one that couldn't be read. It has no
+    version, so save_memory refuses it rather than overwrite the stored row.
+    """
+
+
+class MemoryProjection(dict):
+    """A read-only subset of memory fields, from load_memory(fields=...)."""
+    
+    def __init__(self, data: Dict[str, Any], version: Optional[int] = None):
+        super().__init__(data)
+        # Row version when served from a cached/full load, else None
+        self.version = version
+
+
+def merge_field(key: str, base: Any, ours: Any, theirs: Any) -> Any:
+    """
+    Three-way merge of one top-level memory field after a version conflict.
+    base is what we loaded, ours what we want to write, theirs what is stored now.
+    """
+    if theirs == base:
+        return ours
+    if ours == base:
+        return theirs
+    
+    if key in APPEND_FIELDS and isinstance(ours, list) and isinstance(theirs, list) \
+            and isinstance(base, list) and ours[:len(base)] == base:
+        # Replay the items we appended on top of theirs
+        return theirs + ours[len(base):]
+    
+    if key in COUNTER_FIELDS and all(isinstance(v, int) for v in (base, ours, theirs)):
+        # Apply our delta to the stored value
+        return theirs + (ours - base)
+    
+    if key in MAX_FIELDS and all(isinstance(v, int) for v in (ours, theirs)):
+        return max(ours, theirs)
+    
+    if all(isinstance(v, dict) for v in (base, ours, theirs)):
+        # Sub-keys we changed win; everything else keeps the stored value
+        merged = dict(theirs)
+        for sub_key in set(ours) | set(base):
+            if ours.get(sub_key, _MISSING) != base.get(sub_key, _MISSING):
+                if sub_key in ours:
+                    merged[sub_key] = ours[sub_key]
+                else:
+                    merged.pop(sub_key, None)
+        return merged
+    
+    return ours
 
 
 class MemoryService:
-    """Handles all memory-related operations with Supabase."""
+    """Handles all memory-related operations against the configured store."""
     
-    def __init__(self):
+    def __init__(self, store: Optional[MemoryStore] = None):
         settings = get_settings()
-        self.client: Client = create_client(settings.supabase_url, settings.supabase_key)
+        self.store = store or create_store(settings)
+        # (memory blob, row version) keyed by user_id. Callers always get a copy.
+        self.cache = TTLCache(
+            max_size=settings.memory_cache_size,
+            ttl=settings.memory_cache_ttl_seconds
+        )
+        # Single-flight: one in-progress database load per user_id
+        self._inflight_loads: Dict[str, asyncio.Future] = {}
+        self.deduplicated_loads = 0
+        # Blob writes performed, skipped because nothing changed, version conflicts,
+        # and stale blobs rewritten at SCHEMA_VERSION
+        self.write_stats = {"writes": 0, "skipped": 0, "conflicts": 0, "upgrades": 0}
+        # Compare-and-swap attempts after the first before a write gives up
+        self.cas_retries = settings.memory_cas_retries
+        # Writes that re-merge onto the current row (chat turns, facts) keep
+        # retrying past cas_retries for this long
+        self.cas_merge_seconds = settings.memory_cas_merge_seconds
+        # "blob": history lives in memories.data; "table": append-only chat_messages
+        self.history_storage = settings.history_storage
+        # Table mode: users whose blob still has a legacy 'history' key that is
+        # already in chat_messages. The next save rewrites the blob without it
+        self._blob_history: set = set()
+        # Tier-0 fact window per user: ((version, tier), valid_until, facts, expired_count)
+        self._fact_windows = TTLCache(
+            max_size=settings.memory_cache_size,
+            ttl=settings.memory_cache_ttl_seconds
+        )
+        # ACCOUNT_FIELDS per user, for pre-load checks. Refreshed from every blob
+        # loaded or written, so saves don't force a re-read
+        self._accounts = TTLCache(
+            max_size=settings.memory_cache_size,
+            ttl=settings.memory_cache_ttl_seconds
+        )
+        # Plain JSON blobs, or compressed envelopes (reads accept both)
+        self.codec = MemoryCodec(settings.memory_encoding, settings.memory_codec_dict_path)
+        # Active users' recall vectors, searched locally instead of via match_vectors
+        self.vector_index = VectorIndex(
+            self.store,
+            max_bytes=int(settings.vector_index_max_mb * 1024 * 1024),
+            user_max_vectors=settings.vector_index_user_max_vectors,
+            ttl=settings.vector_index_ttl_seconds,
+            dims=settings.embedding_dimensions,
+            quantization=settings.vector_quantization
+        )
+        # recall_vectors inserts, batched across users
+        self.vector_writer = VectorWriter(
+            self.store,
+            embedding_service,
+            max_batch=settings.vector_batch_size,
+            max_delay=settings.vector_batch_delay_ms / 1000,
+            max_queue=settings.vector_queue_size,
+            index=self.vector_index
+        )
     
     def get_default_memory(self) -> Dict[str, Any]:
         """Returns default memory structure for new users."""
-        return {
-            "history": [],
-            "emotional_state": {
-                "closeness": 10, "warmth": 10, "pace": 10, 
-                "stability": 80, "scene_score": 0, "agency": 10
-            },
-            "user_profile": {
-                "name": "", "age": "", "gender": "", "companion_name": "Keepsake"
-            },
-            "active_context": {"last_topic": "", "significant_event": "", "event_date": "", "last_recalled_date": ""},
-            "user_facts": [],
-            "balance": 100,
-            "inventory": ["default"],
-            "current_outfit": "default",
-            "tier": 0,
-            "avatar_id": "1",
-            "has_chosen_avatar": False,
-            "time_offset": 0,
-            "last_active_timestamp": datetime.now().isoformat()
-        }
+        return default_memory()
     
-    async def load_memory(self, user_id: str) -> Dict[str, Any]:
+    async def load_memory(
+        self,
+        user_id: str,
+        refresh: bool = False,
+        fields: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
         """
-        Load user memory from Supabase.
-        Returns default memory if not found.
+        Load user memory, from the cache if fresh, otherwise from the store.
+        Concurrent loads for the same user share one database request.
+        Pass refresh=True to bypass the cache and re-read the database.
+        Pass fields=[...] to read only those top-level keys (read-only result).
+        Returns a TrackedMemory (TrackedMemory.unsaved defaults if the user has
+        no row), or UnavailableMemory defaults, which can't be saved, if the
+        read failed.
         """
+        if fields is not None and not refresh:
+            return await self._load_fields(user_id, fields)
+        
         try:
-            response = self.client.table("memories").select("data").eq("id", user_id).execute()
-            
-            if response.data and len(response.data) > 0:
-                loaded_data = response.data[0]['data']
-                
-                # Migration: Add missing keys from default
-                default = self.get_default_memory()
-                for key, value in default.items():
-                    if key not in loaded_data:
-                        loaded_data[key] = value
-                
-                return loaded_data
+            if refresh:
+                entry = await self._fetch_memory(user_id)
+            else:
+                entry = self.cache.get(user_id)
+                if entry is None:
+                    task = self._inflight_loads.get(user_id)
+                    if task is None:
+                        task = asyncio.ensure_future(self._fetch_memory(user_id))
+                        self._inflight_loads[user_id] = task
+                        task.add_done_callback(lambda t: self._end_load(user_id, t))
+                    else:
+                        self.deduplicated_loads += 1
+                    
+                    # Shield so one caller being cancelled doesn't cancel the shared load
+                    entry = await asyncio.shield(task)
         except Exception as e:
             print(f"Error loading memory: {e}")
+            return UnavailableMemory(self.get_default_memory())
         
-        return self.get_default_memory()
+        if entry is None:
+            return TrackedMemory.unsaved(self.get_default_memory())
+        loaded_data, version = entry
+        return TrackedMemory(copy.deepcopy(loaded_data), version)
+    
+    async def _load_fields(self, user_id: str, fields: List[str]) -> "MemoryProjection":
+        """
+        Read a few top-level keys without downloading the whole blob.
+        Served from the cache or an in-flight full load when there is one.
+        """
+        default = self.get_default_memory()
+        
+        entry = self.cache.get(user_id)
+        if entry is None and user_id in self._inflight_loads:
+            self.deduplicated_loads += 1
+            try:
+                entry = await asyncio.shield(self._inflight_loads[user_id])
+            except Exception:
+                # Reported by the load's own caller; fall back to a field read
+                entry = None
+        if entry is None and self.codec.compressed:
+            # Compressed blobs can't be projected by the database: load it all (cached)
+            entry = (await self.load_memory(user_id), None)
+        
+        version = None
+        if entry is not None:
+            data, version = entry[0], getattr(entry[0], "version", entry[1])
+        else:
+            try:
+                data = await self.store.get_memory_fields(user_id, fields + ["schema_version"]) or {}
+            except Exception as e:
+                print(f"Error loading memory fields: {e}")
+                data = {}
+            if data and needs_upgrade(data):
+                # Stale layout: the full load upgrades and persists it
+                data = await self.load_memory(user_id)
+                version = getattr(data, "version", None)
+        
+        return MemoryProjection({
+            field: copy.deepcopy(data[field]) if data.get(field) is not None else default.get(field)
+            for field in fields
+        }, version)
+    
+    def _end_load(self, user_id: str, task: asyncio.Future) -> None:
+        """Forget a finished in-flight load."""
+        if self._inflight_loads.get(user_id) is task:
+            del self._inflight_loads[user_id]
+    
+    async def _fetch_memory(self, user_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        """
+        Read a memory blob from the store, refreshing the cache.
+        Blobs older than SCHEMA_VERSION are upgraded and written back first.
+        Returns (data, version), or None if the user has no row. Raises if the
+        read fails, so callers can tell an outage from a new user.
+        """
+        if self.history_storage == "table":
+            row, tail = await asyncio.gather(
+                self.store.get_memory(user_id),
+                self.store.get_messages(user_id, HISTORY_LIMIT)
+            )
+            if row is not None:
+                row = await self._upgrade_if_stale(user_id, self.codec.decode(row[0]), row[1], tail)
+                legacy_history = row[0].pop('history', None)
+                if legacy_history and not tail:
+                    moved = await self._move_blob_history(user_id, row, legacy_history)
+                    if moved is None:
+                        # Moved or written by someone else first: read what they left
+                        return await self._fetch_memory(user_id)
+                    tail, version = moved
+                    row = (row[0], version)
+                elif legacy_history is not None:
+                    # Already in chat_messages: the next save drops it from the blob
+                    self._blob_history.add(user_id)
+                row[0]['history'] = tail
+        else:
+            row = await self.store.get_memory(user_id)
+            if row is not None:
+                row = await self._upgrade_if_stale(user_id, self.codec.decode(row[0]), row[1])
+        
+        if row is not None:
+            # Facts app.py appended may be out of created_ts order
+            sort_facts(row[0].get('user_facts') or [])
+            self.cache.set(user_id, row)
+            self._set_account(user_id, row[0])
+        return row
+    
+    async def _move_blob_history(
+        self,
+        user_id: str,
+        row: Tuple[Dict[str, Any], int],
+        legacy_history: List[Dict[str, Any]]
+    ) -> Optional[Tuple[List[Dict[str, Any]], int]]:
+        """
+        Move legacy blob history into an empty chat_messages log, rewriting the
+        blob without it under the row's version (one store transaction, so a
+        concurrent move by another worker or the bulk migration can't copy it
+        twice). Returns (the moved tail with seqs, new version), or None if
+        the row or the log changed first.
+        """
+        data, version = row
+        new_version = await self.store.move_history(
+            user_id, legacy_history, self.codec.encode(data), expected_version=version
+        )
+        if new_version is None:
+            self._count_write("conflicts")
+            return None
+        self._count_write("upgrades")
+        tail = [
+            {"seq": seq, "role": m["role"], "content": m["content"]}
+            for seq, m in enumerate(legacy_history, start=1)
+        ]
+        return tail[-HISTORY_LIMIT:], new_version
+    
+    async def _upgrade_if_stale(
+        self,
+        user_id: str,
+        data: Dict[str, Any],
+        version: int,
+        history: Optional[List[Dict[str, Any]]] = None
+    ) -> Tuple[Dict[str, Any], int]:
+        """
+        Upgrade a blob older than SCHEMA_VERSION and persist it (compare-and-swap).
+        If someone else wrote in between, the upgraded copy is still returned;
+        the next read upgrades the newer row.
+        """
+        if not needs_upgrade(data):
+            return data, version
+        
+        upgrade_memory(data, history or None)
+        payload = data
+        if self.history_storage == "table" and not data.get('history'):
+            # Table-mode blobs only keep legacy history that's still to be moved
+            payload = {k: v for k, v in data.items() if k != 'history'}
+        new_version = await self.store.upsert_memory(
+            user_id, self.codec.encode(payload), expected_version=version
+        )
+        if new_version is None:
+            return data, version
+        self._count_write("upgrades")
+        return data, new_version
     
     async def save_memory(self, user_id: str, memory_data: Dict[str, Any]) -> bool:
         """
-        Save memory to Supabase.
+        Save memory to the store.
         Automatically truncates history to prevent payload bloat.
+        In table mode only new messages are written; the blob carries no history.
+        They are appended once the blob write has landed, so a turn whose write
+        fails (and is refunded and retried) leaves nothing in chat_messages.
+        For a TrackedMemory only changed fields are sent, as a compare-and-swap
+        on the loaded version; saving with nothing changed is a no-op.
         """
+        if isinstance(memory_data, MemoryProjection):
+            print("Error saving memory: refusing to save a partial (projected) memory")
+            return False
+        if isinstance(memory_data, UnavailableMemory):
+            # Defaults from a failed read: writing them would wipe the stored row
+            print("Error saving memory: refusing to save memory that couldn't be loaded")
+            return False
+        
+        tracked = isinstance(memory_data, TrackedMemory)
+        dirty = memory_data.dirty_fields() if tracked else set()
+        if tracked and not dirty:
+            self._count_write("skipped")
+            return True
+        
+        # Table mode: messages not yet in chat_messages (no seq)
+        new_messages = []
+        if self.history_storage == "table":
+            new_messages = [m for m in memory_data.get('history', []) if 'seq' not in m]
+        
         try:
-            # Truncate history before saving
-            if 'history' in memory_data and len(memory_data['history']) > 50:
-                memory_data['history'] = memory_data['history'][-50:]
+            if tracked:
+                saved, version = await self._compare_and_swap(user_id, memory_data, dirty)
+                if saved is None:
+                    print(f"Error saving memory: version conflict persisted for {self.cas_merge_seconds}s")
+                    self.invalidate(user_id)
+                    return False
+                # Reflect anything merged in from concurrent writers
+                memory_data.clear()
+                memory_data.update(saved)
+                memory_data.mark_clean(version)
+            else:
+                self._truncate_history(memory_data)
+                version = await self.store.upsert_memory(user_id, self._blob_payload(memory_data))
+                self._blob_history.discard(user_id)
+                self._count_write("writes")
+            
+            if new_messages:
+                # If this fails the blob is saved without them: the caller
+                # reports the turn as not saved and the cache is dropped below
+                await self._append_new_messages(user_id, new_messages)
+                if tracked:
+                    # The seqs just stamped aren't a change to save again
+                    memory_data.mark_clean(version)
             
-            self.client.table("memories").upsert({
-                "id": user_id,
-                "data": memory_data
-            }).execute()
+            self.cache.set(user_id, (copy.deepcopy(dict(memory_data)), version))
+            self._set_account(user_id, memory_data)
             return True
         except Exception as e:
             print(f"Error saving memory: {e}")
+            # The write may or may not have landed; re-read next time
+            self.invalidate(user_id)
             return False
     
-    async def create_user_memory(self, user_id: str, profile: Dict[str, Any]) -> Dict[str, Any]:
+    async def _compare_and_swap(
+        self,
+        user_id: str,
+        memory_data: "TrackedMemory",
+        dirty: set
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """
+        Write the dirty fields if the row is still at the loaded version.
+        On conflict, re-read the row, merge our changes onto it and retry.
+        Returns (saved data, new version), or (None, None) if the row kept
+        changing until _merge_attempts() ran out.
+        """
+        ours = dict(memory_data)
+        candidate = ours
+        version = memory_data.version
+        
+        for attempt in self._merge_attempts():
+            candidate = self._truncate_history(dict(candidate))
+            # Table mode: a blob still holding legacy history is replaced without it
+            drop_history = self.history_storage == "table" and user_id in self._blob_history
+            if all(k in candidate for k in dirty) and not drop_history:
+                changes = {k: candidate[k] for k in dirty}
+                if self.history_storage == "table":
+                    changes.pop('history', None)
+                if not changes:
+                    # Only new messages, appended to chat_messages by save_memory
+                    return candidate, version
+                new_version = await self._write_fields(user_id, candidate, changes, version)
+            else:
+                # A key was removed; patches can't express that, replace the blob
+                new_version = await self.store.upsert_memory(
+                    user_id, self._blob_payload(candidate), expected_version=version
+                )
+            
+            if new_version is not None:
+                self._blob_history.discard(user_id)
+                self._count_write("writes")
+                return candidate, new_version
+            
+            # Someone wrote in between: rebase our changes on the current row
+            self._count_write("conflicts")
+            await self._backoff(attempt)
+            entry = await self._fetch_memory(user_id)
+            if entry is None:
+                break
+            fresh, version = copy.deepcopy(entry[0]), entry[1]
+            if self.history_storage == "table":
+                fresh['history'] = ours.get('history', [])
+            
+            candidate = dict(fresh)
+            for key in dirty:
+                if key in ours:
+                    candidate[key] = merge_field(
+                        key,
+                        memory_data.snapshot.get(key),
+                        ours[key],
+                        fresh.get(key)
+                    )
+                else:
+                    candidate.pop(key, None)
+        
+        return None, None
+    
+    def _merge_attempts(self):
+        """
+        Attempt numbers for a write that is re-merged onto a fresh read after
+        each conflict, so retrying never loses anyone's changes: at least
+        cas_retries + 1, and more until cas_merge_seconds have passed.
+        """
+        deadline = time.monotonic() + self.cas_merge_seconds
+        attempt = 0
+        while attempt <= self.cas_retries or time.monotonic() < deadline:
+            yield attempt
+            attempt += 1
+    
+    async def _backoff(self, attempt: int) -> None:
+        """Jittered exponential delay so conflicting writers don't retry in lockstep."""
+        delay = CAS_BACKOFF_SECONDS * (2 ** min(attempt, CAS_BACKOFF_MAX_DOUBLINGS))
+        await asyncio.sleep(random.uniform(0, delay))
+    
+    def _truncate_history(self, memory_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Keep only the last HISTORY_LIMIT messages."""
+        if 'history' in memory_data and len(memory_data['history']) > HISTORY_LIMIT:
+            memory_data['history'] = memory_data['history'][-HISTORY_LIMIT:]
+        return memory_data
+    
+    def _blob_payload(self, memory_data: Dict[str, Any]) -> Dict[str, Any]:
+        """The memories.data value to store (no history in table mode), encoded."""
+        if self.history_storage == "table":
+            return self.codec.encode({k: v for k, v in memory_data.items() if k != 'history'})
+        return self.codec.encode(dict(memory_data))
+    
+    async def _write_fields(
+        self,
+        user_id: str,
+        base: Dict[str, Any],
+        changes: Dict[str, Any],
+        expected_version: Optional[int]
+    ) -> Optional[int]:
+        """
+        Write changes made to `base` if the row is still at expected_version.
+        A JSON patch, or for compressed blobs (opaque to the database) the
+        whole re-encoded blob. Returns the new version, or None on a conflict.
+        """
+        if not self.codec.compressed:
+            return await self.store.patch_memory(user_id, changes, expected_version=expected_version)
+        
+        data = apply_memory_patch(copy.deepcopy(dict(base)), changes)
+        return await self.store.upsert_memory(
+            user_id, self._blob_payload(self._truncate_history(data)), expected_version=expected_version
+        )
+    
+    def _count_write(self, kind: str) -> None:
+        """Record a write, a skipped no-op save, or a version conflict."""
+        self.write_stats[kind] += 1
+        stats = request_write_stats.get()
+        if stats is not None:
+            stats[kind] = stats.get(kind, 0) + 1
+    
+    def _apply_to_cache(self, user_id: str, changes: Dict[str, Any], old_version: Optional[int], new_version: int) -> None:
+        """Apply a patch we just wrote to the cached blob, if the cache was current."""
+        entry = self.cache.peek(user_id)
+        if entry is not None and old_version is not None and entry[1] == old_version:
+            self.cache.set(user_id, (apply_memory_patch(entry[0], changes), new_version))
+            self._set_account(user_id, entry[0])
+        else:
+            self.invalidate(user_id)
+    
+    def _set_account(self, user_id: str, data: Dict[str, Any]) -> None:
+        """Cache ACCOUNT_FIELDS from a blob just loaded or written."""
+        self._accounts.set(user_id, {field: copy.deepcopy(data.get(field)) for field in ACCOUNT_FIELDS})
+    
+    async def patch_memory(
+        self,
+        user_id: str,
+        changes: Dict[str, Any],
+        expected_version: Optional[int] = None
+    ) -> bool:
+        """
+        Write only the given fields, e.g. {"balance": 90, "user_profile.name": "Sam"}.
+        Sends one small RPC instead of upserting the whole blob.
+        
+        With expected_version (the version the changes were computed from),
+        the write only lands if the row is still at that version; False on a
+        conflict, so the caller can re-read and retry. Without it the given
+        paths are overwritten whatever else was written since: use that only
+        for values that don't depend on what was read.
+        """
+        if not changes:
+            return True
+        
+        if self.codec.compressed:
+            # Compressed blobs can't be patched in place: read-modify-write with CAS
+            memory = await self.load_memory(user_id)
+            if expected_version is not None and getattr(memory, 'version', None) != expected_version:
+                self._count_write("conflicts")
+                self.invalidate(user_id)
+                return False
+            apply_memory_patch(memory, changes)
+            return await self.save_memory(user_id, memory)
+        
+        try:
+            new_version = await self.store.patch_memory(user_id, changes, expected_version=expected_version)
+        except Exception as e:
+            print(f"Error patching memory: {e}")
+            self.invalidate(user_id)
+            return False
+        if new_version is None:
+            self._count_write("conflicts")
+            self.invalidate(user_id)
+            return False
+        self._count_write("writes")
+        # Without an expected version we can't know the cached copy was current
+        self._apply_to_cache(user_id, changes, expected_version, new_version)
+        return True
+    
+    async def update_memory(
+        self,
+        user_id: str,
+        compute: Callable[[Dict[str, Any]], Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Read-check-write for changes that depend on what was read (spending
+        coins, one-time choices). compute(memory) returns the patch to write,
+        or raises to refuse. The patch is written only if the row is still at
+        the version read; on a conflict the memory is re-read and compute runs
+        again. Returns the patch written, or None if the retries ran out (or
+        the memory couldn't be read).
+        """
+        for attempt in range(self.cas_retries + 1):
+            memory = await self.load_memory(user_id)
+            version = getattr(memory, 'version', None)
+            if version is not None:
+                changes = compute(memory)
+                if not memory.snapshot:
+                    written = await self._create_memory(user_id, apply_memory_patch(dict(memory), changes))
+                else:
+                    written = await self.patch_memory(user_id, changes, expected_version=version)
+                if written:
+                    return changes
+            await self._backoff(attempt)
+        return None
+    
+    async def _create_memory(self, user_id: str, data: Dict[str, Any]) -> bool:
+        """
+        Write the first row for a user, whole (a patch would leave out the other
+        default fields). False if a row was created in the meantime.
+        """
+        try:
+            new_version = await self.store.upsert_memory(
+                user_id, self._blob_payload(self._truncate_history(data)), expected_version=0
+            )
+        except Exception as e:
+            print(f"Error creating memory: {e}")
+            self.invalidate(user_id)
+            return False
+        if new_version is None:
+            self._count_write("conflicts")
+            self.invalidate(user_id)
+            return False
+        self._count_write("writes")
+        self.cache.set(user_id, (data, new_version))
+        self._set_account(user_id, data)
+        return True
+    
+    async def _append_new_messages(self, user_id: str, new_messages: List[Dict[str, Any]]) -> None:
+        """Append messages not yet in chat_messages (those without a seq) and stamp their seqs."""
+        last_seq = await self.store.append_messages(user_id, new_messages)
+        
+        # Stamp seqs so the next save doesn't append them again
+        first_seq = last_seq - len(new_messages) + 1
+        for offset, message in enumerate(new_messages):
+            message['seq'] = first_seq + offset
+    
+    async def load_history(self, user_id: str, limit: int = HISTORY_LIMIT) -> List[Dict[str, Any]]:
+        """
+        Load the most recent `limit` chat messages, oldest first.
+        In table mode this reads only the tail, without the memory blob.
+        """
+        if self.history_storage == "table":
+            try:
+                return await self.store.get_messages(user_id, limit)
+            except Exception as e:
+                print(f"Error loading history: {e}")
+                return []
+        
+        memory = await self.load_memory(user_id)
+        return memory.get('history', [])[-limit:]
+    
+    def summary_range(self, memory: Dict[str, Any], keep: int) -> Optional[Tuple[int, int]]:
+        """
+        (start, end) slice of memory['history'] to fold into the rolling summary,
+        or None until SUMMARY_FOLD_MESSAGES messages sit before the last `keep`
+        (the ones sent verbatim with each prompt).
+        """
+        fold = get_settings().summary_fold_messages
+        if fold <= 0:
+            return None
+        history = memory.get('history') or []
+        start = unsummarized_start(history, memory.get('history_summary'))
+        end = len(history) - keep
+        if end - start < fold:
+            return None
+        return start, end
+    
+    def prompt_history(self, memory: Dict[str, Any], keep: int) -> List[Dict[str, Any]]:
+        """
+        Messages to send verbatim with the prompt: the last `keep`, plus every
+        earlier one not yet folded into the summary, so nothing falls between the
+        summary and the window while a fold is pending. At most
+        SUMMARY_FOLD_MESSAGES + keep (older messages are left to the summary).
+        """
+        history = memory.get('history') or []
+        fold = get_settings().summary_fold_messages
+        if fold <= 0:
+            return history[-keep:]
+        start = unsummarized_start(history, memory.get('history_summary'))
+        start = max(min(start, len(history) - keep), len(history) - keep - fold, 0)
+        return history[start:]
+    
+    async def save_history_summary(
+        self,
+        user_id: str,
+        summary: Dict[str, Any],
+        based_on: Dict[str, Any]
+    ) -> bool:
+        """
+        Store a new history_summary built on top of `based_on`.
+        Dropped (returns False) if the stored summary has moved on meanwhile,
+        e.g. another process folded the same messages first.
+        """
+        try:
+            entry = self.cache.peek(user_id)
+            
+            for attempt in range(self.cas_retries + 1):
+                if entry is None:
+                    entry = await self._fetch_memory(user_id)
+                    if entry is None:
+                        return False
+                current_data, version = entry
+                if (current_data.get('history_summary') or {}) != (based_on or {}):
+                    self._count_write("skipped")
+                    return False
+                
+                changes = {'history_summary': summary}
+                new_version = await self._write_fields(user_id, current_data, changes, version)
+                if new_version is not None:
+                    self._count_write("writes")
+                    self._apply_to_cache(user_id, changes, version, new_version)
+                    return True
+                
+                self._count_write("conflicts")
+                await self._backoff(attempt)
+                entry = None
+            
+            print(f"Error saving history summary: version conflict persisted after {self.cas_retries} retries")
+            self.invalidate(user_id)
+            return False
+        except Exception as e:
+            print(f"Error saving history summary: {e}")
+            return False
+    
+    async def load_account(self, user_id: str) -> Dict[str, Any]:
+        """
+        The user's tier and time_offset (ACCOUNT_FIELDS), for checks that run
+        before load_memory. Cached, so rejecting a request usually costs no
+        database read; on a miss only these fields are read (projected), so a
+        rejected request never downloads the blob. Compressed blobs can't be
+        projected and are loaded whole (and cached for the request's load).
+        """
+        account = self._accounts.get(user_id)
+        if account is not None:
+            return account
+        
+        entry = self.cache.get(user_id)
+        if entry is None and self.codec.compressed:
+            memory = await self.load_memory(user_id)
+            if isinstance(memory, UnavailableMemory):
+                return {field: memory.get(field) for field in ACCOUNT_FIELDS}
+            entry = (memory, memory.version)
+        
+        if entry is not None:
+            data = entry[0]
+        else:
+            try:
+                # Older layouts have the same top-level tier/time_offset keys
+                data = await self.store.get_memory_fields(user_id, ACCOUNT_FIELDS) or {}
+            except Exception as e:
+                print(f"Error loading account: {e}")
+                default = self.get_default_memory()
+                return {field: default.get(field) for field in ACCOUNT_FIELDS}
+        
+        account = {field: copy.deepcopy(data.get(field)) for field in ACCOUNT_FIELDS}
+        self._accounts.set(user_id, account)
+        return account
+    
+    def message_limit(self, account: Dict[str, Any]) -> Optional[int]:
+        """The tier's daily message_limit, or None if it has none."""
+        return TIER_CONFIG.get(account.get('tier') or 0, TIER_CONFIG[0]).get('message_limit') or None
+    
+    async def take_message_quota(self, user_id: str, account: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Count a message in the daily ledger, on the user's local day, against
+        the tier's message_limit. False if today's quota is used up (nothing
+        was counted). Tiers without a limit pass without a database call;
+        count their message with count_message() once the reply is out.
+        `account` is anything with ACCOUNT_FIELDS, e.g. load_account().
+        """
+        account = account if account is not None else await self.load_account(user_id)
+        limit = self.message_limit(account)
+        if limit is None:
+            return True
+        
+        try:
+            used = await self.store.take_quota(user_id, local_day(account.get('time_offset') or 0), limit)
+        except Exception as e:
+            # Fail open: a ledger outage shouldn't block chat
+            print(f"Error taking message quota: {e}")
+            return True
+        return used is not None
+    
+    async def count_message(self, user_id: str, account: Dict[str, Any]) -> None:
+        """
+        Count a message of a tier without a message_limit in the ledger, for
+        messages_today. Nothing is checked, so run it after the reply.
+        """
+        try:
+            await self.store.take_quota(user_id, local_day(account.get('time_offset') or 0), None)
+        except Exception as e:
+            print(f"Error counting message: {e}")
+    
+    async def refund_message_quota(self, user_id: str, account: Dict[str, Any]) -> None:
+        """Give back the message take_message_quota counted, when the turn failed."""
+        if self.message_limit(account) is None:
+            # Not counted until the reply was out
+            return
+        try:
+            await self.store.refund_quota(user_id, local_day(account.get('time_offset') or 0))
+        except Exception as e:
+            print(f"Error refunding message quota: {e}")
+    
+    async def messages_today(self, user_id: str, account: Dict[str, Any]) -> Optional[int]:
+        """User messages on the user's local day, from the ledger (None if it can't be read)."""
+        try:
+            return await self.store.get_quota(user_id, local_day(account.get('time_offset') or 0))
+        except Exception as e:
+            print(f"Error reading message quota: {e}")
+            return None
+    
+    def get_load_stats(self) -> Dict[str, int]:
+        """Single-flight counters for /metrics."""
+        return {
+            "in_flight": len(self._inflight_loads),
+            "deduplicated": self.deduplicated_loads
+        }
+    
+    async def history_tails(self, user_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        In table mode, the last HISTORY_LIMIT messages of each user, which
+        upgrade_memory() needs to seed the message counters ({} in blob mode).
+        """
+        if self.history_storage != "table" or not user_ids:
+            return {}
+        tails = await asyncio.gather(*(self.store.get_messages(user_id, HISTORY_LIMIT) for user_id in user_ids))
+        return dict(zip(user_ids, tails))
+    
+    async def purge_expired_facts(self, rows: List[Tuple[str, Dict[str, Any], int]]) -> Dict[str, int]:
+        """
+        Drop facts past their tier's memory window from scanned (user_id, stored
+        blob or SWEEP_FIELDS projection, version) rows, adding them to
+        expired_facts_count. Current plain rows are patched from the projection;
+        compressed and pre-SCHEMA_VERSION rows are upgraded and rewritten whole,
+        in one batched write. Rows changed since they were read are left for
+        the next sweep.
+        """
+        stats = {"users": 0, "facts": 0, "conflicts": 0}
+        now = time.time()
+        patches, whole, legacy = [], [], []
+        
+        for user_id, stored, version in rows:
+            data = self.codec.decode(stored)
+            # Legacy facts only get their created_ts in the upgrade
+            view = upgrade_memory(copy.deepcopy(data)) if needs_upgrade(data) else data
+            if not expired_prefix(view.get('user_facts') or [], view.get('tier') or 0, now):
+                continue
+            if is_encoded(stored):
+                whole.append((user_id, data, version))
+            elif needs_upgrade(data):
+                legacy.append(user_id)
+            else:
+                patches.append((user_id, data, version))
+        
+        # Projected legacy rows: the upgrade needs the whole blob
+        fetched = await asyncio.gather(*(self.store.get_memory(user_id) for user_id in legacy))
+        whole += [
+            (user_id, self.codec.decode(row[0]), row[1])
+            for user_id, row in zip(legacy, fetched) if row is not None
+        ]
+        
+        written = await asyncio.gather(*(
+            self._purge_patch(user_id, data, version, now) for user_id, data, version in patches
+        ))
+        if whole:
+            written += await self._purge_whole(whole, now)
+        
+        for expired in written:
+            if expired is None:
+                stats["conflicts"] += 1
+            elif expired:
+                stats["users"] += 1
+                stats["facts"] += expired
+        return stats
+    
+    async def _purge_patch(self, user_id: str, data: Dict[str, Any], version: int, now: float) -> Optional[int]:
+        """Patch one current row's facts. Returns the facts purged, or None on a conflict."""
+        facts = data.get('user_facts') or []
+        expired = expired_prefix(facts, data.get('tier') or 0, now)
+        changes = {
+            'user_facts': facts[expired:],
+            'expired_facts_count': (data.get('expired_facts_count') or 0) + expired
+        }
+        new_version = await self.store.patch_memory(user_id, changes, expected_version=version)
+        if new_version is None:
+            return None
+        self._count_write("writes")
+        self._apply_to_cache(user_id, changes, version, new_version)
+        return expired
+    
+    async def _purge_whole(self, rows: List[Tuple[str, Dict[str, Any], int]], now: float) -> List[Optional[int]]:
+        """Upgrade and purge decoded whole blobs in one put_memories. Facts purged per row, None on a conflict."""
+        tails = await self.history_tails([user_id for user_id, data, _ in rows if needs_upgrade(data)])
+        batch, purged = [], []
+        
+        for user_id, data, version in rows:
+            if needs_upgrade(data):
+                upgrade_memory(data, tails.get(user_id) or None)
+                if self.history_storage == "table" and not data.get('history'):
+                    data.pop('history', None)
+            facts = data.get('user_facts') or []
+            expired = expired_prefix(facts, data.get('tier', 0), now)
+            if not expired:
+                continue
+            
+            changes = {
+                'user_facts': facts[expired:],
+                'expired_facts_count': (data.get('expired_facts_count') or 0) + expired
+            }
+            data.update(changes)
+            batch.append((user_id, self.codec.encode(data), version))
+            purged.append((changes, expired))
+        
+        if not batch:
+            return []
+        
+        versions = await self.store.put_memories(batch)
+        written = []
+        for (user_id, _, old_version), (changes, expired), new_version in zip(batch, purged, versions):
+            if new_version is None:
+                written.append(None)
+                continue
+            self._count_write("writes")
+            self._apply_to_cache(user_id, changes, old_version, new_version)
+            written.append(expired)
+        return written
+    
+    def get_write_stats(self) -> Dict[str, int]:
+        """Write/skip counters for /metrics."""
+        return dict(self.write_stats)
+    
+    def invalidate(self, user_id: str) -> None:
+        """Drop a user's cached memory so the next load hits the database."""
+        self.cache.invalidate(user_id)
+        self._accounts.invalidate(user_id)
+    
+    async def create_user_memory(
+        self,
+        user_id: str,
+        profile: Dict[str, Any],
+        avatar_id: str = "1"
+    ) -> Dict[str, Any]:
         """Create initial memory for a new user."""
         memory = self.get_default_memory()
         memory['user_profile'] = profile
+        memory['avatar_id'] = avatar_id
         memory['has_chosen_avatar'] = True
         
         await self.save_memory(user_id, memory)
         return memory
     
-    def migrate_legacy_facts(self, facts_list: List[Any]) -> List[Dict[str, str]]:
-        """
-        Migrate old string-format facts to timestamped format.
-        Old: ["• User likes coffee"]
-        New: [{"content": "• User likes coffee", "created_at": "2024-01-15T10:30:00"}]
-        """
-        migrated = []
-        for fact in facts_list:
-            if isinstance(fact, str):
-                migrated.append({
-                    "content": fact,
-                    "created_at": datetime.now().isoformat()
-                })
-            elif isinstance(fact, dict) and "content" in fact:
-                migrated.append(fact)
-        return migrated
-    
     def get_valid_facts_with_expiry(
         self, 
         facts_list: List[Any], 
-        tier: int
+        tier: int,
+        user_id: Optional[str] = None,
+        version: Optional[int] = None
     ) -> Tuple[List[str], int]:
         """
         Get facts valid for user's tier and count expired facts.
@@ -119,42 +1196,38 @@ class MemoryService:
         Tier 0: Only facts from last 48 hours
         Tier 1+: All facts (permanent)
         
+        Facts are sorted by created_ts, so the window start is a bisect.
+        Pass the user_id and blob version to reuse the result until the
+        blob changes or its oldest valid fact expires.
+        
         Returns:
             Tuple of (list of valid fact strings, count of expired facts)
         """
         if not facts_list:
             return [], 0
         
-        facts_list = self.migrate_legacy_facts(facts_list)
-        
-        # Tier 1+ gets all facts
+        # Tier 1+ gets all facts (legacy string facts are upgraded on load)
         if tier >= 1:
             return [f["content"] for f in facts_list if isinstance(f, dict) and "content" in f], 0
         
+        now = time.time()
+        if user_id is not None and version is not None:
+            memo = self._fact_windows.get(user_id)
+            if memo is not None and memo[0] == (version, tier) and now < memo[1]:
+                return list(memo[2]), memo[3]
+        
         # Tier 0: Filter to last 48 hours
         tier_config = TIER_CONFIG.get(tier, TIER_CONFIG[0])
-        cutoff_hours = tier_config.get("memory_hours", 48)
-        cutoff = datetime.now() - timedelta(hours=cutoff_hours)
-        
-        valid_facts = []
-        expired_count = 0
+        window = tier_config.get("memory_hours", 48) * 3600
+        start = expired_prefix(facts_list, tier, now)
+        valid_facts = [f["content"] for f in facts_list[start:] if isinstance(f, dict) and "content" in f]
+        expired_count = start
         
-        for fact in facts_list:
-            if not isinstance(fact, dict) or "content" not in fact:
-                continue
-            
-            created_str = fact.get("created_at", "")
-            if created_str:
-                try:
-                    created = datetime.fromisoformat(created_str)
-                    if created >= cutoff:
-                        valid_facts.append(fact["content"])
-                    else:
-                        expired_count += 1
-                except (ValueError, TypeError):
-                    valid_facts.append(fact["content"])
-            else:
-                valid_facts.append(fact["content"])
+        if user_id is not None and version is not None:
+            # Valid until the oldest remaining fact falls out of the window
+            oldest = _fact_ts(facts_list[start]) if start < len(facts_list) else math.inf
+            self._fact_windows.set(user_id, ((version, tier), oldest + window, valid_facts, expired_count))
+            valid_facts = list(valid_facts)
         
         return valid_facts, expired_count
     
@@ -165,49 +1238,61 @@ class MemoryService:
         new_event: Optional[Tuple[str, str]] = None
     ) -> bool:
         """
-        Save new facts to user memory.
-        Thread-safe: Loads fresh DB state, merges, saves.
+        Save new facts to user memory, skipping duplicates and near-duplicates.
+        Merges onto the cached blob and writes with compare-and-swap on its
+        version; only re-reads the database after a conflict or cache miss.
         """
         if not new_facts and not new_event:
             return True
         
         try:
-            # Load fresh state
-            response = self.client.table("memories").select("data").eq("id", user_id).execute()
+            entry = self.cache.peek(user_id)
             
-            if not response.data or len(response.data) == 0:
-                return False
-            
-            current_data = response.data[0]['data']
-            
-            # Migrate and merge facts
-            existing_facts = self.migrate_legacy_facts(current_data.get('user_facts', []))
-            existing_contents = [f.get("content", "") for f in existing_facts if isinstance(f, dict)]
-            
-            # Add new timestamped facts
-            for fact_content in new_facts:
-                if fact_content not in existing_contents:
-                    existing_facts.append({
-                        "content": fact_content,
-                        "created_at": datetime.now().isoformat()
-                    })
-            
-            # Keep last 20 facts
-            current_data['user_facts'] = existing_facts[-20:]
-            
-            # Update event if provided
-            if new_event:
-                event_name, event_date = new_event
-                current_data['active_context']['significant_event'] = event_name
-                current_data['active_context']['event_date'] = event_date
-            
-            # Save
-            self.client.table("memories").upsert({
-                "id": user_id,
-                "data": current_data
-            }).execute()
+            for attempt in self._merge_attempts():
+                if entry is None:
+                    entry = await self._fetch_memory(user_id)
+                    if entry is None:
+                        return False
+                current_data, version = entry
+                
+                # Merge facts: exact repeats are dropped, paraphrases replace
+                # the older phrasing (loaded blobs are already at SCHEMA_VERSION)
+                # New facts go last, so the list stays sorted by created_ts
+                stored_facts = current_data.get('user_facts', [])
+                # Free tier: drop expired facts so they don't take any of the 20 slots
+                expired = expired_prefix(stored_facts, current_data.get('tier', 0))
+                index = FactIndex(stored_facts[expired:])
+                outcomes = [index.add(new_fact(fact_content)) for fact_content in new_facts]
+                if not new_event and not expired and all(o == "duplicate" for o in outcomes):
+                    self._count_write("skipped")
+                    return True
+                
+                # Keep last 20 facts
+                changes = {'user_facts': index.facts()[-20:]}
+                if expired:
+                    changes['expired_facts_count'] = current_data.get('expired_facts_count', 0) + expired
+                
+                # Update event if provided
+                if new_event:
+                    event_name, event_date = new_event
+                    changes['active_context.significant_event'] = event_name
+                    changes['active_context.event_date'] = event_date
+                
+                # Save
+                new_version = await self._write_fields(user_id, current_data, changes, version)
+                if new_version is not None:
+                    self._count_write("writes")
+                    self._apply_to_cache(user_id, changes, version, new_version)
+                    return True
+                
+                # Lost the race to another write: re-read and merge again
+                self._count_write("conflicts")
+                await self._backoff(attempt)
+                entry = None
             
-            return True
+            print(f"Error saving facts: version conflict persisted for {self.cas_merge_seconds}s")
+            self.invalidate(user_id)
+            return False
         except Exception as e:
             print(f"Error saving facts: {e}")
             return False
@@ -235,49 +1320,38 @@ class MemoryService:
         return current_scores
     
     async def get_embedding(self, text: str) -> List[float]:
-        """Create embedding for text using OpenAI."""
-        from openai import AsyncOpenAI
-        settings = get_settings()
-        client = AsyncOpenAI(api_key=settings.openai_api_key)
-        
-        response = await client.embeddings.create(
-            input=text,
-            model="text-embedding-3-small"
-        )
-        return response.data[0].embedding
+        """Create embedding for text using OpenAI (cached by content hash)."""
+        return await embedding_service.embed(text)
     
-    async def save_vector_memory(self, user_id: str, text: str) -> bool:
-        """Save text with embedding to vector store for RAG."""
-        try:
-            embedding = await self.get_embedding(text)
-            
-            self.client.table("recall_vectors").insert({
-                "user_id": user_id,
-                "content": text,
-                "embedding": embedding
-            }).execute()
-            return True
-        except Exception as e:
-            print(f"Error saving vector: {e}")
-            return False
+    def save_vector_memory(self, user_id: str, text: str, embedding: Optional[List[float]] = None) -> bool:
+        """
+        Queue text to be embedded and saved to the vector store for RAG.
+        Pass the embedding if this turn already computed it.
+        Written in batches by the vector writer; False if its queue is full.
+        """
+        return self.vector_writer.submit(user_id, text, embedding)
     
-    async def retrieve_context(self, user_id: str, query: str, threshold: float = 0.5, count: int = 3) -> str:
+    async def retrieve_context(
+        self,
+        user_id: str,
+        query: str,
+        threshold: float = 0.5,
+        count: int = 3,
+        embedding: Optional[List[float]] = None
+    ) -> str:
         """
         RAG: Retrieve relevant past memories based on query.
+        Pass the query's embedding if it was already computed.
         Returns formatted context string.
         """
         try:
-            embedding = await self.get_embedding(query)
+            if embedding is None:
+                embedding = await self.get_embedding(query)
             
-            response = self.client.rpc("match_vectors", {
-                "query_embedding": embedding,
-                "match_threshold": threshold,
-                "match_count": count,
-                "filter_user": user_id
-            }).execute()
+            matches = await self.vector_index.search(user_id, embedding, threshold, count)
             
-            if response.data:
-                return "\n".join([f"- {item['content']}" for item in response.data])
+            if matches:
+                return "\n".join([f"- {item['content']}" for item in matches])
             return ""
         except Exception as e:
             print(f"RAG retrieval error: {e}")
@@ -0,0 +1,238 @@
+"""
+Keepsake Rate Limiter
+Per-user token buckets in front of the chat endpoints (and so OpenAI spend).
+
+Each user has a bucket of up to `limit` tokens that refills at limit/60
+tokens per second. A request takes one token, or is rejected with the time
+until the next token is available (sent back as Retry-After).
+
+- LocalBuckets: in-process dict (one worker)
+- SQLiteBuckets: a small SQLite file shared by all workers on one host,
+  the local stand-in for a shared store such as Redis
+
+A bucket left alone long enough refills completely, which is the same as
+having no bucket, so idle buckets are dropped without changing any outcome.
+"""
+import asyncio
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from api.config import get_settings, TIER_CONFIG
+from api.services.memory import memory_service
+
+# SQLiteBuckets deletes idle buckets once every this many checks
+SQLITE_PRUNE_EVERY = 1000
+
+SQLITE_SCHEMA = """
+create table if not exists rate_buckets (
+    key text primary key,
+    tokens real not null,
+    updated real not null,
+    full_at real not null
+);
+create index if not exists rate_buckets_full_at on rate_buckets (full_at);
+"""
+
+
+def refill(
+    tokens: Optional[float],
+    updated: float,
+    now: float,
+    limit: int
+) -> Tuple[float, float, float]:
+    """
+    Take one token from a bucket holding `tokens` at time `updated` (None: new bucket).
+    Returns (tokens left, seconds to wait (0.0 if allowed), time it is full again).
+    """
+    rate = limit / 60.0
+    if tokens is None:
+        tokens = float(limit)
+    else:
+        tokens = min(float(limit), tokens + (now - updated) * rate)
+
+    if tokens >= 1.0:
+        tokens -= 1.0
+        wait = 0.0
+    else:
+        wait = (1.0 - tokens) / rate
+    return tokens, wait, now + (limit - tokens) / rate
+
+
+class RateLimitBackend(ABC):
+    """Where token buckets live."""
+
+    @abstractmethod
+    async def take(self, key: str, limit: int) -> float:
+        """Take a token from `key`'s bucket. Returns 0.0, or seconds until one is available."""
+
+    def stats(self) -> Dict[str, Any]:
+        """Backend counters for /metrics."""
+        return {}
+
+    def close(self) -> None:
+        """Release resources."""
+
+
+class LocalBuckets(RateLimitBackend):
+    """
+    Buckets in an LRU-ordered dict: O(1) per check, at most `max_buckets`
+    entries. Full (idle) buckets are dropped from the cold end as we go.
+    Not thread-safe: meant to be used from the event loop only.
+    """
+
+    def __init__(self, max_buckets: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.max_buckets = max_buckets
+        self.clock = clock
+        # key -> (tokens, updated, full_at), least recently used first
+        self._buckets: "OrderedDict[str, Tuple[float, float, float]]" = OrderedDict()
+        self.evictions = 0
+
+    async def take(self, key: str, limit: int) -> float:
+        now = self.clock()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            tokens, wait, full_at = refill(None, now, now, limit)
+        else:
+            tokens, wait, full_at = refill(bucket[0], bucket[1], now, limit)
+        self._buckets[key] = (tokens, now, full_at)
+
+        # Amortized O(1): each bucket is dropped at most once
+        while self._buckets:
+            oldest_key, oldest = next(iter(self._buckets.items()))
+            if oldest[2] > now and len(self._buckets) <= self.max_buckets:
+                break
+            del self._buckets[oldest_key]
+            self.evictions += 1
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        return {"buckets": len(self._buckets), "max_buckets": self.max_buckets, "evictions": self.evictions}
+
+
+class SQLiteBuckets(RateLimitBackend):
+    """
+    Buckets in a SQLite table, so every worker process on the host shares
+    each user's limit. One read-modify-write transaction per check, on a
+    single I/O thread; idle rows are pruned every SQLITE_PRUNE_EVERY checks.
+    """
+
+    def __init__(self, path: str = "ratelimit.db", timeout: float = 10.0, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.timeout = timeout
+        # Wall clock: buckets are shared between processes
+        self.clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="keepsake-ratelimit")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._checks = 0
+        self.pruned = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the connection on first use (on the I/O thread)."""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=self.timeout)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            conn.executescript(SQLITE_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _take(self, key: str, limit: int, prune: bool) -> float:
+        conn = self._connect()
+        now = self.clock()
+        conn.execute("begin immediate")
+        try:
+            row = conn.execute("select tokens, updated from rate_buckets where key = ?", (key,)).fetchone()
+            tokens, wait, full_at = refill(row[0] if row else None, row[1] if row else now, now, limit)
+            conn.execute(
+                "insert into rate_buckets (key, tokens, updated, full_at) values (?, ?, ?, ?) "
+                "on conflict (key) do update set tokens = excluded.tokens, "
+                "updated = excluded.updated, full_at = excluded.full_at",
+                (key, tokens, now, full_at)
+            )
+            if prune:
+                self.pruned += conn.execute("delete from rate_buckets where full_at <= ?", (now,)).rowcount
+        except BaseException:
+            conn.execute("rollback")
+            raise
+        conn.execute("commit")
+        return wait
+
+    async def take(self, key: str, limit: int) -> float:
+        self._checks += 1
+        prune = self._checks % SQLITE_PRUNE_EVERY == 0
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(
+            loop.run_in_executor(self._executor, self._take, key, limit, prune),
+            timeout=self.timeout
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pruned": self.pruned}
+
+    def close(self) -> None:
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close)
+        self._executor.shutdown(wait=False)
+
+
+def create_rate_limit_backend(settings) -> RateLimitBackend:
+    """Build the backend selected by RATE_LIMIT_BACKEND ("local" or "sqlite")."""
+    if settings.rate_limit_backend == "sqlite":
+        return SQLiteBuckets(settings.rate_limit_sqlite_path, timeout=settings.db_timeout_seconds)
+    if settings.rate_limit_backend != "local":
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {settings.rate_limit_backend}")
+    return LocalBuckets(settings.rate_limit_max_buckets)
+
+
+class RateLimiter:
+    """Per-user limits by tier (TIER_CONFIG rate_limit_per_minute, else RATE_LIMIT_PER_MINUTE)."""
+
+    def __init__(self, backend: Optional[RateLimitBackend] = None):
+        settings = get_settings()
+        self.backend = backend or create_rate_limit_backend(settings)
+        self.default_limit = settings.rate_limit_per_minute
+        self.allowed = 0
+        self.limited = 0
+
+    def limit_for(self, tier: int) -> int:
+        """Requests per minute allowed for a tier (0: unlimited)."""
+        if self.default_limit <= 0:
+            return 0
+        return TIER_CONFIG.get(tier, TIER_CONFIG[0]).get("rate_limit_per_minute") or self.default_limit
+
+    async def check(self, user_id: str) -> float:
+        """Take a token for the user. Returns 0.0 if allowed, else seconds to wait."""
+        # Cached account fields, so rejected requests don't load memory
+        account = await memory_service.load_account(user_id)
+        limit = self.limit_for(account.get('tier') or 0)
+        if limit <= 0:
+            return 0.0
+        try:
+            wait = await self.backend.take(user_id, limit)
+        except Exception as e:
+            # Fail open: a limiter outage shouldn't take chat down
+            print(f"Rate limiter error: {e}")
+            return 0.0
+        if wait > 0:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for /metrics."""
+        return {"allowed": self.allowed, "limited": self.limited, **self.backend.stats()}
+
+    def close(self) -> None:
+        self.backend.close()
+
+
+# Singleton instance
+rate_limiter = RateLimiter()
@@ -0,0 +1,1039 @@
+"""
+Keepsake Storage Backends
+Async access to memory blobs, chat messages and recall vectors.
+
+- SupabaseStore: hosted Postgres (production)
+- SQLiteStore: embedded SQLite in WAL mode (single node, load tests)
+- LocalStore: in-process dicts (tests and benchmarks)
+"""
+import asyncio
+import copy
+import json
+import math
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from supabase import Client, ClientOptions, create_client
+
+from api.services import vector_codec
+
+
+def apply_memory_patch(data: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply {"dotted.path": value} changes to a memory dict in place.
+    Mirrors the patch_memory RPC: missing parent objects are created.
+    """
+    for path, value in patch.items():
+        keys = path.split(".")
+        node = data
+        for key in keys[:-1]:
+            if not isinstance(node.get(key), dict):
+                node[key] = {}
+            node = node[key]
+        node[keys[-1]] = copy.deepcopy(value)
+    return data
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    """Cosine similarity of two equal-length vectors (0.0 if either is zero)."""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def rank_matches(
+    rows: List[Tuple[str, List[float]]],
+    embedding: List[float],
+    threshold: float,
+    count: int
+) -> List[Dict[str, Any]]:
+    """
+    Brute-force match_vectors: rows above threshold, most similar first.
+    Rows longer than the query (stored before EMBEDDING_DIMENSIONS was
+    lowered) are compared on their leading dimensions; shorter ones are skipped.
+    """
+    dims = len(embedding)
+    scored = []
+    for content, vector in rows:
+        if len(vector) < dims:
+            continue
+        if len(vector) > dims:
+            vector = vector[:dims]
+        similarity = cosine_similarity(embedding, vector)
+        if similarity > threshold:
+            scored.append({"content": content, "similarity": similarity})
+    scored.sort(key=lambda r: r["similarity"], reverse=True)
+    return scored[:count]
+
+
+class MemoryStore(ABC):
+    """
+    Storage interface used by MemoryService.
+
+    Blobs carry a version that every write bumps; writes given an
+    expected_version only apply if the row is still at that version and
+    return None otherwise.
+    """
+
+    def close(self) -> None:
+        """Release connections/threads. Called on shutdown."""
+
+    # ============ MEMORIES ============
+
+    @abstractmethod
+    async def get_memory(self, user_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        """Fetch (memory blob, version) for a user, or None if missing."""
+
+    @abstractmethod
+    async def get_memory_fields(self, user_id: str, fields: List[str]) -> Optional[Dict[str, Any]]:
+        """Fetch {field: value} for top-level keys (None if absent), or None if no row."""
+
+    @abstractmethod
+    async def upsert_memory(
+        self,
+        user_id: str,
+        data: Dict[str, Any],
+        expected_version: Optional[int] = None
+    ) -> Optional[int]:
+        """
+        Replace the blob. Returns the new version, or None on a version mismatch.
+        A missing row counts as version 0: expected_version=0 creates it.
+        """
+
+    @abstractmethod
+    async def patch_memory(
+        self,
+        user_id: str,
+        patch: Dict[str, Any],
+        expected_version: Optional[int] = None
+    ) -> Optional[int]:
+        """Set {"dotted.path": value} keys. Returns the new version, or None on a mismatch (missing row: 0)."""
+
+    @abstractmethod
+    async def scan_memories(
+        self,
+        after: Optional[str],
+        limit: int,
+        fields: Optional[List[str]] = None,
+        tier: Optional[int] = None
+    ) -> List[Tuple[str, Dict[str, Any], int]]:
+        """
+        Up to `limit` (user_id, blob, version) rows with id > after, in id order.
+        With `fields`, each blob is only those top-level keys ({field: value},
+        None for absent keys, like get_memory_fields). With `tier`, only rows
+        whose blob has that tier or none (compressed blobs) are returned.
+        """
+
+    @abstractmethod
+    async def put_memories(
+        self,
+        rows: List[Tuple[str, Dict[str, Any], Optional[int]]]
+    ) -> List[Optional[int]]:
+        """
+        Batched upsert_memory of (user_id, blob, expected_version) rows.
+        Returns each row's new version, or None where its version didn't match.
+        """
+
+    # ============ QUOTAS ============
+
+    @abstractmethod
+    async def take_quota(self, user_id: str, day: str, limit: Optional[int]) -> Optional[int]:
+        """
+        Atomically count one message against the user's quota for `day` (ISO date).
+        Returns the count including this one, or None if `limit` was already reached
+        (a None limit only counts).
+        The user's rows for earlier days are dropped.
+        """
+
+    @abstractmethod
+    async def refund_quota(self, user_id: str, day: str) -> None:
+        """Give back one message counted on `day` (a turn that failed after take_quota)."""
+
+    @abstractmethod
+    async def get_quota(self, user_id: str, day: str) -> int:
+        """Messages counted against the user's quota on `day`."""
+
+    # ============ CHAT MESSAGES ============
+
+    @abstractmethod
+    async def append_messages(self, user_id: str, messages: List[Dict[str, str]]) -> int:
+        """Append messages to the user's log. Returns the seq of the last one."""
+
+    @abstractmethod
+    async def get_messages(self, user_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Fetch the last `limit` messages, oldest first."""
+
+    @abstractmethod
+    async def move_history(
+        self,
+        user_id: str,
+        messages: List[Dict[str, str]],
+        data: Dict[str, Any],
+        expected_version: int
+    ) -> Optional[int]:
+        """
+        Move legacy blob history into chat_messages: append `messages` and
+        replace the blob with `data` in one transaction, only if the row is
+        still at expected_version and the user has no chat_messages yet.
+        Returns the new version, or None (nothing written) otherwise.
+        """
+
+    # ============ VECTORS ============
+
+    @abstractmethod
+    async def insert_vectors(self, rows: List[Tuple[str, str, List[float]]]) -> None:
+        """Store several (user_id, content, embedding) memories in one statement."""
+
+    @abstractmethod
+    async def match_vectors(
+        self,
+        user_id: str,
+        embedding: List[float],
+        threshold: float,
+        count: int
+    ) -> List[Dict[str, Any]]:
+        """Up to `count` of the user's memories with cosine similarity above threshold."""
+
+    @abstractmethod
+    async def get_vectors(
+        self,
+        user_id: str,
+        limit: int,
+        after_id: int = 0
+    ) -> List[Tuple[int, str, List[float]]]:
+        """
+        Up to `limit` of the user's (id, content, embedding) memories with
+        id > after_id, oldest first. Ids only grow, so passing the last id
+        seen reads just the rows written since.
+        """
+
+
+class PooledStore(MemoryStore):
+    """Base for backends whose client blocks: calls run on a bounded thread pool."""
+
+    def __init__(self, max_workers: int = 16, timeout: float = 10.0):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="keepsake-db"
+        )
+
+    async def run(self, fn: Callable[[], Any]) -> Any:
+        """
+        Run a blocking call on the I/O pool and await its result.
+        Raises asyncio.TimeoutError if it takes longer than `timeout`.
+        """
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(
+            loop.run_in_executor(self._executor, fn),
+            timeout=self.timeout
+        )
+
+    def close(self) -> None:
+        """Stop accepting work and release the I/O threads."""
+        self._executor.shutdown(wait=False)
+
+
+class SupabaseStore(PooledStore):
+    """
+    Async facade over the synchronous Supabase client.
+
+    Every `.execute()` runs on a dedicated, bounded thread pool so a slow
+    Postgres round trip never blocks the event loop (and the SSE streams
+    running on it). The pool size caps concurrent database calls.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        max_workers: int = 16,
+        timeout: float = 10.0,
+        vector_quantization: str = "float32"
+    ):
+        super().__init__(max_workers=max_workers, timeout=timeout)
+        self.client = client
+        # float16/int8 expect the halfvec column from 006_vector_storage.sql;
+        # this picks what is sent (int8 goes through the *_q8 RPCs)
+        self.vector_quantization = vector_codec.check_quantization(vector_quantization)
+
+    # ============ MEMORIES ============
+
+    async def get_memory(self, user_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        """Fetch (raw memory blob, row version) for a user, or None if missing."""
+        response = await self.run(
+            lambda: self.client.table("memories").select("data, version").eq("id", user_id).execute()
+        )
+        if response.data and len(response.data) > 0:
+            return response.data[0]['data'], response.data[0]['version']
+        return None
+
+    async def get_memory_fields(self, user_id: str, fields: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Fetch only the given top-level keys of the blob (data->key per field).
+        Returns {field: value}, with None for absent keys, or None if no row.
+        """
+        columns = ", ".join(f"{field}:data->{field}" for field in fields)
+        response = await self.run(
+            lambda: self.client.table("memories").select(columns).eq("id", user_id).execute()
+        )
+        if response.data and len(response.data) > 0:
+            return response.data[0]
+        return None
+
+    async def upsert_memory(
+        self,
+        user_id: str,
+        data: Dict[str, Any],
+        expected_version: Optional[int] = None
+    ) -> Optional[int]:
+        """
+        Replace the memory blob (put_memory RPC). With expected_version, only
+        if the row is still at that version.
+        Returns the new version, or None on a version mismatch.
+        """
+        response = await self.run(
+            lambda: self.client.rpc("put_memory", {
+                "p_user_id": user_id,
+                "p_data": data,
+                "p_expected_version": expected_version
+            }).execute()
+        )
+        return response.data
+
+    async def patch_memory(
+        self,
+        user_id: str,
+        patch: Dict[str, Any],
+        expected_version: Optional[int] = None
+    ) -> Optional[int]:
+        """
+        Set only the given dotted paths of the blob (patch_memory RPC).
+        Returns the new version, or None on a version mismatch.
+        """
+        response = await self.run(
+            lambda: self.client.rpc("patch_memory", {
+                "p_user_id": user_id,
+                "p_patch": patch,
+                "p_expected_version": expected_version
+            }).execute()
+        )
+        return response.data
+
+    async def scan_memories(
+        self,
+        after: Optional[str],
+        limit: int,
+        fields: Optional[List[str]] = None,
+        tier: Optional[int] = None
+    ) -> List[Tuple[str, Dict[str, Any], int]]:
+        """Keyset-paginated read of the memories table (id > after, ordered by id)."""
+        columns = "data" if fields is None else ", ".join(f"{field}:data->{field}" for field in fields)
+
+        def query():
+            request = self.client.table("memories").select(f"id, version, {columns}").order("id").limit(limit)
+            if after is not None:
+                request = request.gt("id", after)
+            if tier is not None:
+                request = request.or_(f"data->>tier.eq.{tier},data->>tier.is.null")
+            return request.execute()
+
+        response = await self.run(query)
+        if fields is None:
+            return [(row["id"], row["data"], row["version"]) for row in response.data or []]
+        return [
+            (row["id"], {field: row.get(field) for field in fields}, row["version"])
+            for row in response.data or []
+        ]
+
+    async def put_memories(
+        self,
+        rows: List[Tuple[str, Dict[str, Any], Optional[int]]]
+    ) -> List[Optional[int]]:
+        """Write a batch of blobs in one round trip (put_memories RPC)."""
+        payload = [
+            {"id": user_id, "data": data, "expected_version": expected_version}
+            for user_id, data, expected_version in rows
+        ]
+        response = await self.run(
+            lambda: self.client.rpc("put_memories", {"p_rows": payload}).execute()
+        )
+        return response.data or []
+
+    # ============ QUOTAS ============
+
+    async def take_quota(self, user_id: str, day: str, limit: Optional[int]) -> Optional[int]:
+        """Count a message in message_quota (take_message_quota RPC)."""
+        response = await self.run(
+            lambda: self.client.rpc("take_message_quota", {
+                "p_user_id": user_id,
+                "p_day": day,
+                "p_limit": limit
+            }).execute()
+        )
+        return int(response.data) if response.data is not None else None
+
+    async def refund_quota(self, user_id: str, day: str) -> None:
+        """Uncount a message in message_quota (refund_message_quota RPC)."""
+        await self.run(
+            lambda: self.client.rpc("refund_message_quota", {
+                "p_user_id": user_id,
+                "p_day": day
+            }).execute()
+        )
+
+    async def get_quota(self, user_id: str, day: str) -> int:
+        response = await self.run(
+            lambda: self.client.table("message_quota").select("count")
+            .eq("user_id", user_id).eq("day", day).execute()
+        )
+        return response.data[0]["count"] if response.data else 0
+
+    # ============ CHAT MESSAGES ============
+
+    async def append_messages(self, user_id: str, messages: List[Dict[str, str]]) -> int:
+        """
+        Append messages to the user's chat_messages log.
+        Returns the seq assigned to the last message.
+        """
+        payload = [{"role": m["role"], "content": m["content"]} for m in messages]
+        response = await self.run(
+            lambda: self.client.rpc("append_chat_messages", {
+                "p_user_id": user_id,
+                "p_messages": payload
+            }).execute()
+        )
+        return int(response.data)
+
+    async def get_messages(self, user_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Fetch the last `limit` messages, oldest first."""
+        response = await self.run(
+            lambda: self.client.table("chat_messages")
+            .select("seq, role, content")
+            .eq("user_id", user_id)
+            .order("seq", desc=True)
+            .limit(limit)
+            .execute()
+        )
+        return list(reversed(response.data or []))
+
+    async def move_history(
+        self,
+        user_id: str,
+        messages: List[Dict[str, str]],
+        data: Dict[str, Any],
+        expected_version: int
+    ) -> Optional[int]:
+        """Append blob history and rewrite the blob in one transaction (move_blob_history RPC)."""
+        payload = [{"role": m["role"], "content": m["content"]} for m in messages]
+        response = await self.run(
+            lambda: self.client.rpc("move_blob_history", {
+                "p_user_id": user_id,
+                "p_messages": payload,
+                "p_data": data,
+                "p_expected_version": expected_version
+            }).execute()
+        )
+        return response.data
+
+    # ============ VECTORS ============
+
+    async def insert_vectors(self, rows: List[Tuple[str, str, List[float]]]) -> None:
+        """Store a batch of embedded memories with one multi-row insert."""
+        payload = [
+            {
+                "user_id": user_id,
+                "content": content,
+                "embedding": vector_codec.wire_value(embedding, self.vector_quantization)
+            }
+            for user_id, content, embedding in rows
+        ]
+        if self.vector_quantization == "int8":
+            # Dequantized by the RPC (006_vector_storage.sql)
+            await self.run(lambda: self.client.rpc("insert_recall_vectors_q8", {"p_rows": payload}).execute())
+            return
+        await self.run(lambda: self.client.table("recall_vectors").insert(payload).execute())
+
+    async def match_vectors(
+        self,
+        user_id: str,
+        embedding: List[float],
+        threshold: float,
+        count: int
+    ) -> List[Dict[str, Any]]:
+        """Run the match_vectors RPC (match_vectors_q8 for int8) and return matching rows."""
+        query = vector_codec.wire_value(embedding, self.vector_quantization)
+        rpc = "match_vectors_q8" if self.vector_quantization == "int8" else "match_vectors"
+        response = await self.run(
+            lambda: self.client.rpc(rpc, {
+                "query_embedding": query,
+                "match_threshold": threshold,
+                "match_count": count,
+                "filter_user": user_id
+            }).execute()
+        )
+        return response.data or []
+
+    async def get_vectors(
+        self,
+        user_id: str,
+        limit: int,
+        after_id: int = 0
+    ) -> List[Tuple[int, str, List[float]]]:
+        """Read the user's recall_vectors rows (pgvector values come back as "[...]" text)."""
+        def query():
+            response = (
+                self.client.table("recall_vectors")
+                .select("id, content, embedding")
+                .eq("user_id", user_id)
+                .gt("id", after_id)
+                .order("id")
+                .limit(limit)
+                .execute()
+            )
+            # Parsed here, on the I/O thread, not on the event loop
+            return [
+                (
+                    row["id"],
+                    row["content"],
+                    json.loads(row["embedding"]) if isinstance(row["embedding"], str) else row["embedding"]
+                )
+                for row in response.data or []
+            ]
+
+        return await self.run(query)
+
+
+SQLITE_SCHEMA = """
+create table if not exists memories (
+    id      text primary key,
+    data    text not null,
+    version integer not null default 0
+);
+
+create table if not exists chat_messages (
+    user_id    text    not null,
+    seq        integer not null,
+    role       text    not null,
+    content    text    not null,
+    created_at text    not null default (datetime('now')),
+    primary key (user_id, seq)
+);
+
+create table if not exists recall_vectors (
+    id         integer primary key autoincrement,
+    user_id    text not null,
+    content    text not null,
+    embedding  blob not null,  -- see encoding
+    encoding   text not null default 'float32',  -- vector_codec quantization
+    created_at text not null default (datetime('now'))
+);
+create index if not exists recall_vectors_user on recall_vectors (user_id);
+
+create table if not exists message_quota (
+    user_id text    not null,
+    day     text    not null,  -- user's local date
+    count   integer not null,
+    primary key (user_id, day)
+);
+"""
+
+
+class SQLiteStore(PooledStore):
+    """
+    Embedded SQLite backend (WAL mode) with the same tables and RPC
+    semantics as Supabase, for single-node deployments and load tests
+    without network latency. match_vectors is a brute-force cosine scan.
+
+    One connection on a single I/O thread: SQLite serializes writers anyway,
+    and this keeps every transaction on the thread that owns the connection.
+    """
+
+    def __init__(self, path: str = "keepsake.db", timeout: float = 10.0, vector_quantization: str = "float32"):
+        super().__init__(max_workers=1, timeout=timeout)
+        self.path = path
+        # Encoding for new recall_vectors rows; each row records its own
+        self.vector_quantization = vector_codec.check_quantization(vector_quantization)
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the connection on first use (on the I/O thread)."""
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            conn.executescript(SQLITE_SCHEMA)
+            columns = [row[1] for row in conn.execute("pragma table_info(recall_vectors)")]
+            if "encoding" not in columns:
+                # Files created before vector quantization: all rows are float32
+                conn.execute("alter table recall_vectors add column encoding text not null default 'float32'")
+            self._conn = conn
+        return self._conn
+
+    def _transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run fn inside BEGIN IMMEDIATE ... COMMIT (rolled back on error)."""
+        conn = self._connect()
+        conn.execute("begin immediate")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("rollback")
+            raise
+        conn.execute("commit")
+        return result
+
+    def close(self) -> None:
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close)
+        super().close()
+
+    # ============ MEMORIES ============
+
+    async def get_memory(self, user_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        def query():
+            return self._connect().execute(
+                "select data, version from memories where id = ?", (user_id,)
+            ).fetchone()
+
+        row = await self.run(query)
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    async def get_memory_fields(self, user_id: str, fields: List[str]) -> Optional[Dict[str, Any]]:
+        # json_object keeps nested objects/arrays as JSON rather than text
+        columns = ", ".join("?, json_extract(data, ?)" for _ in fields)
+        params = [p for field in fields for p in (field, f"$.{field}")]
+
+        def query():
+            return self._connect().execute(
+                f"select json_object({columns}) from memories where id = ?",
+                (*params, user_id)
+            ).fetchone()
+
+        row = await self.run(query)
+        return json.loads(row[0]) if row is not None else None
+
+    def _write_memory(
+        self,
+        conn: sqlite3.Connection,
+        user_id: str,
+        build: Callable[[Dict[str, Any]], Dict[str, Any]],
+        expected_version: Optional[int]
+    ) -> Optional[int]:
+        """Compare-and-swap helper: build(current data) -> new data, in one transaction."""
+        row = conn.execute(
+            "select data, version from memories where id = ?", (user_id,)
+        ).fetchone()
+        # A missing row counts as version 0, so expected_version=0 creates it
+        current_version = row[1] if row is not None else 0
+        if expected_version is not None and current_version != expected_version:
+            return None
+
+        data = build(json.loads(row[0]) if row is not None else {})
+        new_version = current_version + 1
+        conn.execute(
+            "insert into memories (id, data, version) values (?, ?, ?) "
+            "on conflict (id) do update set data = excluded.data, version = excluded.version",
+            (user_id, json.dumps(data), new_version)
+        )
+        return new_version
+
+    async def upsert_memory(
+        self,
+        user_id: str,
+        data: Dict[str, Any],
+        expected_version: Optional[int] = None
+    ) -> Optional[int]:
+        return await self.run(lambda: self._transaction(
+            lambda conn: self._write_memory(conn, user_id, lambda _: data, expected_version)
+        ))
+
+    async def patch_memory(
+        self,
+        user_id: str,
+        patch: Dict[str, Any],
+        expected_version: Optional[int] = None
+    ) -> Optional[int]:
+        return await self.run(lambda: self._transaction(
+            lambda conn: self._write_memory(
+                conn, user_id, lambda current: apply_memory_patch(current, patch), expected_version
+            )
+        ))
+
+    async def scan_memories(
+        self,
+        after: Optional[str],
+        limit: int,
+        fields: Optional[List[str]] = None,
+        tier: Optional[int] = None
+    ) -> List[Tuple[str, Dict[str, Any], int]]:
+        columns, params = "data", []
+        if fields is not None:
+            columns = f"json_object({', '.join('?, json_extract(data, ?)' for _ in fields)})"
+            params = [p for field in fields for p in (field, f"$.{field}")]
+        where = "id > ?"
+        params.append(after if after is not None else "")
+        if tier is not None:
+            where += " and coalesce(json_extract(data, '$.tier'), ?) = ?"
+            params += [tier, tier]
+
+        def query():
+            return self._connect().execute(
+                f"select id, {columns}, version from memories where {where} order by id limit ?",
+                (*params, limit)
+            ).fetchall()
+
+        rows = await self.run(query)
+        return [(user_id, json.loads(data), version) for user_id, data, version in rows]
+
+    async def put_memories(
+        self,
+        rows: List[Tuple[str, Dict[str, Any], Optional[int]]]
+    ) -> List[Optional[int]]:
+        def put_all(conn: sqlite3.Connection) -> List[Optional[int]]:
+            return [
+                self._write_memory(conn, user_id, lambda _, data=data: data, expected_version)
+                for user_id, data, expected_version in rows
+            ]
+
+        return await self.run(lambda: self._transaction(put_all))
+
+    # ============ QUOTAS ============
+
+    async def take_quota(self, user_id: str, day: str, limit: Optional[int]) -> Optional[int]:
+        def take(conn: sqlite3.Connection) -> Optional[int]:
+            conn.execute("delete from message_quota where user_id = ? and day < ?", (user_id, day))
+            counted = conn.execute(
+                "insert into message_quota (user_id, day, count) values (?, ?, 1) "
+                "on conflict (user_id, day) do update set count = count + 1 where ? is null or count < ?",
+                (user_id, day, limit, limit)
+            ).rowcount
+            if not counted:
+                return None
+            return conn.execute(
+                "select count from message_quota where user_id = ? and day = ?", (user_id, day)
+            ).fetchone()[0]
+
+        return await self.run(lambda: self._transaction(take))
+
+    async def refund_quota(self, user_id: str, day: str) -> None:
+        await self.run(lambda: self._transaction(lambda conn: conn.execute(
+            "update message_quota set count = count - 1 where user_id = ? and day = ? and count > 0",
+            (user_id, day)
+        )))
+
+    async def get_quota(self, user_id: str, day: str) -> int:
+        def query():
+            return self._connect().execute(
+                "select count from message_quota where user_id = ? and day = ?", (user_id, day)
+            ).fetchone()
+
+        row = await self.run(query)
+        return row[0] if row is not None else 0
+
+    # ============ CHAT MESSAGES ============
+
+    def _append_messages(self, conn: sqlite3.Connection, user_id: str, messages: List[Dict[str, str]]) -> int:
+        last_seq = conn.execute(
+            "select coalesce(max(seq), 0) from chat_messages where user_id = ?", (user_id,)
+        ).fetchone()[0]
+        conn.executemany(
+            "insert into chat_messages (user_id, seq, role, content) values (?, ?, ?, ?)",
+            [
+                (user_id, last_seq + offset, m["role"], m["content"])
+                for offset, m in enumerate(messages, start=1)
+            ]
+        )
+        return last_seq + len(messages)
+
+    async def append_messages(self, user_id: str, messages: List[Dict[str, str]]) -> int:
+        return await self.run(lambda: self._transaction(
+            lambda conn: self._append_messages(conn, user_id, messages)
+        ))
+
+    async def get_messages(self, user_id: str, limit: int) -> List[Dict[str, Any]]:
+        def query():
+            return self._connect().execute(
+                "select seq, role, content from chat_messages "
+                "where user_id = ? order by seq desc limit ?",
+                (user_id, limit)
+            ).fetchall()
+
+        rows = await self.run(query)
+        return [{"seq": seq, "role": role, "content": content} for seq, role, content in reversed(rows)]
+
+    async def move_history(
+        self,
+        user_id: str,
+        messages: List[Dict[str, str]],
+        data: Dict[str, Any],
+        expected_version: int
+    ) -> Optional[int]:
+        def move(conn: sqlite3.Connection) -> Optional[int]:
+            if conn.execute("select 1 from chat_messages where user_id = ? limit 1", (user_id,)).fetchone():
+                return None
+            new_version = self._write_memory(conn, user_id, lambda _: data, expected_version)
+            if new_version is not None:
+                self._append_messages(conn, user_id, messages)
+            return new_version
+
+        return await self.run(lambda: self._transaction(move))
+
+    # ============ VECTORS ============
+
+    async def insert_vectors(self, rows: List[Tuple[str, str, List[float]]]) -> None:
+        encoding = self.vector_quantization
+        params = [
+            (user_id, content, vector_codec.encode(embedding, encoding), encoding)
+            for user_id, content, embedding in rows
+        ]
+
+        def insert(conn: sqlite3.Connection) -> None:
+            conn.executemany(
+                "insert into recall_vectors (user_id, content, embedding, encoding) values (?, ?, ?, ?)", params
+            )
+
+        await self.run(lambda: self._transaction(insert))
+
+    async def match_vectors(
+        self,
+        user_id: str,
+        embedding: List[float],
+        threshold: float,
+        count: int
+    ) -> List[Dict[str, Any]]:
+        def scan():
+            rows = self._connect().execute(
+                "select content, embedding, encoding from recall_vectors where user_id = ?", (user_id,)
+            ).fetchall()
+            decoded = [(content, vector_codec.decode(blob, encoding)) for content, blob, encoding in rows]
+            return rank_matches(decoded, embedding, threshold, count)
+
+        return await self.run(scan)
+
+    async def get_vectors(
+        self,
+        user_id: str,
+        limit: int,
+        after_id: int = 0
+    ) -> List[Tuple[int, str, List[float]]]:
+        def query():
+            rows = self._connect().execute(
+                "select id, content, embedding, encoding from recall_vectors "
+                "where user_id = ? and id > ? order by id limit ?",
+                (user_id, after_id, limit)
+            ).fetchall()
+            return [(id, content, vector_codec.decode(blob, encoding)) for id, content, blob, encoding in rows]
+
+        return await self.run(query)
+
+
+class LocalStore(MemoryStore):
+    """
+    In-process stand-in for SupabaseStore with the same async interface
+    and semantics. Data lives in dicts and is lost on restart; use it for
+    tests and benchmarks, not deployments. `latency` (seconds) is awaited
+    on every call to simulate database round trips.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.memories: Dict[str, Dict[str, Any]] = {}
+        self.versions: Dict[str, int] = {}
+        self.messages: Dict[str, List[Dict[str, Any]]] = {}
+        self.vectors: List[Dict[str, Any]] = []
+        self.quotas: Dict[str, Tuple[str, int]] = {}  # user_id -> (day, count)
+
+    async def _round_trip(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def get_memory(self, user_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        await self._round_trip()
+        data = self.memories.get(user_id)
+        if data is None:
+            return None
+        return copy.deepcopy(data), self.versions[user_id]
+
+    async def get_memory_fields(self, user_id: str, fields: List[str]) -> Optional[Dict[str, Any]]:
+        await self._round_trip()
+        data = self.memories.get(user_id)
+        if data is None:
+            return None
+        return {field: copy.deepcopy(data.get(field)) for field in fields}
+
+    async def upsert_memory(
+        self,
+        user_id: str,
+        data: Dict[str, Any],
+        expected_version: Optional[int] = None
+    ) -> Optional[int]:
+        await self._round_trip()
+        if expected_version is not None and self.versions.get(user_id, 0) != expected_version:
+            return None
+        self.memories[user_id] = copy.deepcopy(data)
+        self.versions[user_id] = self.versions.get(user_id, 0) + 1
+        return self.versions[user_id]
+
+    async def patch_memory(
+        self,
+        user_id: str,
+        patch: Dict[str, Any],
+        expected_version: Optional[int] = None
+    ) -> Optional[int]:
+        await self._round_trip()
+        if expected_version is not None and self.versions.get(user_id, 0) != expected_version:
+            return None
+        apply_memory_patch(self.memories.setdefault(user_id, {}), patch)
+        self.versions[user_id] = self.versions.get(user_id, 0) + 1
+        return self.versions[user_id]
+
+    async def scan_memories(
+        self,
+        after: Optional[str],
+        limit: int,
+        fields: Optional[List[str]] = None,
+        tier: Optional[int] = None
+    ) -> List[Tuple[str, Dict[str, Any], int]]:
+        await self._round_trip()
+        ids = sorted(
+            user_id for user_id, data in self.memories.items()
+            if (after is None or user_id > after) and (tier is None or data.get("tier", tier) == tier)
+        )
+        rows = []
+        for user_id in ids[:limit]:
+            data = self.memories[user_id]
+            if fields is not None:
+                data = {field: data.get(field) for field in fields}
+            rows.append((user_id, copy.deepcopy(data), self.versions[user_id]))
+        return rows
+
+    async def put_memories(
+        self,
+        rows: List[Tuple[str, Dict[str, Any], Optional[int]]]
+    ) -> List[Optional[int]]:
+        await self._round_trip()
+        versions = []
+        for user_id, data, expected_version in rows:
+            if expected_version is not None and self.versions.get(user_id, 0) != expected_version:
+                versions.append(None)
+                continue
+            self.memories[user_id] = copy.deepcopy(data)
+            self.versions[user_id] = self.versions.get(user_id, 0) + 1
+            versions.append(self.versions[user_id])
+        return versions
+
+    async def take_quota(self, user_id: str, day: str, limit: Optional[int]) -> Optional[int]:
+        await self._round_trip()
+        stored_day, count = self.quotas.get(user_id, (day, 0))
+        if stored_day != day:
+            count = 0
+        if limit is not None and count >= limit:
+            return None
+        self.quotas[user_id] = (day, count + 1)
+        return count + 1
+
+    async def refund_quota(self, user_id: str, day: str) -> None:
+        await self._round_trip()
+        stored_day, count = self.quotas.get(user_id, (day, 0))
+        if stored_day == day and count > 0:
+            self.quotas[user_id] = (day, count - 1)
+
+    async def get_quota(self, user_id: str, day: str) -> int:
+        await self._round_trip()
+        stored_day, count = self.quotas.get(user_id, (day, 0))
+        return count if stored_day == day else 0
+
+    async def append_messages(self, user_id: str, messages: List[Dict[str, str]]) -> int:
+        await self._round_trip()
+        log = self.messages.setdefault(user_id, [])
+        for m in messages:
+            log.append({"seq": len(log) + 1, "role": m["role"], "content": m["content"]})
+        return len(log)
+
+    async def get_messages(self, user_id: str, limit: int) -> List[Dict[str, Any]]:
+        await self._round_trip()
+        return copy.deepcopy(self.messages.get(user_id, [])[-limit:])
+
+    async def move_history(
+        self,
+        user_id: str,
+        messages: List[Dict[str, str]],
+        data: Dict[str, Any],
+        expected_version: int
+    ) -> Optional[int]:
+        await self._round_trip()
+        if self.messages.get(user_id) or self.versions.get(user_id, 0) != expected_version:
+            return None
+        self.messages[user_id] = [
+            {"seq": seq, "role": m["role"], "content": m["content"]}
+            for seq, m in enumerate(messages, start=1)
+        ]
+        self.memories[user_id] = copy.deepcopy(data)
+        self.versions[user_id] = expected_version + 1
+        return self.versions[user_id]
+
+    async def insert_vectors(self, rows: List[Tuple[str, str, List[float]]]) -> None:
+        await self._round_trip()
+        for user_id, content, embedding in rows:
+            self.vectors.append({
+                "id": len(self.vectors) + 1,
+                "user_id": user_id,
+                "content": content,
+                "embedding": list(embedding)
+            })
+
+    async def match_vectors(
+        self,
+        user_id: str,
+        embedding: List[float],
+        threshold: float,
+        count: int
+    ) -> List[Dict[str, Any]]:
+        await self._round_trip()
+        rows = [
+            (row["content"], row["embedding"])
+            for row in self.vectors if row["user_id"] == user_id
+        ]
+        return rank_matches(rows, embedding, threshold, count)
+
+    async def get_vectors(
+        self,
+        user_id: str,
+        limit: int,
+        after_id: int = 0
+    ) -> List[Tuple[int, str, List[float]]]:
+        await self._round_trip()
+        return [
+            (row["id"], row["content"], list(row["embedding"]))
+            for row in self.vectors if row["user_id"] == user_id and row["id"] > after_id
+        ][:limit]
+
+
+def create_store(settings) -> MemoryStore:
+    """Build the backend selected by MEMORY_STORE ("supabase" or "sqlite")."""
+    if settings.memory_store == "sqlite":
+        return SQLiteStore(
+            settings.sqlite_path,
+            timeout=settings.db_timeout_seconds,
+            vector_quantization=settings.vector_quantization
+        )
+    if settings.memory_store != "supabase":
+        raise ValueError(f"Unknown MEMORY_STORE: {settings.memory_store}")
+
+    client = create_client(
+        settings.supabase_url,
+        settings.supabase_key,
+        options=ClientOptions(postgrest_client_timeout=settings.db_timeout_seconds)
+    )
+    return SupabaseStore(
+        client,
+        max_workers=settings.db_pool_size,
+        timeout=settings.db_timeout_seconds,
+        vector_quantization=settings.vector_quantization
+    )
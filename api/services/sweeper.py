@@ -0,0 +1,92 @@
+"""
+Keepsake Fact Sweeper
+Periodically purges free-tier facts that are past their memory window, so
+they stop riding along in every memory payload and taking fact slots.
+
+Walks the memories table in keyset-paginated pages. Only tier-0 rows are
+returned, and only their SWEEP_FIELDS, so the scan doesn't download chat
+history; purges are compare-and-swap writes (MemoryService.purge_expired_facts).
+Run once with python -m api.tools.sweep_facts (e.g. from cron), or started
+from the API lifespan when FACT_SWEEP_INTERVAL_SECONDS > 0, which should be
+set on one designated worker only.
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+from api.services.memory import MemoryService, SWEEP_FIELDS
+
+
+class FactSweeper:
+    """Background purge of expired tier-0 facts."""
+
+    def __init__(
+        self,
+        service: MemoryService,
+        interval: float = 3600.0,
+        page_size: int = 500,
+        page_pause: float = 0.1
+    ):
+        self.service = service
+        self.interval = interval
+        self.page_size = page_size
+        # Breather between pages so a sweep doesn't crowd out request traffic
+        self.page_pause = page_pause
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Any] = {
+            "sweeps": 0, "rows_scanned": 0, "users_purged": 0,
+            "facts_purged": 0, "conflicts": 0, "last_sweep_seconds": None
+        }
+
+    async def sweep_once(self) -> Dict[str, int]:
+        """One pass over every tier-0 memory row. Returns this pass's counters."""
+        totals = {"rows": 0, "users": 0, "facts": 0, "conflicts": 0}
+        start = time.perf_counter()
+        after = None
+
+        while True:
+            rows = await self.service.store.scan_memories(after, self.page_size, fields=SWEEP_FIELDS, tier=0)
+            if not rows:
+                break
+            after = rows[-1][0]
+            totals["rows"] += len(rows)
+
+            purged = await self.service.purge_expired_facts(rows)
+            for key in ("users", "facts", "conflicts"):
+                totals[key] += purged[key]
+
+            if len(rows) < self.page_size:
+                break
+            await asyncio.sleep(self.page_pause)
+
+        self.stats["sweeps"] += 1
+        self.stats["rows_scanned"] += totals["rows"]
+        self.stats["users_purged"] += totals["users"]
+        self.stats["facts_purged"] += totals["facts"]
+        self.stats["conflicts"] += totals["conflicts"]
+        self.stats["last_sweep_seconds"] = round(time.perf_counter() - start, 3)
+        return totals
+
+    async def run_forever(self) -> None:
+        """Sweep every `interval` seconds until cancelled."""
+        while True:
+            try:
+                await self.sweep_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Fact sweep error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
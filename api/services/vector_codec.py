@@ -0,0 +1,100 @@
+"""
+Keepsake Vector Codec
+Compact encodings for recall_vectors embeddings (VECTOR_QUANTIZATION).
+
+- float32: 4 bytes per dimension, the model's output as-is
+- float16: 2 bytes per dimension
+- int8:    1 byte per dimension plus one float32 scale per vector
+           (max |x| / 127), so every component keeps about 1% precision
+
+Cosine similarity only depends on direction, so decoded vectors are ranked
+exactly like the originals, give or take the rounding.
+
+text-embedding-3 embeddings can also be shortened (EMBEDDING_DIMENSIONS):
+asking the API for N dimensions returns the first N of the full embedding,
+re-normalized. truncate() does the same to stored full-length vectors, so
+they stay comparable with shortened queries.
+"""
+import json
+import math
+import struct
+from array import array
+from typing import Any, List, Sequence, Tuple
+
+QUANTIZATIONS = ("float32", "float16", "int8")
+
+# int8 blobs start with their float32 scale
+_SCALE = struct.Struct("=f")
+
+
+def check_quantization(quantization: str) -> str:
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown VECTOR_QUANTIZATION: {quantization}")
+    return quantization
+
+
+def truncate(embedding: Sequence[float], dims: int) -> List[float]:
+    """The first `dims` components at unit length (unchanged if already that short)."""
+    if not dims or len(embedding) <= dims:
+        return list(embedding)
+    head = embedding[:dims]
+    norm = math.sqrt(sum(x * x for x in head)) or 1.0
+    return [x / norm for x in head]
+
+
+def quantize_int8(embedding: Sequence[float]) -> Tuple[float, List[int]]:
+    """(scale, values in [-127, 127]) with value * scale ~= the original."""
+    peak = max((abs(x) for x in embedding), default=0.0)
+    scale = peak / 127 if peak else 1.0
+    return scale, [round(x / scale) for x in embedding]
+
+
+def encode(embedding: Sequence[float], quantization: str) -> bytes:
+    """Blob for one embedding."""
+    if quantization == "float32":
+        return array("f", embedding).tobytes()
+    if quantization == "float16":
+        return struct.pack(f"={len(embedding)}e", *embedding)
+    if quantization == "int8":
+        scale, values = quantize_int8(embedding)
+        return _SCALE.pack(scale) + array("b", values).tobytes()
+    raise ValueError(f"Unknown VECTOR_QUANTIZATION: {quantization}")
+
+
+def decode(blob: bytes, quantization: str) -> List[float]:
+    """Inverse of encode()."""
+    if quantization == "float32":
+        return array("f", blob).tolist()
+    if quantization == "float16":
+        return list(struct.unpack(f"={len(blob) // 2}e", blob))
+    if quantization == "int8":
+        (scale,) = _SCALE.unpack_from(blob)
+        return [x * scale for x in array("b", blob[_SCALE.size:])]
+    raise ValueError(f"Unknown VECTOR_QUANTIZATION: {quantization}")
+
+
+def encoded_size(dims: int, quantization: str) -> int:
+    """Blob bytes for one `dims`-dimension embedding."""
+    if quantization == "int8":
+        return _SCALE.size + dims
+    return dims * (2 if quantization == "float16" else 4)
+
+
+def wire_value(embedding: Sequence[float], quantization: str) -> Any:
+    """
+    An embedding as sent to Supabase. float16 rounds to 4 significant digits
+    (about float16's precision) so the JSON is shorter; int8 is sent as
+    {"q": [...], "scale": s} for the *_q8 RPCs (api/sql/006_vector_storage.sql).
+    """
+    if quantization == "float16":
+        return [float(f"{x:.4g}") for x in embedding]
+    if quantization == "int8":
+        scale, values = quantize_int8(embedding)
+        return {"q": values, "scale": scale}
+    return list(embedding)
+
+
+def wire_size(embedding: Sequence[float], quantization: str) -> int:
+    """JSON bytes of wire_value()."""
+    return len(json.dumps(wire_value(embedding, quantization), separators=(",", ":")))
+
@@ -0,0 +1,543 @@
+"""
+Keepsake Recall Vectors
+Batched writes to recall_vectors, and a local index for reading them.
+
+- VectorWriter: chat turns queue messages worth remembering; the writer
+  collects them across users for up to `max_batch` items or `max_delay`
+  seconds, embeds the batch with one multi-input embeddings call and stores
+  it with one insert. The queue is bounded (new items are dropped and
+  counted when it is full) and flushed on shutdown.
+- VectorIndex: read-through cache of each active user's vectors in front
+  of match_vectors. Loaded from recall_vectors in the background after a
+  user's first search (which goes to match_vectors), appended to by the
+  writer, topped up with the rows written since the last read once `ttl` has
+  passed (to pick up other workers' writes) and evicted LRU within a budget
+  in bytes of matrix memory. Vectors are held at the configured dimensions
+  and quantization (api.services.vector_codec).
+
+The index needs NumPy (in api/requirements.txt); if it is missing the API
+warns at startup and every search goes to match_vectors. Loading and
+searching run on the default thread pool, so a large user never stalls the
+event loop.
+"""
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from api.services import vector_codec
+from api.services.embeddings import EmbeddingService
+from api.services.store import MemoryStore
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# (user_id, text, time queued, embedding if the caller already had one)
+QueuedVector = Tuple[str, str, float, Optional[List[float]]]
+
+_STOP = None
+
+# float16/int8 matrices are widened to float32 this many rows at a time
+SEARCH_BLOCK_ROWS = 256
+
+# Rows fetched per get_vectors call when loading a user
+READ_PAGE_ROWS = 200
+
+# Rows encoded per worker-thread call when loading. Converting Python lists
+# holds the GIL, so small chunks keep each event-loop stall to a few ms.
+ENCODE_CHUNK_ROWS = 64
+
+
+class UserVectors:
+    """
+    One user's memories as a NumPy matrix of unit-length rows, so cosine
+    similarity is a dot product. Matches rank_matches: similarity above
+    threshold, most similar first, at most `count`.
+
+    With `dims`, longer embeddings are cut to their first `dims` components
+    (see vector_codec.truncate) and shorter ones skipped. Rows are stored as
+    `quantization`; int8 rows keep a per-row scale.
+
+    The matrix doubles its capacity as it grows, up to `max_rows` if given.
+
+    encode() and search() don't modify the object and may run on a worker
+    thread; add() and append() must run on the event loop.
+    """
+
+    def __init__(self, dims: int = 0, quantization: str = "float32", max_rows: int = 0):
+        self.contents: List[str] = []
+        self.dims: Optional[int] = dims or None
+        self.quantization = vector_codec.check_quantization(quantization)
+        self.max_rows = max_rows
+        self._matrix = None  # Rows [0, len) used, capacity doubles
+        self._scales = None  # int8: one per row
+        # Highest recall_vectors id read from the store
+        self.last_id = 0
+        # Contents added locally that a later store read will return again
+        self._unsynced: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the used rows."""
+        n = len(self.contents)
+        if self._matrix is None:
+            return 0
+        return self._matrix[:n].nbytes + (self._scales[:n].nbytes if self._scales is not None else 0)
+
+    @property
+    def reserved_bytes(self) -> int:
+        """Bytes allocated, including the unused capacity left by doubling."""
+        if self._matrix is None:
+            return 0
+        return self._matrix.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+
+    def encode(self, embeddings: List[List[float]]) -> Tuple[List[int], Any, Any]:
+        """
+        (indexes of the embeddings kept, their rows, int8 scales or None),
+        normalized and quantized. Set `dims` first.
+        """
+        dims = self.dims
+        kept = [i for i, embedding in enumerate(embeddings) if len(embedding) >= dims]
+        rows = np.array([embeddings[i][:dims] for i in kept], dtype=np.float32).reshape(len(kept), dims)
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        rows /= norms
+        scales = None
+        if self.quantization == "int8":
+            scales = np.abs(rows).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            rows = np.rint(rows / scales[:, None]).astype(np.int8)
+        elif self.quantization == "float16":
+            rows = rows.astype(np.float16)
+        return kept, rows, scales
+
+    def append(self, contents: List[str], rows, scales) -> None:
+        """Add rows from encode()."""
+        n, added = len(self.contents), len(contents)
+        if not added:
+            return
+        if self._matrix is None or n + added > self._matrix.shape[0]:
+            capacity = max(16, n * 2)
+            if self.max_rows:
+                capacity = min(capacity, self.max_rows)
+            capacity = max(capacity, n + added)
+            grown = np.zeros((capacity, self.dims), dtype=self.quantization)
+            if self._matrix is not None:
+                grown[:n] = self._matrix[:n]
+            self._matrix = grown
+            if scales is not None:
+                grown_scales = np.zeros(capacity, dtype=np.float32)
+                if self._scales is not None:
+                    grown_scales[:n] = self._scales[:n]
+                self._scales = grown_scales
+        self._matrix[n:n + added] = rows
+        if scales is not None:
+            self._scales[n:n + added] = scales
+        self.contents.extend(contents)
+
+    def extend(self, contents: List[str], embeddings: List[List[float]]) -> None:
+        """Encode and add several memories."""
+        if not embeddings:
+            return
+        if self.dims is None:
+            self.dims = len(embeddings[0])
+        kept, rows, scales = self.encode(embeddings)
+        self.append([contents[i] for i in kept], rows, scales)
+
+    def add(self, content: str, embedding: List[float]) -> None:
+        """Add a memory written by this process (see merge_rows)."""
+        before = len(self.contents)
+        self.extend([content], [embedding])
+        if len(self.contents) > before:
+            self._unsynced[content] += 1
+
+    def merge_rows(self, rows: List[Tuple[int, str, List[float]]]) -> Tuple[List[str], List[List[float]]]:
+        """
+        Contents and embeddings of store rows not already held, advancing
+        last_id. Rows this process added itself come back from the store
+        too; they're matched by content and skipped.
+        """
+        contents, embeddings = [], []
+        for id, content, embedding in rows:
+            self.last_id = max(self.last_id, id)
+            if self._unsynced[content] > 0:
+                self._unsynced[content] -= 1
+                continue
+            contents.append(content)
+            embeddings.append(embedding)
+        self._unsynced = +self._unsynced
+        return contents, embeddings
+
+    def _similarities(self, matrix, scales, n: int, query):
+        """Dot products of the first n rows with a float32 query."""
+        if matrix.dtype == np.float32:
+            return matrix[:n] @ query
+        similarities = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SEARCH_BLOCK_ROWS):
+            end = min(n, start + SEARCH_BLOCK_ROWS)
+            similarities[start:end] = matrix[start:end].astype(np.float32) @ query
+        if scales is not None:
+            similarities *= scales[:n]
+        return similarities
+
+    def search(self, embedding: List[float], threshold: float, count: int) -> List[Dict[str, Any]]:
+        # Snapshot: append() may grow the matrix while this runs on a worker thread
+        n, matrix, scales = len(self.contents), self._matrix, self._scales
+        if self.dims is not None and len(embedding) > self.dims:
+            embedding = embedding[:self.dims]
+        if not n or count <= 0 or len(embedding) != self.dims:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if not norm:
+            return []
+
+        similarities = self._similarities(matrix, scales, n, query / norm)
+        top = np.argpartition(-similarities, count - 1)[:count] if count < n else np.arange(n)
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        return [
+            {"content": self.contents[i], "similarity": float(similarities[i])}
+            for i in top if similarities[i] > threshold
+        ]
+
+
+class VectorIndex:
+    """
+    Per-user UserVectors in LRU order, holding at most `max_bytes` of
+    matrices in total (reserved_bytes, so growth slack counts). Users with
+    more than `user_max_vectors`, or too large for the whole budget, stay on
+    match_vectors (recall_vectors is append-only, so they stay that way).
+    Not thread-safe: meant to be used from the event loop only.
+    """
+
+    def __init__(
+        self,
+        store: MemoryStore,
+        max_bytes: int = 64 * 1024 * 1024,
+        user_max_vectors: int = 1000,
+        ttl: float = 300.0,
+        dims: int = 0,
+        quantization: str = "float32"
+    ):
+        self.store = store
+        # Storage profile for every UserVectors (EMBEDDING_DIMENSIONS, VECTOR_QUANTIZATION)
+        self.dims = dims
+        self.quantization = vector_codec.check_quantization(quantization)
+        self.max_bytes = max_bytes
+        self.user_max_vectors = user_max_vectors
+        self.ttl = ttl
+        # user_id -> (UserVectors, or None if too large to index, refresh_at)
+        self._users: "OrderedDict[str, Tuple[Optional[UserVectors], float]]" = OrderedDict()
+        self._bytes = 0
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Users written to while a read was in flight: refresh on the next search
+        self._stale: set = set()
+        self.counters = {
+            "local_searches": 0, "store_searches": 0, "warms": 0, "refreshes": 0,
+            "rows_read": 0, "evictions": 0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and np is not None
+
+    async def search(
+        self,
+        user_id: str,
+        embedding: List[float],
+        threshold: float,
+        count: int
+    ) -> List[Dict[str, Any]]:
+        """
+        match_vectors semantics, answered locally whenever the user is indexed.
+        A user's first search starts loading them in the background and goes
+        to match_vectors, so a large read never sits on the request path.
+        """
+        vectors = None
+        if self.enabled:
+            entry = self._users.get(user_id)
+            if entry is None:
+                self._start_load(user_id)
+            else:
+                if entry[1] < time.monotonic():
+                    # Only the rows written since the last read
+                    entry = await self._load(user_id)
+                else:
+                    self._users.move_to_end(user_id)
+                vectors = entry[0]
+
+        if vectors is None:
+            self.counters["store_searches"] += 1
+            return await self.store.match_vectors(user_id, embedding, threshold, count)
+        self.counters["local_searches"] += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, vectors.search, embedding, threshold, count)
+
+    def add(self, user_id: str, content: str, embedding: List[float]) -> None:
+        """Append a memory just written to recall_vectors, if the user is indexed."""
+        if user_id in self._loading:
+            self._stale.add(user_id)
+        entry = self._users.get(user_id)
+        if entry is None or entry[0] is None:
+            return
+        vectors = entry[0]
+        if len(vectors) >= self.user_max_vectors:
+            self._set(user_id, None, float("inf"))
+            return
+        before = vectors.reserved_bytes
+        vectors.add(content, embedding)
+        self._bytes += vectors.reserved_bytes - before
+        if vectors.reserved_bytes > self.max_bytes:
+            self._set(user_id, None, float("inf"))
+            return
+        self._evict()
+
+    async def _load(self, user_id: str) -> Tuple[Optional[UserVectors], float]:
+        """Load or top up a user's vectors (one read shared by concurrent searches)."""
+        return await asyncio.shield(self._start_load(user_id))
+
+    def _start_load(self, user_id: str) -> asyncio.Future:
+        """The user's read in progress, started if there is none."""
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._read(user_id))
+            self._loading[user_id] = task
+            task.add_done_callback(lambda t: self._loading.pop(user_id, None))
+        return task
+
+    async def _read(self, user_id: str) -> Tuple[Optional[UserVectors], float]:
+        """Read the rows written since the last read (all of them the first time)."""
+        self._stale.discard(user_id)
+        refresh_at = time.monotonic() + self.ttl
+        entry = self._users.get(user_id)
+        if entry is not None and entry[0] is None:
+            return self._set(user_id, None, float("inf"))
+
+        self.counters["refreshes" if entry is not None else "warms"] += 1
+        vectors = entry[0] if entry is not None else UserVectors(
+            self.dims, self.quantization, max_rows=self.user_max_vectors
+        )
+        rows_left = self.user_max_vectors + 1 - len(vectors)
+        try:
+            while rows_left > 0:
+                page = min(READ_PAGE_ROWS, rows_left)
+                rows = await self.store.get_vectors(user_id, page, vectors.last_id)
+                self.counters["rows_read"] += len(rows)
+                rows_left -= len(rows)
+                contents, embeddings = vectors.merge_rows(rows)
+                if len(vectors) + len(contents) > self.user_max_vectors:
+                    return self._set(user_id, None, float("inf"))
+                await self._append(user_id, vectors, contents, embeddings)
+                if vectors.reserved_bytes > self.max_bytes:
+                    return self._set(user_id, None, float("inf"))
+                if len(rows) < page:
+                    break
+        except Exception as e:
+            print(f"Vector index read error: {e}")
+            if entry is None:
+                return None, refresh_at
+            return self._set(user_id, vectors, refresh_at)
+
+        if user_id in self._stale:
+            # A write raced with the read: top up again on the next search
+            self._stale.discard(user_id)
+            refresh_at = 0.0
+        return self._set(user_id, vectors, refresh_at)
+
+    async def _append(
+        self,
+        user_id: str,
+        vectors: UserVectors,
+        contents: List[str],
+        embeddings: List[List[float]]
+    ) -> None:
+        """Encode rows on the thread pool, a chunk at a time, and add them."""
+        if embeddings and vectors.dims is None:
+            vectors.dims = len(embeddings[0])
+        loop = asyncio.get_running_loop()
+        for start in range(0, len(embeddings), ENCODE_CHUNK_ROWS):
+            chunk = embeddings[start:start + ENCODE_CHUNK_ROWS]
+            kept, block, scales = await loop.run_in_executor(None, vectors.encode, chunk)
+            before = vectors.reserved_bytes
+            vectors.append([contents[start + i] for i in kept], block, scales)
+            if self._users.get(user_id, (None,))[0] is vectors:
+                self._bytes += vectors.reserved_bytes - before
+
+    def _set(
+        self,
+        user_id: str,
+        vectors: Optional[UserVectors],
+        refresh_at: float
+    ) -> Tuple[Optional[UserVectors], float]:
+        """Store a user's entry as most recently used, keeping the byte count."""
+        entry = self._users.get(user_id)
+        if entry is None or entry[0] is not vectors:
+            self._drop(user_id)
+            self._bytes += vectors.reserved_bytes if vectors is not None else 0
+        self._users[user_id] = (vectors, refresh_at)
+        self._users.move_to_end(user_id)
+        self._evict()
+        return vectors, refresh_at
+
+    def _drop(self, user_id: str) -> None:
+        entry = self._users.pop(user_id, None)
+        if entry is not None and entry[0] is not None:
+            self._bytes -= entry[0].reserved_bytes
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._users:
+            oldest = next(iter(self._users))
+            self._drop(oldest)
+            self.counters["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for /metrics."""
+        return {
+            **self.counters,
+            "users": len(self._users),
+            "vectors": sum(len(entry[0]) for entry in self._users.values() if entry[0] is not None),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "dims": self.dims or None,
+            "quantization": self.quantization,
+            "enabled": self.enabled,
+        }
+
+
+class VectorWriter:
+    """Background batcher for recall_vectors inserts."""
+
+    def __init__(
+        self,
+        store: MemoryStore,
+        embedder: EmbeddingService,
+        max_batch: int = 64,
+        max_delay: float = 0.2,
+        max_queue: int = 10000,
+        flush_timeout: float = 10.0,
+        index: Optional[VectorIndex] = None
+    ):
+        self.store = store
+        self.embedder = embedder
+        # Local index to append written vectors to
+        self.index = index
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        # How long stop() waits for the final flush
+        self.flush_timeout = flush_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, Any] = {
+            "queued": 0, "dropped": 0, "written": 0, "failed": 0, "batches": 0,
+            "embeddings_reused": 0,  # Queued with the turn's embedding, not re-embedded
+            "avg_batch_size": 0.0, "max_batch_size": 0,
+            "last_flush_ms": None, "avg_flush_ms": None, "max_queue_wait_ms": None
+        }
+
+    def submit(self, user_id: str, text: str, embedding: Optional[List[float]] = None) -> bool:
+        """
+        Queue a text for embedding and storage. Pass its embedding if it was
+        already computed, so the batch doesn't embed it again.
+        False if the queue is full.
+        """
+        if self._task is None:
+            self.start()
+        if self._queue.qsize() >= self.max_queue:
+            self.stats["dropped"] += 1
+            return False
+        self._queue.put_nowait((user_id, text, time.perf_counter(), embedding))
+        self.stats["queued"] += 1
+        return True
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def run(self) -> None:
+        """Collect and flush batches until stop() is called."""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is _STOP:
+                return
+            batch: List[QueuedVector] = [item]
+            stopping = False
+            deadline = loop.time() + self.max_delay
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self.flush(batch)
+            if stopping:
+                return
+
+    async def flush(self, batch: List[QueuedVector]) -> None:
+        """Embed and insert one batch, recording size and latency."""
+        start = time.perf_counter()
+        try:
+            missing = [text for _, text, _, embedding in batch if embedding is None]
+            computed = iter(await self.embedder.embed_many(missing) if missing else [])
+            rows = [
+                (user_id, text, embedding if embedding is not None else next(computed))
+                for user_id, text, _, embedding in batch
+            ]
+            self.stats["embeddings_reused"] += len(batch) - len(missing)
+            await self.store.insert_vectors(rows)
+            self.stats["written"] += len(batch)
+            if self.index is not None:
+                for row in rows:
+                    self.index.add(*row)
+        except Exception as e:
+            print(f"Error saving vectors: {e}")
+            self.stats["failed"] += len(batch)
+            return
+        finally:
+            self._record_flush(batch, start)
+
+    def _record_flush(self, batch: List[QueuedVector], start: float) -> None:
+        stats = self.stats
+        now = time.perf_counter()
+        flush_ms = round((now - start) * 1000, 2)
+        stats["batches"] += 1
+        batches = stats["batches"]
+        stats["avg_batch_size"] = round(stats["avg_batch_size"] + (len(batch) - stats["avg_batch_size"]) / batches, 2)
+        stats["max_batch_size"] = max(stats["max_batch_size"], len(batch))
+        stats["last_flush_ms"] = flush_ms
+        previous = stats["avg_flush_ms"] or 0.0
+        stats["avg_flush_ms"] = round(previous + (flush_ms - previous) / batches, 2)
+        oldest_wait = round((now - min(queued_at for _, _, queued_at, _ in batch)) * 1000, 2)
+        stats["max_queue_wait_ms"] = max(stats["max_queue_wait_ms"] or 0.0, oldest_wait)
+
+    def start(self) -> None:
+        if self._task is None:
+            # One slot beyond max_queue (enforced by submit) for the stop marker
+            self._queue = asyncio.Queue(maxsize=self.max_queue + 1)
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Flush everything queued so far, then stop."""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        try:
+            # Cancels the writer if the flush takes too long
+            await asyncio.wait_for(self._task, self.flush_timeout)
+        except asyncio.TimeoutError:
+            print(f"Vector writer: gave up flushing {self.pending()} queued items on shutdown")
+        self._task = None
+        self._queue = None
@@ -0,0 +1,36 @@
+-- Keepsake: append-only chat history (HISTORY_STORAGE=table)
+-- Run once in the Supabase SQL editor.
+
+create table if not exists chat_messages (
+    user_id    uuid        not null,
+    seq        bigint      not null,
+    role       text        not null,
+    content    text        not null,
+    created_at timestamptz not null default now(),
+    -- Also serves as the (user_id, seq) index used for tail reads
+    primary key (user_id, seq)
+);
+
+-- Append messages for one user, numbering them after the current tail.
+-- Returns the seq of the last inserted message.
+create or replace function append_chat_messages(p_user_id uuid, p_messages jsonb)
+returns bigint
+language plpgsql
+as $$
+declare
+    last_seq bigint;
+begin
+    -- Serialize appends per user so seq stays gap-free and unique
+    perform pg_advisory_xact_lock(hashtext(p_user_id::text));
+
+    select coalesce(max(seq), 0) into last_seq
+    from chat_messages
+    where user_id = p_user_id;
+
+    insert into chat_messages (user_id, seq, role, content)
+    select p_user_id, last_seq + m.ord, m.value->>'role', m.value->>'content'
+    from jsonb_array_elements(p_messages) with ordinality as m(value, ord);
+
+    return last_seq + jsonb_array_length(p_messages);
+end;
+$$;
@@ -0,0 +1,33 @@
+-- Keepsake: partial memory writes (MemoryService.patch_memory)
+-- Required. Run once in the Supabase SQL editor, before 003_memory_version.sql.
+
+-- Apply {"dotted.path": value, ...} to memories.data in one statement.
+-- Missing parent objects are created; a missing row starts from '{}'
+-- (load_memory backfills the remaining default keys).
+create or replace function patch_memory(p_user_id uuid, p_patch jsonb)
+returns void
+language plpgsql
+as $$
+declare
+    new_data jsonb;
+    entry record;
+    path text[];
+    i int;
+begin
+    select data into new_data from memories where id = p_user_id for update;
+    new_data := coalesce(new_data, '{}'::jsonb);
+
+    for entry in select key, value from jsonb_each(p_patch) loop
+        path := string_to_array(entry.key, '.');
+        for i in 1 .. array_length(path, 1) - 1 loop
+            if jsonb_typeof(new_data #> path[1:i]) is distinct from 'object' then
+                new_data := jsonb_set(new_data, path[1:i], '{}'::jsonb, true);
+            end if;
+        end loop;
+        new_data := jsonb_set(new_data, path, entry.value, true);
+    end loop;
+
+    insert into memories (id, data) values (p_user_id, new_data)
+    on conflict (id) do update set data = excluded.data;
+end;
+$$;
@@ -0,0 +1,113 @@
+-- Keepsake: optimistic concurrency for memories (compare-and-swap writes)
+-- Required: SupabaseStore reads memories.version and writes through these
+-- RPCs. Run once in the Supabase SQL editor, after 002_patch_memory.sql.
+
+alter table memories add column if not exists version bigint not null default 0;
+
+-- The version is set here rather than by each writer, so writers that don't
+-- go through the RPCs below (app.py upserts the table directly) still bump it
+-- and a compare-and-swap never succeeds over a write it didn't see. New rows
+-- start at 1: version 0 means "no row".
+create or replace function bump_memory_version()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op = 'INSERT' then
+        new.version := 1;
+    else
+        new.version := old.version + 1;
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists memories_bump_version on memories;
+create trigger memories_bump_version
+    before insert or update on memories
+    for each row execute function bump_memory_version();
+
+-- Replace the whole blob. With p_expected_version, only if the row is still
+-- at that version. Returns the new version, or null on a version mismatch.
+-- A missing row counts as version 0, so p_expected_version = 0 creates it.
+create or replace function put_memory(
+    p_user_id uuid,
+    p_data jsonb,
+    p_expected_version bigint default null
+)
+returns bigint
+language plpgsql
+as $$
+declare
+    new_version bigint;
+begin
+    if p_expected_version is null then
+        insert into memories (id, data) values (p_user_id, p_data)
+        on conflict (id) do update set data = excluded.data
+        returning version into new_version;
+    else
+        update memories set data = p_data
+        where id = p_user_id and version = p_expected_version
+        returning version into new_version;
+        if not found and p_expected_version = 0 then
+            -- Nothing is returned if another writer created the row first
+            insert into memories (id, data) values (p_user_id, p_data)
+            on conflict (id) do nothing
+            returning version into new_version;
+        end if;
+    end if;
+    return new_version;
+end;
+$$;
+
+-- patch_memory gains the same optional version check (a missing row counts as
+-- version 0) and returns the new version
+drop function if exists patch_memory(uuid, jsonb);
+
+create or replace function patch_memory(
+    p_user_id uuid,
+    p_patch jsonb,
+    p_expected_version bigint default null
+)
+returns bigint
+language plpgsql
+as $$
+declare
+    new_data jsonb;
+    cur_version bigint;
+    new_version bigint;
+    entry record;
+    path text[];
+    i int;
+begin
+    select data, version into new_data, cur_version
+    from memories where id = p_user_id for update;
+
+    if p_expected_version is not null and coalesce(cur_version, 0) <> p_expected_version then
+        return null;
+    end if;
+    new_data := coalesce(new_data, '{}'::jsonb);
+
+    for entry in select key, value from jsonb_each(p_patch) loop
+        path := string_to_array(entry.key, '.');
+        for i in 1 .. array_length(path, 1) - 1 loop
+            if jsonb_typeof(new_data #> path[1:i]) is distinct from 'object' then
+                new_data := jsonb_set(new_data, path[1:i], '{}'::jsonb, true);
+            end if;
+        end loop;
+        new_data := jsonb_set(new_data, path, entry.value, true);
+    end loop;
+
+    if cur_version is null then
+        -- Nothing is returned if another writer created the row first
+        insert into memories (id, data) values (p_user_id, new_data)
+        on conflict (id) do nothing
+        returning version into new_version;
+    else
+        update memories set data = new_data
+        where id = p_user_id
+        returning version into new_version;
+    end if;
+    return new_version;
+end;
+$$;
@@ -0,0 +1,24 @@
+-- Keepsake: batched compare-and-swap writes for offline migrations
+-- (python -m api.tools.migrate). Run once, after 003_memory_version.sql.
+
+-- p_rows: [{"id": "...", "data": {...}, "expected_version": 3}, ...]
+-- Each row is put_memory'd on its own version check (null: unconditional).
+-- Returns the new version of each row in input order, null where it didn't match.
+create or replace function put_memories(p_rows jsonb)
+returns bigint[]
+language plpgsql
+as $$
+declare
+    entry jsonb;
+    versions bigint[] := '{}';
+begin
+    for entry in select value from jsonb_array_elements(p_rows) loop
+        versions := array_append(versions, put_memory(
+            (entry->>'id')::uuid,
+            entry->'data',
+            (entry->>'expected_version')::bigint
+        ));
+    end loop;
+    return versions;
+end;
+$$;
@@ -0,0 +1,48 @@
+-- Keepsake: daily message ledger: every user's messages today (/memory/stats),
+-- checked against the tier's message_limit where it has one.
+-- Required. Run once in the Supabase SQL editor.
+
+create table if not exists message_quota (
+    user_id uuid    not null,
+    day     date    not null,  -- user's local date (time_offset applied)
+    count   integer not null,
+    primary key (user_id, day)
+);
+
+-- Count one message for p_user_id on p_day unless p_limit is reached
+-- (a null p_limit never rejects).
+-- Returns the count including this message, or null when over the limit.
+-- Also drops the user's rows for earlier days, so the table holds about
+-- one row per active user.
+create or replace function take_message_quota(p_user_id uuid, p_day date, p_limit integer)
+returns integer
+language plpgsql
+as $$
+declare
+    used integer;
+begin
+    delete from message_quota
+    where user_id = p_user_id and day < p_day;
+
+    -- The row lock taken by the upsert makes concurrent calls count one at a time
+    insert into message_quota (user_id, day, count)
+    values (p_user_id, p_day, 1)
+    on conflict (user_id, day) do update
+        set count = message_quota.count + 1
+        where p_limit is null or message_quota.count < p_limit
+    returning count into used;
+
+    return used;
+end;
+$$;
+
+-- Give back one message counted on p_day, for a turn that failed after
+-- take_message_quota (re-running this file adds it to an existing setup).
+create or replace function refund_message_quota(p_user_id uuid, p_day date)
+returns void
+language sql
+as $$
+    update message_quota
+    set count = count - 1
+    where user_id = p_user_id and day = p_day and count > 0;
+$$;
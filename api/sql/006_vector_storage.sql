@@ -0,0 +1,93 @@
+-- Keepsake: smaller recall vectors (EMBEDDING_DIMENSIONS, VECTOR_QUANTIZATION)
+-- Run the parts for the settings you use, once, in the Supabase SQL editor.
+-- Needs pgvector 0.7+ (subvector(), halfvec).
+
+-- ---------------------------------------------------------------------------
+-- EMBEDDING_DIMENSIONS=N (example: 512).
+-- Existing rows keep their first N dimensions, re-normalized: the same
+-- vector the API returns for dimensions=N. Recreate any ivfflat/hnsw index
+-- on the column afterwards, and match_vectors too if it declares
+-- query_embedding as vector(1536). With float16 or int8, convert to
+-- halfvec(N) in the next part instead (same using clause, ::halfvec(N)).
+-- ---------------------------------------------------------------------------
+-- alter table recall_vectors
+--     alter column embedding type vector(512)
+--     using l2_normalize(subvector(embedding, 1, 512))::vector(512);
+
+-- ---------------------------------------------------------------------------
+-- VECTOR_QUANTIZATION=float16 or int8: store 2 bytes per dimension.
+-- pgvector has no int8 vector type, so int8 is stored as halfvec too (its
+-- values and scale fit float16's precision). Use your dimensions (1536, or
+-- EMBEDDING_DIMENSIONS). The alter rewrites the table; recreate any
+-- ivfflat/hnsw index afterwards with halfvec_cosine_ops.
+-- ---------------------------------------------------------------------------
+-- alter table recall_vectors
+--     alter column embedding type halfvec(1536)
+--     using embedding::halfvec(1536);
+
+-- Then replace match_vectors, which must compare against the column's type:
+-- queries still arrive as vector (app.py, match_vectors_q8 below) and are
+-- cast to halfvec here. Inserts need nothing: vector values are assigned to
+-- a halfvec column as-is.
+--
+-- create or replace function match_vectors(
+--     query_embedding vector,
+--     match_threshold float,
+--     match_count int,
+--     filter_user uuid
+-- )
+-- returns table (content text, similarity float)
+-- language sql
+-- stable
+-- as $$
+--     select r.content, 1 - (r.embedding <=> query_embedding::halfvec) as similarity
+--     from recall_vectors r
+--     where r.user_id = filter_user
+--       and 1 - (r.embedding <=> query_embedding::halfvec) > match_threshold
+--     order by r.embedding <=> query_embedding::halfvec
+--     limit match_count;
+-- $$;
+
+-- ---------------------------------------------------------------------------
+-- VECTOR_QUANTIZATION=int8: embeddings are sent as {"q": [int8...], "scale": s}
+-- (a quarter of the JSON of float arrays) and turned back into vectors here,
+-- then stored in the halfvec column above.
+-- ---------------------------------------------------------------------------
+
+-- q[i] * scale for each element of q, as a vector.
+create or replace function dequantize_q8(p_embedding jsonb)
+returns vector
+language sql
+immutable
+as $$
+    select array(
+        select value::real * (p_embedding->>'scale')::real
+        from jsonb_array_elements_text(p_embedding->'q') with ordinality as q(value, i)
+        order by i
+    )::real[]::vector;
+$$;
+
+-- Insert [{"user_id", "content", "embedding": {"q", "scale"}}, ...] in one statement.
+create or replace function insert_recall_vectors_q8(p_rows jsonb)
+returns void
+language sql
+as $$
+    insert into recall_vectors (user_id, content, embedding)
+    select (r->>'user_id')::uuid, r->>'content', dequantize_q8(r->'embedding')
+    from jsonb_array_elements(p_rows) as r;
+$$;
+
+-- match_vectors for a quantized query.
+create or replace function match_vectors_q8(
+    query_embedding jsonb,
+    match_threshold float,
+    match_count int,
+    filter_user uuid
+)
+returns table (content text, similarity float)
+language sql
+stable
+as $$
+    select m.content, m.similarity
+    from match_vectors(dequantize_q8(query_embedding), match_threshold, match_count, filter_user) as m;
+$$;
@@ -0,0 +1,36 @@
+-- Keepsake: move legacy blob history into chat_messages (HISTORY_STORAGE=table)
+-- Required for table mode. Run once, after 001_chat_messages.sql and
+-- 003_memory_version.sql.
+
+-- Append p_messages to the user's chat_messages and replace the blob with
+-- p_data (which no longer holds them) in one transaction, only if the row is
+-- still at p_expected_version and the user has no chat_messages yet. Returns
+-- the new version, or null with nothing written. Live reads and the bulk
+-- migration both move history through here, so whichever comes second sees
+-- the messages (or the new version) and the history is only copied once.
+create or replace function move_blob_history(
+    p_user_id uuid,
+    p_messages jsonb,
+    p_data jsonb,
+    p_expected_version bigint
+)
+returns bigint
+language plpgsql
+as $$
+declare
+    new_version bigint;
+begin
+    -- The lock append_chat_messages takes, so no append slips in between
+    perform pg_advisory_xact_lock(hashtext(p_user_id::text));
+
+    if exists (select 1 from chat_messages where user_id = p_user_id) then
+        return null;
+    end if;
+
+    new_version := put_memory(p_user_id, p_data, p_expected_version);
+    if new_version is not null then
+        perform append_chat_messages(p_user_id, p_messages);
+    end if;
+    return new_version;
+end;
+$$;
@@ -0,0 +1 @@
+"""Keepsake API maintenance and benchmark tools (run with `python -m api.tools.<name>`)."""
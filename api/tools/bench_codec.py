@@ -0,0 +1,118 @@
+"""
+Memory Encoding Benchmark
+Compares stored/wire size and encode/decode time of memory blobs as plain
+JSON vs the msgpack+zstd envelope, with and without a shared dictionary.
+
+The dictionary is trained on one set of synthetic users and measured on
+another, as it would be in production. Sizes are the JSON text PostgREST
+sends for memories.data (the envelope includes its base64 overhead).
+
+Run with: python -m api.tools.bench_codec [--users 200] [--history 50] [--facts 20]
+"""
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+
+from api.services.codec import MemoryCodec, train_dictionary
+
+OPENERS = ["I", "Today I", "Honestly I", "So I", "Yesterday I", "I think I"]
+VERBS = ["had", "finished", "skipped", "started", "talked about", "worried about", "enjoyed"]
+THINGS = [
+    "a long day at work", "the meeting with my manager", "my sister's birthday",
+    "the gym", "a job interview", "dinner with friends", "my thesis draft",
+    "the dentist appointment", "a walk in the park", "my landlord again",
+]
+REPLIES = [
+    "That sounds like a lot. How are you feeling about it now?",
+    "I'm really glad you told me. What was the hardest part?",
+    "You handled that better than you think. Want to talk it through?",
+    "That's wonderful! I remember you mentioning it last week.",
+    "Take it easy tonight, you've earned some rest.",
+]
+
+
+def synthetic_memory(rng: random.Random, history: int, facts: int) -> dict:
+    """A fully populated memory blob with varied, chat-like text."""
+    def user_line():
+        return f"{rng.choice(OPENERS)} {rng.choice(VERBS)} {rng.choice(THINGS)} " \
+               f"and {rng.choice(VERBS)} {rng.choice(THINGS)}."
+
+    return {
+        "history": [
+            {"role": "user", "content": user_line()} if i % 2 == 0
+            else {"role": "assistant", "content": rng.choice(REPLIES)}
+            for i in range(history)
+        ],
+        "emotional_state": {
+            "closeness": rng.randint(10, 90), "warmth": rng.randint(10, 90), "pace": 10,
+            "stability": rng.randint(40, 100), "scene_score": 0, "agency": rng.randint(10, 50)
+        },
+        "user_profile": {"name": rng.choice(["Sam", "Alex", "Priya", "Jordan"]), "age": str(rng.randint(18, 60)),
+                         "gender": "", "companion_name": "Keepsake"},
+        "active_context": {"last_topic": "", "significant_event": rng.choice(THINGS),
+                           "event_date": "2026-10-15", "last_recalled_date": ""},
+        "user_facts": [
+            {"content": f"• User {rng.choice(VERBS)} {rng.choice(THINGS)}",
+             "created_at": f"2026-10-{rng.randint(1, 16):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00"}
+            for _ in range(facts)
+        ],
+        "balance": rng.randint(0, 500),
+        "inventory": ["default"],
+        "current_outfit": "default",
+        "tier": rng.randint(0, 2),
+        "avatar_id": "1",
+        "has_chosen_avatar": True,
+        "time_offset": 0,
+        "last_active_timestamp": "2026-10-16T09:00:00",
+    }
+
+
+def measure(name: str, codec: MemoryCodec, blobs: list) -> None:
+    sizes, encode_times, decode_times = [], [], []
+    for blob in blobs:
+        start = time.perf_counter()
+        stored = codec.encode(blob)
+        wire = json.dumps(stored)
+        encode_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        decoded = codec.decode(json.loads(wire))
+        decode_times.append(time.perf_counter() - start)
+
+        assert decoded == blob, name
+        sizes.append(len(wire))
+
+    print(f"{name:<28} {statistics.mean(sizes):>10.0f} {statistics.mean(encode_times) * 1e6:>12.1f} "
+          f"{statistics.mean(decode_times) * 1e6:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--history", type=int, default=50)
+    parser.add_argument("--facts", type=int, default=20)
+    parser.add_argument("--dict-size", type=int, default=16 * 1024)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    training = [synthetic_memory(rng, args.history, args.facts) for _ in range(args.users)]
+    blobs = [synthetic_memory(rng, args.history, args.facts) for _ in range(args.users)]
+
+    with tempfile.NamedTemporaryFile(suffix=".zdict") as dict_file:
+        dict_file.write(train_dictionary(training, size=args.dict_size))
+        dict_file.flush()
+
+        print(f"{args.users} blobs: {args.history} messages, {args.facts} facts "
+              f"(json encode/decode includes the PostgREST json.dumps/loads)\n")
+        print(f"{'encoding':<28} {'avg bytes':>10} {'encode us':>12} {'decode us':>12}")
+        measure("json", MemoryCodec("json"), blobs)
+        measure("msgpack+zstd", MemoryCodec("msgpack-zstd"), blobs)
+        measure("msgpack+zstd (dictionary)", MemoryCodec("msgpack-zstd", dict_file.name), blobs)
+
+
+if __name__ == "__main__":
+    main()
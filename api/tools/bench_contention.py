@@ -0,0 +1,130 @@
+"""
+Write Contention Benchmark
+Runs parallel chat turns and fact extractions for the same users against
+a local store (LocalStore, or SQLiteStore with --store sqlite), comparing the old blind upserts with version-checked writes.
+
+Each user has `--sessions` clients sending turns back to back (two devices,
+or a double-tapped send) while background fact extractions land at random
+times. Each turn appends two messages and adds 2 coins; each extraction adds
+one fact. Anything missing at the end was lost to a concurrent overwrite.
+
+Run with: python -m api.tools.bench_contention [--users 20] [--sessions 2] [--turns 12]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from api.services.memory import MemoryService
+from api.services.store import LocalStore, MemoryStore, SQLiteStore
+
+
+async def legacy_turn(store: MemoryStore, user_id: str, i: int, args) -> None:
+    """Pre-versioning turn: load the blob, modify, upsert all of it."""
+    data, _ = await store.get_memory(user_id)
+    data['history'].append({"role": "user", "content": f"message {i}"})
+    await asyncio.sleep(random.uniform(0, args.llm_time))
+    data['history'].append({"role": "assistant", "content": f"reply {i}"})
+    data['balance'] += 2
+    await store.upsert_memory(user_id, data)
+
+
+async def legacy_extraction(store: MemoryStore, user_id: str, i: int) -> None:
+    """Pre-versioning save_facts: fresh select, merge, upsert all of it."""
+    data, _ = await store.get_memory(user_id)
+    data['user_facts'].append({"content": f"• fact {i}", "created_at": ""})
+    await store.upsert_memory(user_id, data)
+
+
+async def cas_turn(service: MemoryService, user_id: str, i: int, args) -> None:
+    memory = await service.load_memory(user_id)
+    memory['history'].append({"role": "user", "content": f"message {i}"})
+    await asyncio.sleep(random.uniform(0, args.llm_time))
+    memory['history'].append({"role": "assistant", "content": f"reply {i}"})
+    memory['balance'] += 2
+    await service.save_memory(user_id, memory)
+
+
+async def cas_extraction(service: MemoryService, user_id: str, i: int) -> None:
+    await service.save_facts(user_id, [f"• fact {i}"])
+
+
+async def run_mode(mode: str, args) -> dict:
+    random.seed(args.seed)
+    if args.store == "sqlite":
+        store = SQLiteStore(args.sqlite_path)
+    else:
+        store = LocalStore(latency=args.db_latency)
+    service = MemoryService(store=store)
+    service.history_storage = "blob"  # the legacy path only knows blob history
+    users = [f"user-{u}" for u in range(args.users)]
+    for user_id in users:
+        await service.create_user_memory(user_id, {"name": user_id})
+
+    async def session(user_id: str, session_id: int):
+        for i in range(session_id, args.turns, args.sessions):
+            if mode == "legacy":
+                await legacy_turn(store, user_id, i, args)
+            else:
+                await cas_turn(service, user_id, i, args)
+
+    async def extraction(user_id: str, i: int):
+        await asyncio.sleep(random.uniform(0, args.turns / args.sessions * args.llm_time / 2))
+        if mode == "legacy":
+            await legacy_extraction(store, user_id, i)
+        else:
+            await cas_extraction(service, user_id, i)
+
+    jobs = []
+    for user_id in users:
+        jobs += [session(user_id, s) for s in range(args.sessions)]
+        jobs += [extraction(user_id, i) for i in range(args.extractions)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - start
+
+    lost = {"messages": 0, "coins": 0, "facts": 0}
+    for user_id in users:
+        data, _ = await store.get_memory(user_id)
+        lost["messages"] += 2 * args.turns - len(data['history'])
+        lost["coins"] += 100 + 2 * args.turns - data['balance']
+        lost["facts"] += args.extractions - len(data['user_facts'])
+
+    store.close()
+    return {"elapsed_s": elapsed, "lost": lost, "writes": service.get_write_stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=2, help="concurrent turn senders per user")
+    parser.add_argument("--turns", type=int, default=12, help="per user (keep 2x under the 50-message history cap)")
+    parser.add_argument("--extractions", type=int, default=4, help="per user (keep under the 20-fact cap)")
+    parser.add_argument("--store", choices=["local", "sqlite"], default="local")
+    parser.add_argument("--sqlite-path", default=":memory:")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="simulated, local store only")
+    parser.add_argument("--llm-time", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    total = args.users
+    print(
+        f"{args.users} users x ({args.turns} turns over {args.sessions} sessions "
+        f"+ {args.extractions} background extractions)"
+    )
+    print(f"  expected per run: {2 * args.turns * total} messages, {2 * args.turns * total} coins, {args.extractions * total} facts")
+    for mode in ("legacy", "cas"):
+        r = asyncio.run(run_mode(mode, args))
+        lost = r["lost"]
+        line = (
+            f"  {mode:<6} elapsed={r['elapsed_s']:.2f}s  lost messages={lost['messages']} "
+            f"coins={lost['coins']} facts={lost['facts']}"
+        )
+        if mode == "cas":
+            line += f"  (writes={r['writes']['writes']} conflicts={r['writes']['conflicts']})"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
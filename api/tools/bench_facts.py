@@ -0,0 +1,82 @@
+"""
+Fact Expiry Benchmark
+Times the tier-0 48-hour fact filter on large fact lists: the old per-call
+ISO parse of every created_at vs a bisect on the sorted created_ts, and a
+memoized repeat read of the same blob version.
+
+Run with: python -m api.tools.bench_facts [--sizes 20 1000 10000 100000]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from api.config import TIER_CONFIG
+from api.services.memory import MemoryService
+from api.services.store import LocalStore
+
+
+def legacy_filter(facts_list: list, tier: int) -> tuple:
+    """The pre-bisect implementation: parse every timestamp on every call."""
+    cutoff = datetime.now() - timedelta(hours=TIER_CONFIG[tier]["memory_hours"])
+    valid_facts, expired_count = [], 0
+    for fact in facts_list:
+        created_str = fact.get("created_at", "")
+        if created_str:
+            try:
+                if datetime.fromisoformat(created_str) >= cutoff:
+                    valid_facts.append(fact["content"])
+                else:
+                    expired_count += 1
+            except (ValueError, TypeError):
+                valid_facts.append(fact["content"])
+        else:
+            valid_facts.append(fact["content"])
+    return valid_facts, expired_count
+
+
+def synthetic_facts(count: int) -> list:
+    """Facts spread evenly over the last 96 hours, oldest first."""
+    now = time.time()
+    span = 96 * 3600
+    facts = []
+    for i in range(count):
+        ts = now - span + span * i / count
+        facts.append({
+            "content": f"• User fact {i}",
+            "created_at": datetime.fromtimestamp(ts).isoformat(),
+            "created_ts": ts
+        })
+    return facts
+
+
+def per_call_us(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 1000, 10000, 100000])
+    args = parser.parse_args()
+
+    service = MemoryService(store=LocalStore())
+    print(f"{'facts':>8} {'legacy us':>12} {'bisect us':>12} {'memo hit us':>12}")
+    for size in args.sizes:
+        facts = synthetic_facts(size)
+        repeat = max(3, 200_000 // size)
+
+        expected = legacy_filter(facts, 0)
+        assert service.get_valid_facts_with_expiry(facts, 0) == expected
+
+        legacy = per_call_us(lambda: legacy_filter(facts, 0), repeat)
+        bisected = per_call_us(lambda: service.get_valid_facts_with_expiry(facts, 0), repeat)
+        user_id = f"bench-{size}"
+        service.get_valid_facts_with_expiry(facts, 0, user_id, 1)
+        memo = per_call_us(lambda: service.get_valid_facts_with_expiry(facts, 0, user_id, 1), repeat)
+        print(f"{size:>8} {legacy:>12.1f} {bisected:>12.1f} {memo:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
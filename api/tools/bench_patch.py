@@ -0,0 +1,78 @@
+"""
+Patch Write Benchmark
+Compares write payload size of full-blob upserts vs patch_memory for the
+small-update endpoints, and checks both produce the same stored blob.
+
+Run with: python -m api.tools.bench_patch [--history 50] [--facts 20]
+"""
+import argparse
+import asyncio
+import copy
+import json
+
+from api.services.store import LocalStore, apply_memory_patch
+
+
+def synthetic_memory(history: int, facts: int) -> dict:
+    """A realistic, fully populated memory blob."""
+    return {
+        "history": [
+            {"role": "user" if i % 2 == 0 else "assistant",
+             "content": "I had a long day at work and the meeting ran over again. " * 2}
+            for i in range(history)
+        ],
+        "emotional_state": {"closeness": 35, "warmth": 40, "pace": 10, "stability": 70, "scene_score": 0, "agency": 22},
+        "user_profile": {"name": "Sam", "age": "29", "gender": "", "companion_name": "Keepsake"},
+        "active_context": {"last_topic": "", "significant_event": "job interview", "event_date": "2026-10-15", "last_recalled_date": ""},
+        "user_facts": [
+            {"content": f"• User mentioned detail number {i} about their life", "created_at": "2026-10-14T10:30:00"}
+            for i in range(facts)
+        ],
+        "balance": 180,
+        "inventory": ["default"],
+        "current_outfit": "default",
+        "tier": 1,
+        "avatar_id": "1",
+        "has_chosen_avatar": True,
+        "time_offset": 0,
+        "last_active_timestamp": "2026-10-16T09:00:00",
+    }
+
+
+ENDPOINT_PATCHES = {
+    "PUT /user/profile": {"user_profile.name": "Sammy", "time_offset": -5},
+    "POST /user/avatar/{id}": {"avatar_id": "2", "has_chosen_avatar": True},
+    "POST /user/spend/{amount}": {"balance": 170, "emotional_state.warmth": 45},
+    "POST /chat/greeting (recall)": {"active_context.last_recalled_date": "2026-10-16"},
+}
+
+
+async def run(args) -> None:
+    base = synthetic_memory(args.history, args.facts)
+    print(f"blob: {args.history} messages, {args.facts} facts\n")
+    print(f"{'endpoint':<30} {'upsert bytes':>12} {'patch bytes':>12} {'ratio':>8}")
+
+    for endpoint, patch in ENDPOINT_PATCHES.items():
+        full_store, patch_store = LocalStore(), LocalStore()
+        await full_store.upsert_memory("u", base)
+        await patch_store.upsert_memory("u", base)
+
+        updated = apply_memory_patch(copy.deepcopy(base), patch)
+        await full_store.upsert_memory("u", updated)
+        await patch_store.patch_memory("u", patch)
+        assert full_store.memories["u"] == patch_store.memories["u"], endpoint
+
+        full_bytes = len(json.dumps({"id": "u", "data": updated}))
+        patch_bytes = len(json.dumps({"p_user_id": "u", "p_patch": patch}))
+        print(f"{endpoint:<30} {full_bytes:>12} {patch_bytes:>12} {full_bytes / patch_bytes:>7.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=int, default=50)
+    parser.add_argument("--facts", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Concurrent Stream Benchmark
+Measures how database calls affect concurrent SSE streams, through the
+real MemoryService and store code.
+
+Each simulated stream is one user's turn with the same shape as
+/chat/message/stream: MemoryService.load_memory, chunks emitted at a fixed
+token interval, then MemoryService.save_memory. The store is a SQLiteStore
+whose calls each take a blocking `--db-latency` round trip first, standing
+in for the synchronous Supabase client's `.execute()`:
+
+- inline: calls block the event loop (the old MemoryService)
+- pool N: calls go through PooledStore.run on N I/O threads with the
+  `--timeout` per call, as SupabaseStore's do (DB_POOL_SIZE, DB_TIMEOUT_SECONDS)
+
+Run with: python -m api.tools.bench_streams [--streams 50] [--db-latency 0.05] [--pool-sizes 4 16 32]
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from api.services.memory import MemoryService, record_message
+from api.services.store import SQLiteStore
+
+
+class RemoteSQLiteStore(SQLiteStore):
+    """
+    In-memory SQLiteStore behind a simulated network round trip. The
+    round trips overlap on the I/O pool; the SQLite work itself is serialized
+    on the one connection, as it only takes microseconds.
+    """
+
+    def __init__(self, latency: float, pool_size: int, timeout: float, inline: bool = False):
+        super().__init__(":memory:", timeout=timeout)
+        # The I/O pool SupabaseStore would have (SQLiteStore's is one thread)
+        self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="keepsake-db")
+        self.latency = latency
+        self.inline = inline
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    async def run(self, fn: Callable[[], Any]) -> Any:
+        def round_trip():
+            time.sleep(self.latency)
+            with self._lock:
+                return fn()
+
+        self.calls += 1
+        if self.inline:
+            return round_trip()
+        return await super().run(round_trip)
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[max(int(len(values) * p) - 1, 0)]
+
+
+async def run_stream(service: MemoryService, user_id: str, args, stats: dict) -> int:
+    """One streaming chat turn; returns chunks emitted."""
+    start = time.perf_counter()
+    memory = await service.load_memory(user_id)
+    stats["loads"].append(time.perf_counter() - start)
+    record_message(memory, "user", "hello")
+
+    last = time.perf_counter()
+    for _ in range(args.chunks):
+        await asyncio.sleep(args.chunk_interval)
+        now = time.perf_counter()
+        stats["gaps"].append(now - last)
+        last = now
+
+    record_message(memory, "assistant", "reply " * args.chunks)
+    if not await service.save_memory(user_id, memory):
+        stats["failed_saves"] += 1
+    return args.chunks
+
+
+async def run_mode(pool_size: int, inline: bool, args) -> dict:
+    store = RemoteSQLiteStore(args.db_latency, pool_size, args.timeout, inline=inline)
+    service = MemoryService(store=store)
+    service.history_storage = "blob"
+    users = [f"user-{i}" for i in range(args.streams)]
+    for user_id in users:
+        await service.create_user_memory(user_id, {"name": user_id})
+        # Every turn reads the database, as on a cold cache or another worker
+        service.invalidate(user_id)
+
+    stats = {"gaps": [], "loads": [], "failed_saves": 0}
+    calls_before = store.calls
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_stream(service, user_id, args, stats) for user_id in users))
+    elapsed = time.perf_counter() - start
+    store.close()
+
+    return {
+        "elapsed_s": elapsed,
+        "chunks_per_s": sum(results) / elapsed,
+        "gap_p50_ms": statistics.median(stats["gaps"]) * 1000,
+        "gap_p99_ms": percentile(stats["gaps"], 0.99) * 1000,
+        "load_p50_ms": statistics.median(stats["loads"]) * 1000,
+        "load_p99_ms": percentile(stats["loads"], 0.99) * 1000,
+        "db_calls": store.calls - calls_before,
+        "failed_saves": stats["failed_saves"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--chunk-interval", type=float, default=0.02)
+    parser.add_argument("--db-latency", type=float, default=0.05)
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[4, 16, 32])
+    parser.add_argument("--timeout", type=float, default=10.0, help="per database call, like DB_TIMEOUT_SECONDS")
+    args = parser.parse_args()
+
+    print(f"{args.streams} streams x {args.chunks} chunks, db latency {args.db_latency * 1000:.0f}ms")
+    modes = [("inline", 1, True)] + [(f"pool {size}", size, False) for size in args.pool_sizes]
+    for label, pool_size, inline in modes:
+        r = asyncio.run(run_mode(pool_size, inline, args))
+        print(
+            f"  {label:<8} elapsed={r['elapsed_s']:.2f}s  "
+            f"throughput={r['chunks_per_s']:.0f} chunks/s  "
+            f"gap p50={r['gap_p50_ms']:.1f}ms p99={r['gap_p99_ms']:.1f}ms  "
+            f"load p50={r['load_p50_ms']:.0f}ms p99={r['load_p99_ms']:.0f}ms  "
+            f"db calls={r['db_calls']} failed saves={r['failed_saves']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
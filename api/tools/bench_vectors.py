@@ -0,0 +1,96 @@
+"""
+Recall Vector Storage Benchmark
+Recall@k and size of each storage profile (EMBEDDING_DIMENSIONS x
+VECTOR_QUANTIZATION) against exact full-length float32 search.
+
+The corpus is synthetic: clustered unit vectors whose variance falls off
+along the dimensions, like text-embedding-3's (shortened embeddings are its
+leading dimensions). Queries are noisy copies of corpus vectors. Searches
+go through the index's UserVectors, so the numbers are for the same code
+RAG uses. How much shortening costs depends on the real embeddings'
+spectrum, so check a profile against production data before switching.
+
+Needs numpy, like the index itself: pip install numpy
+
+Run with: python -m api.tools.bench_vectors [--vectors 5000] [--queries 200] [--k 3]
+"""
+import argparse
+import math
+import random
+import time
+
+from api.services import vector_codec
+from api.services.vectors import UserVectors, np
+
+FULL_DIMENSIONS = 1536
+
+
+def synthetic_corpus(rng: random.Random, args) -> tuple:
+    """(corpus, queries) of unit vectors: corpus drawn around cluster centers."""
+    weights = [1 / (1 + i / args.decay) for i in range(FULL_DIMENSIONS)]
+
+    def around(center, spread):
+        vector = [c + rng.gauss(0.0, spread) * w for c, w in zip(center, weights)]
+        norm = math.sqrt(sum(x * x for x in vector))
+        return [x / norm for x in vector]
+
+    centers = [[rng.gauss(0.0, 1.0) * w for w in weights] for _ in range(args.clusters)]
+    corpus = [around(rng.choice(centers), args.spread) for _ in range(args.vectors)]
+    queries = [around(rng.choice(corpus), args.noise) for _ in range(args.queries)]
+    return corpus, queries
+
+
+def top_k(index: UserVectors, queries: list, k: int) -> tuple:
+    """(result sets, mean search ms)."""
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        matches = index.search(query, -1.0, k)
+        results.append({match["content"] for match in matches})
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--dims", type=int, nargs="+", default=[1536, 1024, 512, 256])
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--spread", type=float, default=0.6)
+    parser.add_argument("--noise", type=float, default=0.4)
+    parser.add_argument("--decay", type=float, default=64.0, help="variance of dim i ~ 1 / (1 + i / decay)^2")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    if np is None:
+        raise SystemExit("bench_vectors needs numpy: pip install numpy")
+
+    rng = random.Random(args.seed)
+    corpus, queries = synthetic_corpus(rng, args)
+    contents = [str(i) for i in range(len(corpus))]
+
+    exact = UserVectors()
+    exact.extend(contents, corpus)
+    truth, _ = top_k(exact, queries, args.k)
+
+    print(f"{args.vectors} vectors, {args.queries} queries, recall@{args.k} vs exact {FULL_DIMENSIONS}-dim float32\n")
+    print(f"{'dims':>6} {'encoding':<9} {'bytes/vec':>10} {'wire B/vec':>11} {'vs full':>8} "
+          f"{'recall@k':>9} {'index MB':>9} {'search ms':>10}")
+    for dims in args.dims:
+        shortened = [vector_codec.truncate(vector, dims) for vector in corpus]
+        short_queries = [vector_codec.truncate(query, dims) for query in queries]
+        for quantization in vector_codec.QUANTIZATIONS:
+            index = UserVectors(dims, quantization)
+            index.extend(contents, shortened)
+            found, search_ms = top_k(index, short_queries, args.k)
+            recall = sum(len(f & t) for f, t in zip(found, truth)) / sum(len(t) for t in truth)
+
+            size = vector_codec.encoded_size(dims, quantization)
+            wire = sum(vector_codec.wire_size(v, quantization) for v in shortened[:100]) / min(100, len(shortened))
+            ratio = size / vector_codec.encoded_size(FULL_DIMENSIONS, "float32")
+            print(f"{dims:>6} {quantization:<9} {size:>10} {wire:>11.0f} {ratio:>8.1%} "
+                  f"{recall:>9.3f} {index.nbytes / 1e6:>9.1f} {search_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Bulk Memory Migration
+Rewrites every memories row at the current SCHEMA_VERSION (and MEMORY_ENCODING)
+offline, instead of waiting for each user's next read to upgrade it.
+
+Streams the table in keyset-paginated pages (id order, next page prefetched),
+upgrades rows in a process pool and writes changed rows back in batches with
+compare-and-swap. With HISTORY_STORAGE=table, stale rows are upgraded with
+their chat_messages tail (as a normal read would) so message counters are
+seeded from real history, and history still in a blob is moved to
+chat_messages (unless the table already has the user's messages) with
+store.move_history: the append and the blob rewrite are one transaction on
+the row's version and an empty log, so a live read moving the same history
+concurrently (or a conflict here) can't leave it copied twice. Rows written
+by live traffic in the meantime are skipped; they are upgraded on their next
+read anyway. Progress is checkpointed after
+every page, so a killed run resumes where it stopped (--restart ignores it).
+
+Run with: python -m api.tools.migrate [--workers 4] [--page-size 1000] [--batch-size 200]
+Try it locally: python -m api.tools.migrate --store local --seed-users 20000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from api.config import get_settings
+from api.services.codec import MemoryCodec, is_encoded
+from api.services.memory import HISTORY_LIMIT, needs_upgrade, upgrade_memory
+from api.services.store import LocalStore, MemoryStore, SQLiteStore, create_store
+
+Row = Tuple[str, Dict[str, Any], int]
+# user_id -> last HISTORY_LIMIT chat_messages (table mode)
+Tails = Dict[str, List[Dict[str, Any]]]
+# (user_id, legacy blob messages for chat_messages, new stored blob, version read)
+Move = Tuple[str, List[Dict[str, Any]], Dict[str, Any], int]
+
+# Per worker process, set by _init_worker
+_codec: Optional[MemoryCodec] = None
+_history_storage = "blob"
+
+
+def _init_worker(encoding: str, dict_path: str, history_storage: str) -> None:
+    global _codec, _history_storage
+    _codec = MemoryCodec(encoding, dict_path)
+    _history_storage = history_storage
+
+
+def transform_rows(rows: List[Row], tails: Optional[Tails] = None) -> Tuple[List[Row], List[Row], List[Move]]:
+    """
+    Upgrade a chunk of rows (runs in a worker process).
+    Returns ((user_id, new stored blob, version read) for rows that changed,
+    table-mode rows (stale or holding history) whose chat_messages tail isn't
+    in `tails` yet, changed rows whose blob history moves to chat_messages).
+    """
+    changed, deferred, moves = [], [], []
+    for user_id, stored, version in rows:
+        data = _codec.decode(stored)
+        stale = needs_upgrade(data)
+        moved = False
+        if _history_storage == "table" and (stale or 'history' in data):
+            if tails is None or user_id not in tails:
+                deferred.append((user_id, stored, version))
+                continue
+            tail = tails[user_id]
+            legacy_history = data.pop('history', None) or []
+            if stale:
+                upgrade_memory(data, tail or legacy_history)
+            # The upgrade backfills an empty history key; table-mode blobs have none
+            data.pop('history', None)
+            if legacy_history and not tail:
+                moves.append((user_id, legacy_history, _codec.encode(data), version))
+                continue
+            moved = True
+        elif stale:
+            upgrade_memory(data)
+        if stale or moved or is_encoded(stored) != _codec.compressed:
+            changed.append((user_id, _codec.encode(data), version))
+    return changed, deferred, moves
+
+
+async def fetch_tails(store: MemoryStore, rows: List[Row]) -> Tails:
+    """chat_messages tails for rows that transform_rows deferred (empty: no messages yet)."""
+    user_ids = [user_id for user_id, _, _ in rows]
+    tails = await asyncio.gather(*(store.get_messages(user_id, HISTORY_LIMIT) for user_id in user_ids))
+    return dict(zip(user_ids, tails))
+
+
+async def migrate_page(
+    store: MemoryStore,
+    pool: Executor,
+    rows: List[Row],
+    workers: int,
+    batch_size: int,
+    dry_run: bool = False
+) -> Tuple[int, int]:
+    """Upgrade and write back one scanned page. Returns (rows written, rows skipped on conflict)."""
+    loop = asyncio.get_running_loop()
+    chunk_size = -(-len(rows) // workers)
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(pool, transform_rows, rows[i:i + chunk_size])
+        for i in range(0, len(rows), chunk_size)
+    ))
+    changed = [row for chunk, _, _ in chunks for row in chunk]
+    deferred = [row for _, chunk, _ in chunks for row in chunk]
+    moves: List[Move] = []
+    if deferred:
+        tails = await fetch_tails(store, deferred)
+        upgraded, _, moves = await loop.run_in_executor(pool, transform_rows, deferred, tails)
+        changed.extend(upgraded)
+
+    if dry_run:
+        return len(changed) + len(moves), 0
+
+    written = conflicts = 0
+    # None: the row changed or its chat_messages filled since the page was read
+    versions = await asyncio.gather(*(
+        store.move_history(user_id, messages, stored, version)
+        for user_id, messages, stored, version in moves
+    ))
+    for i in range(0, len(changed), batch_size):
+        versions.extend(await store.put_memories(changed[i:i + batch_size]))
+    for version in versions:
+        if version is None:
+            conflicts += 1
+        else:
+            written += 1
+    return written, conflicts
+
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"after": None, "scanned": 0, "written": 0, "conflicts": 0}
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    """Write atomically so a kill mid-write can't corrupt it."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+async def seed_legacy_rows(store: MemoryStore, users: int) -> None:
+    """Fill a local/SQLite store with pre-versioning blobs to migrate."""
+    rows = [
+        (f"user-{u:07d}", {
+            "history": [{"role": "user", "content": f"message {i}"} for i in range(80)],
+            "user_facts": [f"• legacy fact {i}" for i in range(5)],
+            "balance": 100,
+            "tier": u % 3,
+        }, None)
+        for u in range(users)
+    ]
+    for i in range(0, len(rows), 1000):
+        await store.put_memories(rows[i:i + 1000])
+
+
+def build_store(args, settings) -> MemoryStore:
+    if args.store == "local":
+        return LocalStore(latency=args.db_latency)
+    if args.store == "sqlite":
+        return SQLiteStore(args.sqlite_path or settings.sqlite_path, timeout=settings.db_timeout_seconds)
+    return create_store(settings)
+
+
+async def run(args) -> None:
+    settings = get_settings()
+    store = build_store(args, settings)
+    if args.seed_users:
+        if args.store not in ("local", "sqlite"):
+            raise SystemExit("--seed-users only works with --store local or sqlite")
+        await seed_legacy_rows(store, args.seed_users)
+
+    checkpoint = {"after": None, "scanned": 0, "written": 0, "conflicts": 0}
+    if not args.restart and args.store != "local":
+        checkpoint = load_checkpoint(args.checkpoint)
+        if checkpoint["after"] is not None:
+            print(f"Resuming after {checkpoint['after']} ({checkpoint['scanned']} rows already scanned)")
+
+    scanned = written = conflicts = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(settings.memory_encoding, settings.memory_codec_dict_path, settings.history_storage)
+    ) as pool:
+        next_page = asyncio.ensure_future(store.scan_memories(checkpoint["after"], args.page_size))
+        try:
+            while True:
+                rows = await next_page
+                if not rows:
+                    break
+                # Read the next page while this one is transformed and written
+                next_page = asyncio.ensure_future(store.scan_memories(rows[-1][0], args.page_size))
+
+                page_written, page_conflicts = await migrate_page(
+                    store, pool, rows, args.workers, args.batch_size, args.dry_run
+                )
+                written += page_written
+                conflicts += page_conflicts
+
+                scanned += len(rows)
+                if not args.dry_run and args.store != "local":
+                    # Totals include earlier runs resumed from this checkpoint
+                    save_checkpoint(args.checkpoint, {
+                        "after": rows[-1][0],
+                        "scanned": checkpoint["scanned"] + scanned,
+                        "written": checkpoint["written"] + written,
+                        "conflicts": checkpoint["conflicts"] + conflicts,
+                    })
+
+                elapsed = time.perf_counter() - start
+                print(f"  {scanned} rows scanned, {written} written, {conflicts} skipped (concurrent write) "
+                      f"- {scanned / elapsed:,.0f} rows/s")
+        finally:
+            next_page.cancel()
+            store.close()
+
+    elapsed = time.perf_counter() - start
+    rate = scanned / elapsed if elapsed else 0.0
+    verb = "would be written" if args.dry_run else "written"
+    print(f"Done: {scanned} rows scanned, {written} {verb}, {conflicts} skipped in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", choices=["supabase", "sqlite", "local"], default=None,
+                        help="default: MEMORY_STORE")
+    parser.add_argument("--sqlite-path", default=None, help="default: SQLITE_PATH")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--checkpoint", default="migrate.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="transform but don't write")
+    parser.add_argument("--seed-users", type=int, default=0, help="local/sqlite only: create legacy rows first")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="simulated, local store only")
+    args = parser.parse_args()
+    if args.store is None:
+        args.store = get_settings().memory_store
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
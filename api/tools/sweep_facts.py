@@ -0,0 +1,35 @@
+"""
+Purge expired free-tier facts once (e.g. from cron, with the in-process
+sweeper disabled via FACT_SWEEP_INTERVAL_SECONDS=0).
+
+Run with: python -m api.tools.sweep_facts [--page-size 500]
+"""
+import argparse
+import asyncio
+
+from api.services.memory import memory_service
+from api.services.sweeper import FactSweeper
+
+
+async def run(args) -> None:
+    sweeper = FactSweeper(memory_service, page_size=args.page_size, page_pause=args.page_pause)
+    try:
+        totals = await sweeper.sweep_once()
+    finally:
+        memory_service.store.close()
+    print(
+        f"Scanned {totals['rows']} rows: purged {totals['facts']} facts from {totals['users']} users "
+        f"({totals['conflicts']} rows changed mid-sweep, left for next time) "
+        f"in {sweeper.stats['last_sweep_seconds']}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--page-pause", type=float, default=0.0, help="seconds between pages")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
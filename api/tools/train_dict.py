@@ -0,0 +1,60 @@
+"""
+Train the shared zstd dictionary for compressed memory blobs.
+Samples stored blobs (plain or already compressed) from the configured
+store and writes a dictionary for MEMORY_CODEC_DICT_PATH.
+
+Blobs compressed with one dictionary need that same file to be read, so
+keep old dictionaries around (or re-encode rows) when retraining.
+
+Run with: python -m api.tools.train_dict --out keepsake.zdict [--samples 2000] [--size 16384]
+"""
+import argparse
+import asyncio
+
+from api.config import get_settings
+from api.services.codec import MemoryCodec, train_dictionary
+from api.services.store import create_store
+
+PAGE_SIZE = 500
+
+
+async def run(args) -> None:
+    settings = get_settings()
+    store = create_store(settings)
+    codec = MemoryCodec("json", settings.memory_codec_dict_path)
+    samples = []
+    after = None
+
+    try:
+        while len(samples) < args.samples:
+            rows = await store.scan_memories(after, PAGE_SIZE)
+            if not rows:
+                break
+            for _, data, _ in rows:
+                samples.append(codec.decode(data))
+            after = rows[-1][0]
+    finally:
+        store.close()
+
+    samples = samples[:args.samples]
+    if not samples:
+        print("No memory rows to train on")
+        return
+
+    dictionary = train_dictionary(samples, size=args.size)
+    with open(args.out, "wb") as f:
+        f.write(dictionary)
+    print(f"Trained on {len(samples)} blobs: {len(dictionary)} bytes written to {args.out}")
+    print(f"Set MEMORY_CODEC_DICT_PATH={args.out} and MEMORY_ENCODING=msgpack-zstd to use it")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="keepsake.zdict")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=16 * 1024, help="dictionary size in bytes")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
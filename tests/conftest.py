@@ -0,0 +1,24 @@
+"""
+Test setup: dummy credentials so api.config.Settings loads without a .env,
+and each test gets an in-process memory store.
+"""
+import os
+
+for key in ("OPENAI_API_KEY", "SUPABASE_URL", "SUPABASE_KEY", "SUPABASE_JWT_SECRET"):
+    os.environ.setdefault(key, "https://test.invalid" if key == "SUPABASE_URL" else "test")
+
+import pytest
+
+from api.services.cache import TTLCache
+from api.services.memory import memory_service
+from api.services.store import LocalStore
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """A fresh LocalStore behind memory_service, with empty caches."""
+    local = LocalStore()
+    monkeypatch.setattr(memory_service, "store", local)
+    monkeypatch.setattr(memory_service, "cache", TTLCache(max_size=16, ttl=60))
+    monkeypatch.setattr(memory_service, "_accounts", TTLCache(max_size=16, ttl=60))
+    return local
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from api.services.codec import MemoryCodec, is_encoded, train_dictionary
+from api.services.memory import default_memory, memory_service, record_message
+
+USER_ID = "00000000-0000-0000-0000-000000000005"
+
+
+def sample_blob(i):
+    blob = default_memory()
+    blob["user_profile"]["name"] = f"User {i}"
+    blob["history"] = [
+        {"role": "user" if n % 2 == 0 else "assistant", "content": f"Message {n} about day {i}: work, sleep, coffee."}
+        for n in range(20)
+    ]
+    blob["history"].append({"role": "user", "content": "with a seq", "seq": 21})
+    blob["user_facts"] = [{"content": f"• User likes thing {i}", "created_at": "2024-01-15T10:30:00", "created_ts": 1.5}]
+    return blob
+
+
+def test_plain_json_blobs_decode_as_is():
+    blob = sample_blob(1)
+
+    assert MemoryCodec("json").encode(blob) is blob
+    assert MemoryCodec("json").decode(blob) == blob
+    # A compressing codec still reads rows written before it was switched on
+    pytest.importorskip("msgpack")
+    pytest.importorskip("zstandard")
+    assert MemoryCodec("msgpack-zstd").decode(blob) == blob
+
+
+def test_compressed_round_trip():
+    pytest.importorskip("msgpack")
+    pytest.importorskip("zstandard")
+    codec = MemoryCodec("msgpack-zstd")
+    blob = sample_blob(2)
+
+    stored = codec.encode(blob)
+    assert is_encoded(stored)
+    assert stored["dict_id"] == 0
+    assert codec.decode(stored) == blob
+    # And by a codec configured for plain JSON, e.g. after switching back
+    assert MemoryCodec("json").decode(stored) == blob
+
+
+def test_dictionary_round_trip_and_missing_dictionary(tmp_path):
+    pytest.importorskip("msgpack")
+    pytest.importorskip("zstandard")
+    dict_path = tmp_path / "keepsake.zdict"
+    dict_path.write_bytes(train_dictionary([sample_blob(i) for i in range(400)], size=4096))
+    codec = MemoryCodec("msgpack-zstd", str(dict_path))
+    blob = sample_blob(500)
+
+    stored = codec.encode(blob)
+    assert stored["dict_id"] != 0
+    assert MemoryCodec("json", str(dict_path)).decode(stored) == blob
+
+    with pytest.raises(ValueError, match="dictionary"):
+        MemoryCodec("msgpack-zstd").decode(stored)
+
+
+def test_unknown_envelope_version_is_rejected():
+    pytest.importorskip("msgpack")
+    pytest.importorskip("zstandard")
+    stored = MemoryCodec("msgpack-zstd").encode(sample_blob(3))
+    stored["v"] = 99
+
+    with pytest.raises(ValueError, match="version"):
+        MemoryCodec("msgpack-zstd").decode(stored)
+
+
+def test_unknown_encoding_is_rejected():
+    with pytest.raises(ValueError, match="MEMORY_ENCODING"):
+        MemoryCodec("gzip")
+
+
+def test_history_packing_keeps_messages_with_extra_keys():
+    pytest.importorskip("msgpack")
+    pytest.importorskip("zstandard")
+    codec = MemoryCodec("msgpack-zstd")
+    blob = sample_blob(4)
+    blob["history"][0]["mood"] = "happy"
+
+    decoded = codec.decode(codec.encode(blob))
+    assert decoded["history"][0] == {"role": "user", "content": blob["history"][0]["content"], "mood": "happy"}
+    assert decoded["history"][-1] == {"role": "user", "content": "with a seq", "seq": 21}
+    assert decoded == blob
+
+
+def test_compressed_memory_saves_and_loads(store, monkeypatch):
+    pytest.importorskip("msgpack")
+    pytest.importorskip("zstandard")
+    monkeypatch.setattr(memory_service, "codec", MemoryCodec("msgpack-zstd"))
+
+    async def turn():
+        memory = await memory_service.load_memory(USER_ID)
+        record_message(memory, "user", "hello")
+        return await memory_service.save_memory(USER_ID, memory)
+
+    assert asyncio.run(turn())
+    assert asyncio.run(turn())
+    assert is_encoded(store.memories[USER_ID])
+    memory_service.invalidate(USER_ID)
+    memory = asyncio.run(memory_service.load_memory(USER_ID))
+    assert [m["content"] for m in memory["history"]] == ["hello", "hello"]
+    assert memory["user_message_count"] == 2
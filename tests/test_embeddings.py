@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+from api.services.embeddings import EmbeddingService
+from api.services.store import LocalStore
+from api.services.vectors import VectorWriter
+
+
+class FakeEmbeddings:
+    """embeddings.create stand-in that records every input it is sent."""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.calls = []
+
+    async def create(self, input, model, dimensions=None):
+        texts = [input] if isinstance(input, str) else list(input)
+        self.calls.append(texts)
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(t)), 1.0]) for t in texts])
+
+
+def service():
+    fake = FakeEmbeddings()
+    return EmbeddingService(client=SimpleNamespace(embeddings=fake)), fake
+
+
+def test_embed_many_waits_for_texts_already_being_embedded():
+    embedder, fake = service()
+
+    async def run():
+        # The turn's RAG embedding is still in flight when the batch flushes
+        turn = asyncio.ensure_future(embedder.embed("a message worth remembering"))
+        await asyncio.sleep(0)
+        batch = await embedder.embed_many(["a message worth remembering", "another one"])
+        assert batch[0] == await turn
+
+    asyncio.run(run())
+    assert fake.calls == [["a message worth remembering"], ["another one"]]
+    assert embedder.counters["api_inputs"] == 2
+
+
+def test_writer_does_not_re_embed_a_turn_that_missed_the_rag_budget():
+    embedder, fake = service()
+    store = LocalStore()
+    writer = VectorWriter(store, embedder, max_delay=0.0)
+    text = "something the user said that is worth keeping"
+
+    async def run():
+        # RAG gave up before the embedding came back, so none is passed along
+        turn = asyncio.ensure_future(embedder.embed(text))
+        await asyncio.sleep(0)
+        writer.submit("u", text, None)
+        await writer.stop()
+        await turn
+
+    asyncio.run(run())
+    assert fake.calls == [[text]]
+    assert [row["content"] for row in store.vectors] == [text]
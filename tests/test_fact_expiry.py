@@ -0,0 +1,54 @@
+import asyncio
+import time
+from datetime import datetime
+
+from api.services.memory import SCHEMA_VERSION, default_memory, expired_prefix, memory_service
+
+USER_ID = "00000000-0000-0000-0000-000000000014"
+DAY = 24 * 3600
+
+
+def app_fact(content, age):
+    """A fact as app.py writes it: ISO created_at, no created_ts."""
+    return {"content": content, "created_at": datetime.fromtimestamp(time.time() - age).isoformat()}
+
+
+def api_fact(content, age):
+    ts = time.time() - age
+    return {"content": content, "created_at": datetime.fromtimestamp(ts).isoformat(), "created_ts": ts}
+
+
+def test_created_at_only_facts_expire_by_their_created_at():
+    facts = [app_fact("• User is fresh", 60), api_fact("• User is old", 3 * DAY)]
+
+    assert expired_prefix(facts, 0) == 1
+    # Sorted in place, so the expired prefix is the old fact
+    assert [f["content"] for f in facts] == ["• User is old", "• User is fresh"]
+
+    facts = [api_fact("• User is recent", 60), app_fact("• User is five days old", 5 * DAY)]
+    assert expired_prefix(facts, 0) == 1
+    assert facts[0]["content"] == "• User is five days old"
+    # Paid tiers keep everything
+    assert expired_prefix(facts, 1) == 0
+
+
+def test_sweep_keeps_fresh_app_facts(store):
+    data = default_memory()
+    data["schema_version"] = SCHEMA_VERSION
+    data["user_facts"] = [
+        api_fact("• User is old", 3 * DAY),
+        api_fact("• User is recent", 60),
+        # Appended by app.py after the API's facts, older than the one before it
+        app_fact("• User is from yesterday", DAY),
+        app_fact("• User is ancient", 5 * DAY),
+    ]
+    asyncio.run(store.upsert_memory(USER_ID, data))
+
+    async def sweep():
+        rows = await store.scan_memories(None, 10)
+        return await memory_service.purge_expired_facts(rows)
+
+    assert asyncio.run(sweep())["facts"] == 2
+    stored = store.memories[USER_ID]
+    assert [f["content"] for f in stored["user_facts"]] == ["• User is from yesterday", "• User is recent"]
+    assert stored["expired_facts_count"] == 2
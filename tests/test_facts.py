@@ -0,0 +1,75 @@
+from api.services.facts import FactIndex
+
+
+def fact(content):
+    return {"content": content, "created_at": ""}
+
+
+def contents(index):
+    return [f["content"] for f in index.facts()]
+
+
+def test_exact_repeats_are_duplicates():
+    index = FactIndex([fact("• User likes coffee")])
+
+    assert index.add(fact("user likes coffee!")) == "duplicate"
+    assert contents(index) == ["• User likes coffee"]
+
+
+def test_paraphrases_replace_the_older_phrasing():
+    index = FactIndex([fact("• User likes coffee"), fact("• User has a dog")])
+
+    assert index.add(fact("• User really loves coffee")) == "replaced"
+    assert contents(index) == ["• User has a dog", "• User really loves coffee"]
+
+
+def test_different_facts_are_added():
+    index = FactIndex([fact("• User likes hiking"), fact("• User is married")])
+
+    assert index.add(fact("• User likes biking")) == "added"
+    assert index.add(fact("• User is unmarried")) == "added"
+    assert index.add(fact("• User likes hiking in the mountains")) == "added"
+    assert len(index) == 5
+
+
+def test_changed_tense_replaces_the_fact():
+    index = FactIndex([fact("• User is married"), fact("• User has a dog")])
+
+    assert index.add(fact("• User was married")) == "replaced"
+    assert index.add(fact("• User had a dog")) == "replaced"
+    assert contents(index) == ["• User was married", "• User had a dog"]
+    # And back again
+    assert index.add(fact("• User is married")) == "replaced"
+
+
+def test_one_word_paraphrases_replace_the_older_phrasing():
+    index = FactIndex([
+        fact("• User drinks coffee every morning before work"),
+        fact("• User is training for a marathon in May"),
+        fact("• User has a dog"),
+    ])
+
+    assert index.add(fact("• User drinks coffee each morning before work")) == "replaced"
+    assert index.add(fact("• User is preparing for a marathon in May")) == "replaced"
+    assert contents(index) == [
+        "• User has a dog",
+        "• User drinks coffee each morning before work",
+        "• User is preparing for a marathon in May",
+    ]
+
+
+def test_look_alike_swaps_names_and_numbers_are_different_facts():
+    index = FactIndex([
+        fact("• User goes hiking every weekend with friends"),
+        fact("• User's brother lives in Paris with his wife"),
+        fact("• User's sister Anna works as a nurse downtown"),
+        fact("• User runs 5 miles every morning"),
+    ])
+
+    assert index.add(fact("• User goes biking every weekend with friends")) == "added"
+    assert index.add(fact("• User's mother lives in Paris with his wife")) == "added"
+    assert index.add(fact("• User's sister Maria works as a nurse downtown")) == "added"
+    assert index.add(fact("• User runs 10 miles every morning")) == "added"
+    # Two words swapped is more than a rewording
+    assert index.add(fact("• User goes swimming every evening with friends")) == "added"
+    assert len(index) == 9
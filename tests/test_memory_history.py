@@ -0,0 +1,171 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from api.config import get_settings
+from api.services.memory import default_memory, history_fingerprint, memory_service, record_message
+from api.services.store import LocalStore, SQLiteStore
+from api.tools import migrate
+
+USER_ID = "00000000-0000-0000-0000-000000000002"
+
+
+def test_table_mode_drops_legacy_blob_history(store, monkeypatch):
+    monkeypatch.setattr(memory_service, "history_storage", "table")
+    legacy = default_memory()
+    legacy["history"] = [{"role": "user", "content": f"message {i}"} for i in range(6)]
+    asyncio.run(store.upsert_memory(USER_ID, legacy))
+
+    async def turn():
+        memory = await memory_service.load_memory(USER_ID)
+        record_message(memory, "user", "hello")
+        record_message(memory, "assistant", "hi")
+        return await memory_service.save_memory(USER_ID, memory)
+
+    assert asyncio.run(turn())
+    assert "history" not in store.memories[USER_ID]
+    assert [m["content"] for m in store.messages[USER_ID]][-3:] == ["message 5", "hello", "hi"]
+    assert len(store.messages[USER_ID]) == 8
+
+    # Later turns only append to chat_messages
+    assert asyncio.run(turn())
+    assert "history" not in store.memories[USER_ID]
+    assert len(store.messages[USER_ID]) == 10
+
+
+def migrate_once(store):
+    """One migrate.py page over the whole store, with the workers in-process."""
+    settings = get_settings()
+    migrate._init_worker(settings.memory_encoding, settings.memory_codec_dict_path, "table")
+
+    async def run():
+        rows = await store.scan_memories(None, 100)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return await migrate.migrate_page(store, pool, rows, workers=1, batch_size=100)
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def legacy_table_user(store, monkeypatch):
+    monkeypatch.setattr(memory_service, "history_storage", "table")
+    legacy = default_memory()
+    legacy["history"] = [{"role": "user", "content": f"message {i}"} for i in range(6)]
+    asyncio.run(store.upsert_memory(USER_ID, legacy))
+    return store
+
+
+def test_migration_moves_blob_history_once(legacy_table_user):
+    store = legacy_table_user
+    assert migrate_once(store) == (1, 0)
+    assert "history" not in store.memories[USER_ID]
+    assert [m["seq"] for m in store.messages[USER_ID]] == [1, 2, 3, 4, 5, 6]
+
+    # A live read finds it in chat_messages and appends nothing
+    memory = asyncio.run(memory_service.load_memory(USER_ID))
+    assert [m["seq"] for m in memory["history"]] == [1, 2, 3, 4, 5, 6]
+    assert len(store.messages[USER_ID]) == 6
+
+
+def test_live_read_racing_the_migration_moves_history_once(legacy_table_user, monkeypatch):
+    store = legacy_table_user
+    move = store.move_history
+    raced = []
+
+    async def racing_move(user_id, messages, data, expected_version):
+        # The user's next turn reads (and moves) the blob after the migration
+        # read it with an empty chat_messages tail, before its move lands
+        if not raced:
+            raced.append(user_id)
+            memory = await memory_service.load_memory(user_id)
+            record_message(memory, "user", "hello")
+            assert await memory_service.save_memory(user_id, memory)
+        return await move(user_id, messages, data, expected_version)
+
+    monkeypatch.setattr(store, "move_history", racing_move)
+
+    assert migrate_once(store) == (0, 1)
+    assert "history" not in store.memories[USER_ID]
+    assert [m["content"] for m in store.messages[USER_ID]] == [f"message {i}" for i in range(6)] + ["hello"]
+
+
+@pytest.mark.parametrize("make_store", [LocalStore, lambda: SQLiteStore(":memory:")])
+def test_move_history_is_conditional(make_store):
+    store = make_store()
+    messages = [{"role": "user", "content": "old"}]
+
+    async def run():
+        version = await store.upsert_memory(USER_ID, {"history": messages})
+        # Stale version: nothing written
+        assert await store.move_history(USER_ID, messages, {}, version - 1) is None
+        assert await store.get_messages(USER_ID, 10) == []
+        moved = await store.move_history(USER_ID, messages, {}, version)
+        assert moved == version + 1
+        # The log isn't empty any more, even at the current version
+        assert await store.move_history(USER_ID, messages, {}, moved) is None
+        assert len(await store.get_messages(USER_ID, 10)) == 1
+        assert await store.get_memory(USER_ID) == ({}, moved)
+
+    try:
+        asyncio.run(run())
+    finally:
+        store.close()
+
+
+def test_prompt_history_covers_messages_awaiting_a_fold():
+    memory = default_memory()
+    memory["history"] = [{"role": "user", "content": f"message {i}"} for i in range(40)]
+    memory["history_summary"] = {
+        "text": "earlier", "through": history_fingerprint(memory["history"][:15]), "folded": 15
+    }
+
+    # 15 messages left the window since the summary: not enough to fold yet,
+    # so all of them are still sent
+    assert memory_service.summary_range(memory, 10) is None
+    prompt = memory_service.prompt_history(memory, 10)
+    assert [m["content"] for m in prompt] == [f"message {i}" for i in range(15, 40)]
+
+    # Once folded, only the window is left
+    memory["history_summary"]["through"] = history_fingerprint(memory["history"][:30])
+    assert len(memory_service.prompt_history(memory, 10)) == 10
+
+    # A summary whose end was truncated away: capped at fold + window
+    memory["history_summary"]["through"] = "gone"
+    assert len(memory_service.prompt_history(memory, 10)) == 30
+
+
+def test_turn_whose_write_fails_appends_no_messages(legacy_table_user, monkeypatch):
+    store = legacy_table_user
+    memory = asyncio.run(memory_service.load_memory(USER_ID))
+    monkeypatch.setattr(memory_service, "cas_retries", 0)
+    monkeypatch.setattr(memory_service, "cas_merge_seconds", 0)
+    patch = store.patch_memory
+
+    async def contended(user_id, changes, expected_version=None):
+        # Another device writes first, every time
+        await patch(user_id, {"balance": 90})
+        return await patch(user_id, changes, expected_version=expected_version)
+
+    monkeypatch.setattr(store, "patch_memory", contended)
+    record_message(memory, "user", "hello")
+    assert not asyncio.run(memory_service.save_memory(USER_ID, memory))
+    assert len(store.messages[USER_ID]) == 6
+
+    async def broken(user_id, changes, expected_version=None):
+        raise TimeoutError("database timed out")
+
+    monkeypatch.setattr(store, "patch_memory", broken)
+    memory = asyncio.run(memory_service.load_memory(USER_ID))
+    record_message(memory, "user", "hello")
+    assert not asyncio.run(memory_service.save_memory(USER_ID, memory))
+    assert len(store.messages[USER_ID]) == 6
+
+    # The resent turn is stored once, with its seq
+    monkeypatch.setattr(store, "patch_memory", patch)
+    memory = asyncio.run(memory_service.load_memory(USER_ID))
+    record_message(memory, "user", "hello")
+    assert asyncio.run(memory_service.save_memory(USER_ID, memory))
+    assert [m["content"] for m in store.messages[USER_ID]][-2:] == ["message 5", "hello"]
+    assert memory["history"][-1]["seq"] == 7
+    assert not memory.dirty_fields()
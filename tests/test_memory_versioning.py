@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.main import app
+from api.routes.deps import get_current_user
+from api.services import memory as memory_module
+from api.services.memory import default_memory, memory_service, merge_field, new_fact, record_message
+
+USER_ID = "00000000-0000-0000-0000-000000000004"
+
+
+@pytest.fixture
+def stored(store):
+    """A user with a balance and a fact that a blind write of defaults would lose."""
+    data = default_memory()
+    data["balance"] = 999
+    data["user_facts"] = [new_fact("• User likes tea")]
+    asyncio.run(store.upsert_memory(USER_ID, data))
+    return store
+
+
+def fail_reads(store, monkeypatch, times):
+    """Make the next `times` get_memory calls raise, as in a database timeout."""
+    read = store.get_memory
+    failures = [times]
+
+    async def flaky(user_id):
+        if failures[0] > 0:
+            failures[0] -= 1
+            raise TimeoutError("database timed out")
+        return await read(user_id)
+
+    monkeypatch.setattr(store, "get_memory", flaky)
+
+
+def test_memory_that_failed_to_load_is_never_saved(stored, monkeypatch):
+    fail_reads(stored, monkeypatch, 1)
+
+    async def turn():
+        memory = await memory_service.load_memory(USER_ID)
+        record_message(memory, "user", "hello")
+        memory["balance"] = memory.get("balance", 100) + 2
+        return await memory_service.save_memory(USER_ID, memory)
+
+    assert not asyncio.run(turn())
+    assert stored.memories[USER_ID]["balance"] == 999
+    assert len(stored.memories[USER_ID]["user_facts"]) == 1
+
+    # The failure isn't cached: the next turn reads and saves the real row
+    assert asyncio.run(turn())
+    assert stored.memories[USER_ID]["balance"] == 1001
+    assert len(stored.memories[USER_ID]["user_facts"]) == 1
+
+
+def test_chat_turn_is_refused_when_memory_cannot_be_read(stored, monkeypatch):
+    fail_reads(stored, monkeypatch, 100)
+    app.dependency_overrides[get_current_user] = lambda: {"id": USER_ID, "email": None, "role": "authenticated"}
+    try:
+        response = TestClient(app).post("/chat/message", json={"message": "hello"})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 503
+    assert stored.memories[USER_ID]["balance"] == 999
+    assert stored.versions[USER_ID] == 1
+
+
+def test_merge_field():
+    # Only one side changed: take it
+    assert merge_field("tier", 0, 1, 0) == 1
+    assert merge_field("tier", 0, 0, 2) == 2
+    # Appends replayed, counter deltas applied, the larger index kept
+    assert merge_field("history", [1], [1, 2], [1, 3]) == [1, 3, 2]
+    assert merge_field("balance", 100, 102, 90) == 92
+    assert merge_field("last_extraction_index", 3, 6, 9) == 9
+    # Sub-keys we changed win, the others keep the stored value
+    assert merge_field(
+        "emotional_state", {"warmth": 10, "pace": 10}, {"warmth": 15, "pace": 10}, {"warmth": 10, "pace": 12}
+    ) == {"warmth": 15, "pace": 12}
+    # Anything else: ours
+    assert merge_field("avatar_id", "1", "2", "3") == "2"
+
+
+def test_turn_is_merged_onto_a_concurrent_write(stored):
+    async def run():
+        memory = await memory_service.load_memory(USER_ID)
+        record_message(memory, "user", "hello")
+        memory["balance"] += 2
+        # Another device spends coins and adds a message meanwhile
+        assert await memory_service.patch_memory(USER_ID, {
+            "balance": 899, "history": [{"role": "user", "content": "from the phone"}]
+        })
+        return await memory_service.save_memory(USER_ID, memory)
+
+    assert asyncio.run(run())
+    data = stored.memories[USER_ID]
+    assert data["balance"] == 901
+    assert [m["content"] for m in data["history"]] == ["from the phone", "hello"]
+    assert data["user_message_count"] == 1
+    assert len(data["user_facts"]) == 1
+
+
+def test_turn_outlasts_more_conflicts_than_cas_retries(stored, monkeypatch):
+    monkeypatch.setattr(memory_module, "CAS_BACKOFF_SECONDS", 0)
+    conflicts = memory_service.cas_retries + 3
+    remaining = [conflicts]
+    patch = stored.patch_memory
+
+    async def contended(user_id, changes, expected_version=None):
+        remaining[0] -= 1
+        if remaining[0] >= 0:
+            # Someone else's fact extraction lands first
+            await patch(user_id, {"expired_facts_count": 0})
+        return await patch(user_id, changes, expected_version=expected_version)
+
+    monkeypatch.setattr(stored, "patch_memory", contended)
+
+    async def turn():
+        memory = await memory_service.load_memory(USER_ID)
+        record_message(memory, "user", "hello")
+        memory["balance"] += 2
+        return await memory_service.save_memory(USER_ID, memory)
+
+    before = memory_service.write_stats["conflicts"]
+    assert asyncio.run(turn())
+    assert stored.memories[USER_ID]["balance"] == 1001
+    assert stored.memories[USER_ID]["history"][-1]["content"] == "hello"
+    assert memory_service.write_stats["conflicts"] - before == conflicts
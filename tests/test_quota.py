@@ -0,0 +1,100 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from api.config import TIER_CONFIG
+from api.main import app
+from api.routes.deps import get_current_user
+from api.services.memory import default_memory, memory_service
+
+USER_ID = "00000000-0000-0000-0000-000000000003"
+
+
+async def take(account, times):
+    return [await memory_service.take_message_quota(USER_ID, account) for _ in range(times)]
+
+
+def test_paid_tier_messages_are_counted_not_limited(store, monkeypatch):
+    account = {"tier": 1, "time_offset": 0}
+
+    async def no_ledger(*args):
+        raise AssertionError("unlimited tiers make no ledger call before the reply")
+
+    with monkeypatch.context() as m:
+        m.setattr(store, "take_quota", no_ledger)
+        assert all(asyncio.run(take(account, 20)))
+
+    async def count(times):
+        for _ in range(times):
+            await memory_service.count_message(USER_ID, account)
+
+    asyncio.run(count(20))
+    # A failed turn of an unlimited tier was never counted, so there's nothing to refund
+    asyncio.run(memory_service.refund_message_quota(USER_ID, account))
+    assert asyncio.run(memory_service.messages_today(USER_ID, account)) == 20
+
+
+def test_free_tier_limit_and_refund(store):
+    account = {"tier": 0, "time_offset": 0}
+    limit = TIER_CONFIG[0]["message_limit"]
+
+    assert asyncio.run(take(account, limit + 1)) == [True] * limit + [False]
+    asyncio.run(memory_service.refund_message_quota(USER_ID, account))
+    assert asyncio.run(memory_service.messages_today(USER_ID, account)) == limit - 1
+
+
+def test_over_the_limit_turn_is_rejected_before_the_memory_load(store, monkeypatch):
+    account = {"tier": 0, "time_offset": 0}
+    asyncio.run(take(account, TIER_CONFIG[0]["message_limit"]))
+    asyncio.run(store.upsert_memory(USER_ID, default_memory()))
+
+    reads = []
+    get_memory = store.get_memory
+
+    async def counted(user_id):
+        reads.append(user_id)
+        return await get_memory(user_id)
+
+    monkeypatch.setattr(store, "get_memory", counted)
+    # Account fields cached (e.g. from an earlier turn), the memory blob not
+    memory_service._accounts.set(USER_ID, dict(account))
+    app.dependency_overrides[get_current_user] = lambda: {"id": USER_ID, "email": None, "role": "authenticated"}
+    try:
+        response = TestClient(app).post("/chat/message", json={"message": "hello"})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 403
+    assert reads == []
+    assert asyncio.run(memory_service.messages_today(USER_ID, account)) == TIER_CONFIG[0]["message_limit"]
+
+
+def test_cold_cache_over_the_limit_turn_reads_only_account_fields(store, monkeypatch):
+    account = {"tier": 0, "time_offset": 0}
+    asyncio.run(take(account, TIER_CONFIG[0]["message_limit"]))
+    asyncio.run(store.upsert_memory(USER_ID, default_memory()))
+
+    reads, projections = [], []
+    get_memory, get_memory_fields = store.get_memory, store.get_memory_fields
+
+    async def counted(user_id):
+        reads.append(user_id)
+        return await get_memory(user_id)
+
+    async def counted_fields(user_id, fields):
+        projections.append(fields)
+        return await get_memory_fields(user_id, fields)
+
+    monkeypatch.setattr(store, "get_memory", counted)
+    monkeypatch.setattr(store, "get_memory_fields", counted_fields)
+    app.dependency_overrides[get_current_user] = lambda: {"id": USER_ID, "email": None, "role": "authenticated"}
+    try:
+        client = TestClient(app)
+        assert client.post("/chat/message", json={"message": "hello"}).status_code == 403
+        # The account fields are cached now
+        assert client.post("/chat/message", json={"message": "hello"}).status_code == 403
+    finally:
+        app.dependency_overrides.clear()
+
+    assert reads == []
+    assert projections == [["tier", "time_offset"]]
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api.main import app
+from api.routes.deps import get_current_user
+from api.services import ratelimit
+from api.services.ratelimit import LocalBuckets, RateLimiter, SQLiteBuckets, rate_limiter, refill
+
+USER_ID = "00000000-0000-0000-0000-000000000018"
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_refill():
+    # 30/min: a token every 2s. A new bucket starts full
+    assert refill(None, 0.0, 0.0, 30) == (29.0, 0.0, 2.0)
+    # Empty: wait for the next token
+    assert refill(0.0, 0.0, 0.0, 30) == (0.0, 2.0, 60.0)
+    assert refill(0.5, 0.0, 0.0, 30) == (0.5, 1.0, 59.0)
+    # 10s later 5 tokens are back, one is taken
+    assert refill(0.0, 0.0, 10.0, 30) == (4.0, 0.0, 62.0)
+    # Never above the limit
+    assert refill(29.0, 0.0, 3600.0, 30) == (29.0, 0.0, 3602.0)
+
+
+def test_limit_for_tiers():
+    limiter = RateLimiter(backend=LocalBuckets())
+    limiter.default_limit = 30
+    assert limiter.limit_for(0) == 30
+    assert limiter.limit_for(1) == 60
+    assert limiter.limit_for(2) == 120
+    # Unknown tiers get the free tier's limit
+    assert limiter.limit_for(7) == 30
+
+    limiter.default_limit = 0
+    assert [limiter.limit_for(tier) for tier in (0, 1, 2)] == [0, 0, 0]
+
+
+def test_retry_after(store, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter, "backend", LocalBuckets(clock=clock))
+    monkeypatch.setattr(rate_limiter, "default_limit", 30)
+
+    async def drain():
+        return [await rate_limiter.check(USER_ID) for _ in range(30)]
+
+    assert asyncio.run(drain()) == [0.0] * 30
+
+    app.dependency_overrides[get_current_user] = lambda: {"id": USER_ID, "email": None, "role": "authenticated"}
+    try:
+        client = TestClient(app)
+        response = client.post("/chat/message", json={"message": "hello"})
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "2"
+
+        # 1.2s later 0.6 of a token is back: 0.8s to go, rounded up
+        clock.now += 1.2
+        response = client.post("/chat/message", json={"message": "hello"})
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "1"
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_local_buckets_drop_idle_buckets():
+    clock = Clock()
+    buckets = LocalBuckets(clock=clock)
+
+    async def run():
+        assert await buckets.take("a", 60) == 0.0
+        # "a" is full again after 1s, and dropped by the next check
+        clock.now += 2
+        assert await buckets.take("b", 60) == 0.0
+        assert buckets.stats() == {"buckets": 1, "max_buckets": 10000, "evictions": 1}
+        # Which changes nothing: it comes back full
+        for _ in range(60):
+            assert await buckets.take("a", 60) == 0.0
+        assert await buckets.take("a", 60) == pytest.approx(1.0)
+
+    asyncio.run(run())
+
+
+def test_local_buckets_evict_least_recently_used_on_overflow():
+    clock = Clock()
+    buckets = LocalBuckets(max_buckets=2, clock=clock)
+
+    async def run():
+        await buckets.take("a", 60)
+        await buckets.take("b", 60)
+        await buckets.take("a", 60)
+        await buckets.take("c", 60)
+        assert list(buckets._buckets) == ["a", "c"]
+        assert buckets.evictions == 1
+
+    asyncio.run(run())
+
+
+def test_sqlite_buckets_are_shared_across_connections(tmp_path, monkeypatch):
+    monkeypatch.setattr(ratelimit, "SQLITE_PRUNE_EVERY", 4)
+    clock = Clock()
+    path = str(tmp_path / "ratelimit.db")
+    first, second = SQLiteBuckets(path, clock=clock), SQLiteBuckets(path, clock=clock)
+
+    async def run():
+        # Two workers share a 2/min limit
+        assert await first.take(USER_ID, 2) == 0.0
+        assert await second.take(USER_ID, 2) == 0.0
+        assert await first.take(USER_ID, 2) == pytest.approx(30.0)
+        # 15s later half a token is back for both
+        clock.now += 15
+        assert await second.take(USER_ID, 2) == pytest.approx(15.0)
+
+        # Idle rows are pruned every SQLITE_PRUNE_EVERY checks per connection
+        await first.take("other", 2)
+        clock.now += 120
+        await first.take("third", 2)
+        assert first.stats() == {"pruned": 2}
+
+    try:
+        asyncio.run(run())
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,48 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from api.main import app
+from api.routes.deps import get_current_user
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+
+
+@pytest.fixture
+def client():
+    app.dependency_overrides[get_current_user] = lambda: {"id": USER_ID, "email": None, "role": "authenticated"}
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def test_spend_on_new_user_creates_the_row(store, client):
+    response = client.post("/user/spend/30")
+
+    assert response.status_code == 200
+    assert response.json()["new_balance"] == 70
+    data, version = store.memories[USER_ID], store.versions[USER_ID]
+    assert version == 1
+    assert data["balance"] == 70
+    # Created whole, not just the patched fields
+    assert data["emotional_state"]["closeness"] == 10
+    assert data["user_profile"]["companion_name"] == "Keepsake"
+
+
+def test_spend_then_avatar_on_new_user(store, client):
+    c = client
+
+    assert c.post("/user/spend/10").status_code == 200
+    assert c.post("/user/avatar/2").status_code == 200
+    assert c.post("/user/avatar/3").status_code == 403
+    assert store.memories[USER_ID]["balance"] == 90
+    assert store.memories[USER_ID]["avatar_id"] == "2"
+
+
+def test_spend_when_memory_cannot_be_read(store, client, monkeypatch):
+    async def unavailable(user_id):
+        raise TimeoutError("database timed out")
+
+    monkeypatch.setattr(store, "get_memory", unavailable)
+    response = client.post("/user/spend/10")
+
+    assert response.status_code == 409
+    assert USER_ID not in store.memories
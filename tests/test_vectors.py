@@ -0,0 +1,72 @@
+import asyncio
+import random
+
+from api.services.store import LocalStore
+from api.services.vectors import VectorIndex
+
+DIMS = 8
+
+
+def random_vectors(rng, n):
+    return [[rng.gauss(0.0, 1.0) for _ in range(DIMS)] for _ in range(n)]
+
+
+def test_local_search_matches_match_vectors():
+    rng = random.Random(1)
+    store = LocalStore()
+    asyncio.run(store.insert_vectors([("u", f"memory {i}", v) for i, v in enumerate(random_vectors(rng, 300))]))
+    index = VectorIndex(store, max_bytes=1 << 20, user_max_vectors=1000)
+
+    async def compare():
+        # A cold search goes to match_vectors while the user loads in the background
+        await index.search("u", random_vectors(rng, 1)[0], 0.2, 5)
+        assert index.counters["store_searches"] == 1
+        await index._load("u")
+        for query in random_vectors(rng, 20):
+            local = await index.search("u", query, 0.2, 5)
+            expected = await store.match_vectors("u", query, 0.2, 5)
+            assert [m["content"] for m in local] == [m["content"] for m in expected]
+            for a, b in zip(local, expected):
+                assert abs(a["similarity"] - b["similarity"]) < 1e-5
+        assert index.counters["local_searches"] == 20
+
+    asyncio.run(compare())
+
+
+def test_budget_counts_reserved_bytes_and_evicts_lru():
+    rng = random.Random(2)
+    store = LocalStore()
+    rows = []
+    for user in ("a", "b", "c"):
+        rows += [(user, f"{user} {i}", v) for i, v in enumerate(random_vectors(rng, 20))]
+    asyncio.run(store.insert_vectors(rows))
+    # 20 rows of 8 float32s: 640 bytes per user
+    index = VectorIndex(store, max_bytes=2000, user_max_vectors=1000)
+
+    async def load_all():
+        for user in ("a", "b", "c"):
+            await index._load(user)
+
+    asyncio.run(load_all())
+    assert index.stats()["bytes"] == 3 * 640
+    assert index.counters["evictions"] == 0
+
+    # One more row doubles c's matrix to 40 rows: the slack counts too,
+    # so the least recently used user is evicted
+    index.add("c", "c new", random_vectors(rng, 1)[0])
+    stats = index.stats()
+    assert stats["bytes"] == 640 + 1280
+    assert stats["vectors"] == 41
+    assert index.counters["evictions"] == 1
+    assert "a" not in index._users
+
+
+def test_users_over_the_budget_stay_on_match_vectors():
+    rng = random.Random(3)
+    store = LocalStore()
+    asyncio.run(store.insert_vectors([("big", f"m {i}", v) for i, v in enumerate(random_vectors(rng, 100))]))
+    index = VectorIndex(store, max_bytes=1024, user_max_vectors=1000)
+
+    asyncio.run(index._load("big"))
+    assert index._users["big"][0] is None
+    assert index.stats()["bytes"] == 0